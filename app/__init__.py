@@ -13,6 +13,8 @@ def create_app(config=None):
     template_dir = os.path.join(root_dir, 'templates')
     static_dir = os.path.join(root_dir, 'static')
     upload_dir = os.path.join(root_dir, 'uploads')
+    # Chunked uploads are assembled here, outside the served upload folder
+    staging_dir = os.path.join(root_dir, 'uploads_staging')
     
     flask_app = Flask(__name__, template_folder=template_dir, static_folder=static_dir)
     
@@ -29,10 +31,22 @@ def create_app(config=None):
         flask_app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = SQLALCHEMY_TRACK_MODIFICATIONS
         flask_app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
         flask_app.config['UPLOAD_FOLDER'] = upload_dir
+        flask_app.config['UPLOAD_STAGING_FOLDER'] = staging_dir
+    
+    # Engine/pool options and per-connection PRAGMAs for SQLite
+    from app.sqlite_profile import sqlite_engine_options, install_sqlite_profile
+    flask_app.config.setdefault(
+        'SQLALCHEMY_ENGINE_OPTIONS', sqlite_engine_options(flask_app.config.get('SQLALCHEMY_DATABASE_URI'))
+    )
     
     # Initialize extensions
     db.init_app(flask_app)
-    socketio.init_app(flask_app)
+    with flask_app.app_context():
+        install_sqlite_profile(db.engine)
+    socketio.init_app(flask_app, **_socketio_options())
+    # Let cache invalidations travel between workers over the Socket.IO queue
+    from app.pubsub import install_cluster_listener
+    install_cluster_listener(socketio.server)
     login_manager.init_app(flask_app)
 
     # Return JSON 401 for XHR/API requests when not authenticated
@@ -60,105 +74,68 @@ def create_app(config=None):
     
     # Import socket handlers
     import app.sockets  # noqa
+    from app.sockets.presence import init_presence, presence_of
+    init_presence(flask_app)
+    from app.sockets.message_writer import init_message_writer
+    init_message_writer(flask_app)
+    from app.functions import init_image_jobs, start_file_sweeper
+    init_image_jobs(flask_app)
+    start_file_sweeper(flask_app)
+    flask_app.jinja_env.globals['presence_of'] = presence_of
+    flask_app.jinja_env.globals['socketio_client_options'] = _socketio_client_options()
     
-    # Create database tables and seed if needed
+    # Create or upgrade the schema and seed if needed
+    from app.migrations import run_migrations
     with flask_app.app_context():
-        _init_database(flask_app)
+        run_migrations()
         _setup_admin_user()
     
     # Set up login manager
     @login_manager.user_loader
     def load_user(user_id):
-        from app.models import User
-        return User.query.get(int(user_id))
+        # Served from the per-worker user cache (app/functions/identity.py)
+        from app.functions import load_cached_user
+        return load_cached_user(user_id)
     
     return flask_app
 
-def _init_database(flask_app):
-    # Initialize database tables
-    from sqlalchemy import inspect, text
-    from app.models import (
-        User, Room, Channel, Member, Message, MessageReaction,
-        ReadMessage, StickerPack, Sticker, UserMusic
-    )
-    
-    db_file = 'thecomboxmsgr.db'
-    db_exists = os.path.exists(db_file)
-    
-    try:
-        if not db_exists:
-            print("База данных не найдена, создаем новую...")
-        db.create_all()
-        if not db_exists:
-            print("База данных успешно создана!")
-    except Exception as e:
-        print(f"Ошибка при создании таблиц БД: {e}")
-        try:
-            if db_exists:
-                print("Пробуем пересоздать базу данных...")
-            db.drop_all()
-            db.create_all()
-            print("База данных пересоздана!")
-        except Exception as e2:
-            print(f"Критическая ошибка при создании БД: {e2}")
-            import traceback
-            traceback.print_exc()
-    
-    # Update schema
-    try:
-        inspector = inspect(db.engine)
-        tables = inspector.get_table_names()
-        
-        # Update message table
-        if 'message' in tables:
-            columns = [col['name'] for col in inspector.get_columns('message')]
-            if 'edited_at' not in columns:
-                try:
-                    with db.engine.connect() as conn:
-                        conn.execute(text('ALTER TABLE message ADD COLUMN edited_at DATETIME'))
-                        conn.commit()
-                except:
-                    pass
-        
-        # Create new tables if needed
-        for table_class in [MessageReaction, ReadMessage, StickerPack, Sticker]:
-            table_name = table_class.__tablename__
-            if table_name not in tables:
-                try:
-                    table_class.__table__.create(db.engine)
-                except:
-                    pass
-        
-        # Add invite_token column if missing
-        if 'room' in tables:
-            columns = [col['name'] for col in inspector.get_columns('room')]
-            if 'invite_token' not in columns:
-                try:
-                    with db.engine.connect() as conn:
-                        conn.execute(text('ALTER TABLE room ADD COLUMN invite_token VARCHAR(100)'))
-                        conn.commit()
-                except:
-                    pass
-    
-    except Exception as e:
-        print(f"Ошибка при обновлении схемы БД: {e}")
-        try:
-            db.drop_all()
-            db.create_all()
-        except Exception as e2:
-            print(f"Критическая ошибка при пересоздании БД: {e2}")
+def _socketio_options():
+    # Socket.IO server options: message queue for multi-worker setups and allowed transports
+    from config import SOCKETIO_MESSAGE_QUEUE, SOCKETIO_CHANNEL, SOCKETIO_WEBSOCKET_ONLY
+    from app.pubsub import create_client_manager
+
+    options = {}
+    if SOCKETIO_MESSAGE_QUEUE:
+        manager = create_client_manager(SOCKETIO_MESSAGE_QUEUE, channel=SOCKETIO_CHANNEL)
+        if manager is not None:
+            options['client_manager'] = manager
+        else:
+            options['message_queue'] = SOCKETIO_MESSAGE_QUEUE
+            options['channel'] = SOCKETIO_CHANNEL
+        print(f"[SERVER CONFIG] Socket.IO message queue: {SOCKETIO_MESSAGE_QUEUE}")
+    if SOCKETIO_WEBSOCKET_ONLY:
+        options['transports'] = ['websocket']
+    return options
+
+
+def _socketio_client_options():
+    # Options for `io()` in templates; must match the server transports
+    from config import SOCKETIO_WEBSOCKET_ONLY
+    if SOCKETIO_WEBSOCKET_ONLY:
+        return {'transports': ['websocket']}
+    return {}
 
 
 def _setup_admin_user():
     # Create admin user if it doesn't exist
     from app.models import User
-    from werkzeug.security import generate_password_hash
+    from app.functions import hash_password
     
     try:
         if not User.query.filter_by(username='admin').first():
             admin = User(
                 username='admin',
-                password=generate_password_hash('Fynjif121%', method='scrypt'),
+                password=hash_password('Fynjif121%'),
                 is_superuser=True
             )
             db.session.add(admin)
@@ -0,0 +1,175 @@
+# Upload storage backends
+# Uploaded files are addressed by keys, '/'-separated paths relative to the upload root that map
+# 1:1 to URLs: key 'files/ab/cd/abcd...ef.png' is served as /uploads/files/ab/cd/abcd...ef.png.
+# Content-addressed files are spread over two levels of hash-prefix directories (shard_key), so no
+# directory grows past a few thousand entries however many files are stored.
+# `UPLOAD_STORAGE` selects the backend:
+#   local          files under the upload folder (default)
+# Backends take local files to store (uploads are spooled and hashed on local disk first).
+
+import os
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from flask import send_from_directory, abort
+from config import UPLOAD_STORAGE
+
+# Hash-prefix directory levels and characters per level ('ab/cd/')
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+
+
+def shard_key(subfolder, digest, ext):
+    # Key of a content-addressed file: <subfolder>/<ab>/<cd>/<digest>.<ext>
+    shards = [digest[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_LEVELS)]
+    name = f"{digest}.{ext}" if ext else digest
+    return '/'.join([subfolder] + shards + [name])
+
+
+def url_key(url):
+    # Key of an /uploads/ URL, or None for other URLs
+    if not url or not url.startswith('/uploads/'):
+        return None
+    key = url[len('/uploads/'):]
+    return key or None
+
+
+def key_url(key):
+    return '/uploads/' + key
+
+
+class StorageBackend(ABC):
+    # Interface of upload storage backends (a backend missing a method cannot be instantiated)
+
+    def path(self, key):
+        # Local filesystem path of a key, or None when the backend keeps no local files
+        return None
+
+    @abstractmethod
+    def exists(self, key):
+        raise NotImplementedError
+
+    @abstractmethod
+    def size(self, key):
+        # Size in bytes, or None when the key does not exist
+        raise NotImplementedError
+
+    @abstractmethod
+    def put(self, path, key, move=True):
+        # Store the local file `path` under `key` (kept as is if the key exists); with move=False
+        # the local file is left in place
+        raise NotImplementedError
+
+    @abstractmethod
+    def copy(self, src_key, dst_key):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, key):
+        # Remove a key; missing keys are ignored
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_dir(self, prefix):
+        # (name, is_dir) of the entries directly under a key prefix ('' for the root)
+        raise NotImplementedError
+
+    @abstractmethod
+    def serve(self, key, max_age=None):
+        # Flask response sending the file (404 when missing)
+        raise NotImplementedError
+
+    def incoming_folder(self):
+        # Local scratch folder where uploads are spooled and hashed before put()
+        return os.path.join(tempfile.gettempdir(), 'boxchat-incoming')
+
+
+class LocalStorage(StorageBackend):
+    # Files under a local directory
+    name = 'local'
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def path(self, key):
+        # Filesystem path of a key; rejects keys escaping the root or naming hidden entries
+        parts = [part for part in (key or '').split('/') if part]
+        if any(part.startswith('.') or '\\' in part for part in parts):
+            return None
+        path = os.path.join(self.root, *parts)
+        return path if parts and os.path.abspath(path).startswith(self.root + os.sep) else None
+
+    def exists(self, key):
+        path = self.path(key)
+        return bool(path) and os.path.isfile(path)
+
+    def size(self, key):
+        path = self.path(key)
+        try:
+            return os.path.getsize(path) if path else None
+        except OSError:
+            return None
+
+    def put(self, path, key, move=True):
+        target = self.path(key)
+        if target is None:
+            raise ValueError(f'invalid storage key {key!r}')
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            if move:
+                os.remove(path)
+        elif move:
+            try:
+                os.replace(path, target)
+            except OSError:
+                # Source on another filesystem
+                shutil.move(path, target)
+        else:
+            try:
+                os.link(path, target)
+            except OSError:
+                shutil.copy2(path, target)
+
+    def copy(self, src_key, dst_key):
+        self.put(self.path(src_key), dst_key, move=False)
+
+    def delete(self, key):
+        path = self.path(key)
+        try:
+            if path and os.path.isfile(path):
+                os.remove(path)
+        except OSError as e:
+            print(f"[STORAGE] Cannot remove {path}: {e}")
+
+    def list_dir(self, prefix):
+        folder = self.path(prefix) if prefix else self.root
+        if not folder or not os.path.isdir(folder):
+            return []
+        with os.scandir(folder) as entries:
+            return [(entry.name, entry.is_dir()) for entry in entries if not entry.name.startswith('.')]
+
+    def serve(self, key, max_age=None):
+        if self.path(key) is None:
+            abort(404)
+        return send_from_directory(self.root, key, max_age=max_age)
+
+    def incoming_folder(self):
+        # Scratch folder for spooling uploads, on the same filesystem so stores are atomic renames
+        return os.path.join(self.root, '.incoming')
+
+
+_backends = {}
+
+
+def get_storage(upload_folder, url=None):
+    # Storage backend for the upload folder (one instance per folder and backend)
+    url = (UPLOAD_STORAGE if url is None else url) or 'local'
+    key = (url, os.path.abspath(upload_folder))
+    backend = _backends.get(key)
+    if backend is None:
+        if url == 'local':
+            backend = LocalStorage(upload_folder)
+        else:
+            raise ValueError(f'Unknown UPLOAD_STORAGE {url!r}')
+        _backends[key] = backend
+    return backend
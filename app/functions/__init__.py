@@ -1,11 +1,66 @@
 # Functions package
 
+from app.functions.storage import (
+    FILE_REFERENCES, file_extension, stored_url, is_stored_url, hash_file, spool_to_disk,
+    store_file, record_upload, find_upload, discard_upload, rebuild_file_references, sweep_unreferenced_files,
+    start_file_sweeper
+)
 from app.functions.files import (
     allowed_file, is_image_file, is_music_file, is_video_file,
-    save_uploaded_file, resize_image
+    upload_subfolder, clean_filename, describe_file, save_uploaded_file
+)
+from app.functions.images import IMAGE_KINDS, init_image_jobs, queue_image_job, image_pool_stats
+from app.functions.uploads import (
+    UploadError, start_upload, upload_status, write_chunk, finish_upload, cancel_upload, prune_stale_uploads
+)
+from app.functions.unread import (
+    increment_unread, reset_unread, get_unread_counts, get_room_unread_counts, get_channel_unread_counts,
+    discount_unread, rebuild_unread
+)
+from app.functions.conversations import (
+    load_dm_list, get_dm_list, invalidate_dm_list, invalidate_dm_room
+)
+from app.functions.reactions import (
+    load_reactions, toggle_reaction, reaction_delta, delete_message_reactions, rebuild_reaction_counts
+)
+from app.functions.messages import (
+    clamp_page_size, load_message_page, load_messages_around, attach_message_extras, serialize_message,
+    log_message_change, log_bulk_deletion, current_sync_token, load_changes_since
+)
+from app.functions.search import search_available, build_match_query, search_messages
+from app.functions.directory import find_users, find_rooms
+from app.functions.bans import (
+    is_ip_banned, add_ip_ban, remove_user_ip_bans, invalidate_ip_bans, list_ip_bans, normalize_network
+)
+from app.functions.passwords import hash_password, verify_password, password_pool_stats, PasswordPoolBusy
+from app.functions.throttle import check_login_rate, login_throttle_stats
+from app.functions.identity import (
+    load_cached_user, get_user_identity, socket_identity, invalidate_user
+)
+from app.functions.access import (
+    load_room_access, get_room_access, get_member_role, get_channel_room, invalidate_room_access
 )
 
 __all__ = [
+    'FILE_REFERENCES', 'file_extension', 'stored_url', 'is_stored_url', 'hash_file', 'spool_to_disk',
+    'store_file', 'record_upload', 'find_upload', 'discard_upload', 'rebuild_file_references',
+    'sweep_unreferenced_files', 'start_file_sweeper',
     'allowed_file', 'is_image_file', 'is_music_file', 'is_video_file',
-    'save_uploaded_file', 'resize_image'
+    'upload_subfolder', 'clean_filename', 'describe_file', 'save_uploaded_file',
+    'IMAGE_KINDS', 'init_image_jobs', 'queue_image_job', 'image_pool_stats',
+    'UploadError', 'start_upload', 'upload_status', 'write_chunk', 'finish_upload', 'cancel_upload',
+    'prune_stale_uploads',
+    'increment_unread', 'reset_unread', 'get_unread_counts', 'get_room_unread_counts', 'get_channel_unread_counts',
+    'discount_unread', 'rebuild_unread',
+    'load_dm_list', 'get_dm_list', 'invalidate_dm_list', 'invalidate_dm_room',
+    'load_reactions', 'toggle_reaction', 'reaction_delta', 'delete_message_reactions', 'rebuild_reaction_counts',
+    'clamp_page_size', 'load_message_page', 'load_messages_around', 'attach_message_extras', 'serialize_message',
+    'log_message_change', 'log_bulk_deletion', 'current_sync_token', 'load_changes_since',
+    'search_available', 'build_match_query', 'search_messages',
+    'find_users', 'find_rooms',
+    'is_ip_banned', 'add_ip_ban', 'remove_user_ip_bans', 'invalidate_ip_bans', 'list_ip_bans', 'normalize_network',
+    'hash_password', 'verify_password', 'password_pool_stats', 'PasswordPoolBusy',
+    'check_login_rate', 'login_throttle_stats',
+    'load_cached_user', 'get_user_identity', 'socket_identity', 'invalidate_user',
+    'load_room_access', 'get_room_access', 'get_member_role', 'get_channel_room', 'invalidate_room_access'
 ]
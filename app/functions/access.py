@@ -0,0 +1,204 @@
+# Room access cache functions
+# Membership, role and ban per (user, room), cached per worker and dropped everywhere on commit
+
+import operator
+import threading
+import time
+from sqlalchemy import event, and_, inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter
+from app.extensions import db, socketio
+from app.models import Room, Channel, Member, RoomBan
+from app.pubsub import on_cluster_event, publish_cluster_event
+from config import MEMBERSHIP_CACHE_SECONDS
+
+_lock = threading.Lock()
+_access = {}    # (user_id, room_id) -> (expires_at, access dict or None)
+_channels = {}  # channel_id -> (expires_at, room_id or None)
+_generation = 0  # bumped by every invalidation; loads that raced with one are not cached
+
+# Entries kept before expired ones are swept out
+ACCESS_CACHE_MAX_ENTRIES = 200000
+_CLUSTER_EVENT = 'access_invalidate'
+_STALE_KEY = 'stale_room_access'
+_ACCESS_MODELS = (Member, RoomBan, Room, Channel)
+
+
+def _store(cache, key, value, now, generation):
+    with _lock:
+        if generation != _generation:
+            return
+        if len(cache) >= ACCESS_CACHE_MAX_ENTRIES:
+            for stale in [k for k, e in cache.items() if e[0] <= now]:
+                del cache[stale]
+        cache[key] = (now + MEMBERSHIP_CACHE_SECONDS, value)
+
+
+def load_room_access(user_id, room_id):
+    # Access of a user to a room straight from the database, None when the room does not exist
+    row = db.session.query(Room.type, Room.is_public, Room.owner_id, Member.role, RoomBan.id).outerjoin(
+        Member, and_(Member.room_id == Room.id, Member.user_id == user_id)
+    ).outerjoin(
+        RoomBan, and_(RoomBan.room_id == Room.id, RoomBan.user_id == user_id)
+    ).filter(Room.id == room_id).first()
+    if row is None:
+        return None
+    room_type, is_public, owner_id, role, ban_id = row
+    return {
+        'room_type': room_type,
+        'is_public': bool(is_public),
+        'owner_id': owner_id,
+        'role': role,
+        'banned': ban_id is not None
+    }
+
+
+def get_room_access(user_id, room_id):
+    # Cached {room_type, is_public, owner_id, role, banned} of a user in a room
+    # role is None for non-members; returns None when the room does not exist
+    try:
+        key = (int(user_id), int(room_id))
+    except (TypeError, ValueError):
+        return None
+    now = time.monotonic()
+    with _lock:
+        entry = _access.get(key)
+        generation = _generation
+    if entry is not None and entry[0] > now:
+        return entry[1]
+    access = load_room_access(*key)
+    _store(_access, key, access, now, generation)
+    return access
+
+
+def get_member_role(user_id, room_id):
+    # Role of a user in a room, or None when not a member
+    access = get_room_access(user_id, room_id)
+    return access['role'] if access else None
+
+
+def get_channel_room(channel_id):
+    # Room id of a channel (cached), or None when the channel does not exist
+    try:
+        channel_id = int(channel_id)
+    except (TypeError, ValueError):
+        return None
+    now = time.monotonic()
+    with _lock:
+        entry = _channels.get(channel_id)
+        generation = _generation
+    if entry is not None and entry[0] > now:
+        return entry[1]
+    row = db.session.query(Channel.room_id).filter(Channel.id == channel_id).first()
+    room_id = row[0] if row else None
+    _store(_channels, channel_id, room_id, now, generation)
+    return room_id
+
+
+def _apply_invalidation(payload):
+    # Drop cached entries named by an invalidation payload (runs in every worker)
+    global _generation
+    payload = payload or {}
+    with _lock:
+        _generation += 1
+        if payload.get('all'):
+            _access.clear()
+            _channels.clear()
+            return
+        for user_id, room_id in payload.get('keys', ()):
+            _access.pop((user_id, room_id), None)
+        rooms = set(payload.get('rooms', ()))
+        users = set(payload.get('users', ()))
+        if rooms or users:
+            for key in [k for k in _access if k[1] in rooms or k[0] in users]:
+                del _access[key]
+        for channel_id in payload.get('channels', ()):
+            _channels.pop(channel_id, None)
+
+
+def invalidate_room_access(keys=(), rooms=(), users=(), channels=(), everything=False):
+    # Drop cached access in every worker: (user_id, room_id) pairs, whole rooms or users, channels,
+    # or everything
+    payload = {
+        'keys': [list(key) for key in keys],
+        'rooms': list(rooms),
+        'users': list(users),
+        'channels': list(channels),
+        'all': everything
+    }
+    publish_cluster_event(socketio.server, _CLUSTER_EVENT, payload)
+
+
+on_cluster_event(_CLUSTER_EVENT, _apply_invalidation)
+
+
+def _pending(db_session):
+    return db_session.info.setdefault(
+        _STALE_KEY, {'keys': set(), 'rooms': set(), 'users': set(), 'channels': set(), 'all': False}
+    )
+
+
+def _bulk_scope(statement):
+    # ('rooms' | 'users', id) for a statement filtered on a single room_id or user_id, else None
+    clause = getattr(statement, 'whereclause', None)
+    if not isinstance(clause, BinaryExpression) or clause.operator is not operator.eq:
+        return None
+    if not isinstance(clause.right, BindParameter):
+        return None
+    name = getattr(clause.left, 'key', None)
+    if name == 'room_id':
+        return 'rooms', clause.right.effective_value
+    if name == 'user_id':
+        return 'users', clause.right.effective_value
+    return None
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_access_changes(db_session, flush_context):
+    # Remember the access entries touched by this flush; they are dropped after the commit
+    changed = [obj for obj in list(db_session.new) + list(db_session.dirty) + list(db_session.deleted)
+               if isinstance(obj, _ACCESS_MODELS)]
+    if not changed:
+        return
+    pending = _pending(db_session)
+    for obj in changed:
+        # Read loaded values only: rows deleted in this flush can't be refreshed
+        values = inspect(obj).dict
+        if isinstance(obj, (Member, RoomBan)):
+            if values.get('user_id') is None or values.get('room_id') is None:
+                pending['all'] = True
+            else:
+                pending['keys'].add((values['user_id'], values['room_id']))
+        elif isinstance(obj, Room):
+            pending['rooms'].add(values.get('id'))
+        else:
+            pending['channels'].add(values.get('id'))
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_access_changes(orm_execute_state):
+    # Bulk UPDATE/DELETE on access tables: drop the room or user it is filtered on, else everything
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or not issubclass(mapper.class_, _ACCESS_MODELS):
+        return
+    pending = _pending(orm_execute_state.session)
+    scope = _bulk_scope(orm_execute_state.statement) if issubclass(mapper.class_, (Member, RoomBan)) else None
+    if scope is None:
+        pending['all'] = True
+    else:
+        pending[scope[0]].add(scope[1])
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_access_changes(db_session):
+    pending = db_session.info.pop(_STALE_KEY, None)
+    if pending:
+        invalidate_room_access(pending['keys'], pending['rooms'], pending['users'], pending['channels'],
+                               pending['all'])
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_access_changes(db_session):
+    db_session.info.pop(_STALE_KEY, None)
@@ -0,0 +1,155 @@
+# IP ban functions
+# Bans live in the `banned_ip` table as canonical CIDR networks (single addresses are /32 or /128).
+# Logins check an in-memory index instead of the database: a hash set of banned addresses plus one
+# set of masked network ids per distinct prefix length, so a lookup costs one set probe per prefix
+# length in use. The index is rebuilt lazily after ban/unban in this process, and at least every
+# IP_BAN_REFRESH_SECONDS so bans made by other workers are picked up.
+
+import ipaddress
+import threading
+import time
+from app.extensions import db
+from app.models import BannedIP, User
+from config import IP_BAN_REFRESH_SECONDS, IP_BAN_PAGE_SIZE
+
+_lock = threading.Lock()
+_index = None
+_loaded_at = 0.0
+
+
+class IPBanIndex:
+    # Exact-address and CIDR lookup over a set of networks
+    def __init__(self, networks=()):
+        self.exact = {4: set(), 6: set()}
+        self.ranges = {4: {}, 6: {}}  # version -> {prefixlen: set of network ints}
+        self.size = 0
+        for network in networks:
+            self.add(network)
+
+    def add(self, network):
+        network = ipaddress.ip_network(network, strict=False)
+        if network.prefixlen == network.max_prefixlen:
+            self.exact[network.version].add(int(network.network_address))
+        else:
+            self.ranges[network.version].setdefault(network.prefixlen, set()).add(int(network.network_address))
+        self.size += 1
+
+    def contains(self, ip):
+        address = parse_ip(ip)
+        if address is None:
+            return False
+        value = int(address)
+        if value in self.exact[address.version]:
+            return True
+        bits = address.max_prefixlen
+        for prefixlen, networks in self.ranges[address.version].items():
+            mask = ((1 << prefixlen) - 1) << (bits - prefixlen)
+            if value & mask in networks:
+                return True
+        return False
+
+
+def parse_ip(ip):
+    # ip_address for a client address string (IPv4-mapped IPv6 becomes IPv4), None when invalid
+    try:
+        address = ipaddress.ip_address((ip or '').strip())
+    except ValueError:
+        return None
+    if address.version == 6 and address.ipv4_mapped:
+        return address.ipv4_mapped
+    return address
+
+
+def normalize_network(value):
+    # Canonical CIDR string for an address or network; raises ValueError when invalid
+    network = ipaddress.ip_network((value or '').strip(), strict=False)
+    if network.version == 6 and network.network_address.ipv4_mapped and network.prefixlen >= 96:
+        network = ipaddress.ip_network(
+            f"{network.network_address.ipv4_mapped}/{network.prefixlen - 96}", strict=False
+        )
+    return network.with_prefixlen
+
+
+def display_network(network):
+    # Single addresses are shown without their /32 or /128 suffix
+    parsed = ipaddress.ip_network(network, strict=False)
+    if parsed.prefixlen == parsed.max_prefixlen:
+        return str(parsed.network_address)
+    return parsed.with_prefixlen
+
+
+def load_ip_ban_index():
+    # Build a fresh index from the banned_ip table
+    networks = [network for (network,) in db.session.query(BannedIP.network).all()]
+    return IPBanIndex(networks)
+
+
+def get_ip_ban_index():
+    # Current index, rebuilt when invalidated or older than IP_BAN_REFRESH_SECONDS
+    global _index, _loaded_at
+    now = time.monotonic()
+    with _lock:
+        index = _index
+        fresh = index is not None and now - _loaded_at < IP_BAN_REFRESH_SECONDS
+    if fresh:
+        return index
+    index = load_ip_ban_index()
+    with _lock:
+        _index = index
+        _loaded_at = now
+    return index
+
+
+def invalidate_ip_bans():
+    # Rebuild the index on the next lookup (call after committing a ban or unban)
+    global _index
+    with _lock:
+        _index = None
+
+
+def is_ip_banned(ip):
+    # True when `ip` matches a banned address or range
+    if not ip:
+        return False
+    return get_ip_ban_index().contains(ip)
+
+
+def add_ip_ban(value, user_id=None, reason=None, banned_by_id=None):
+    # Ban an address or CIDR range; returns the BannedIP row (existing one if already banned)
+    # Raises ValueError for invalid input; caller commits and then calls invalidate_ip_bans()
+    network = normalize_network(value)
+    existing = BannedIP.query.filter_by(network=network, user_id=user_id).first()
+    if existing:
+        return existing
+    ban = BannedIP(network=network, user_id=user_id, reason=reason, banned_by_id=banned_by_id)
+    db.session.add(ban)
+    return ban
+
+
+def remove_user_ip_bans(user_id):
+    # Lift every IP ban tied to a user; caller commits and then calls invalidate_ip_bans()
+    return BannedIP.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+
+
+def list_ip_bans(after_id=None, limit=None):
+    # One page of IP bans ordered by id, with the banned user
+    # Returns (items, next_after_id); next_after_id is None on the last page
+    try:
+        limit = max(1, min(int(limit), 500))
+    except (TypeError, ValueError):
+        limit = IP_BAN_PAGE_SIZE
+    query = db.session.query(BannedIP, User).outerjoin(User, User.id == BannedIP.user_id)
+    if after_id:
+        query = query.filter(BannedIP.id > after_id)
+    rows = query.order_by(BannedIP.id.asc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    items = [{
+        'id': ban.id,
+        'ip': display_network(ban.network),
+        'user_id': ban.user_id,
+        'username': user.username if user else None,
+        'reason': ban.reason,
+        'banned_at': ban.banned_at.isoformat() if ban.banned_at else None
+    } for ban, user in rows]
+    return items, (rows[-1][0].id if has_more else None)
@@ -0,0 +1,123 @@
+# DM list (conversation index) functions
+# The dashboard's DM list is built by one aggregated query: other participant, unread counter and
+# last message per DM, newest activity first. Results are cached per user for DM_LIST_CACHE_SECONDS
+# and invalidated by the write paths (new/edited/deleted DM messages, reads, DM create/delete).
+# The cache is per process; with several workers the TTL bounds how stale another worker can be.
+
+import threading
+import time
+from sqlalchemy import select, func, and_
+from sqlalchemy.orm import aliased
+from app.extensions import db
+from app.models import Room, Channel, Member, Message, User, UnreadCounter
+from config import DM_LIST_CACHE_SECONDS
+
+_lock = threading.Lock()
+_cache = {}        # user_id -> (expires_at, items)
+_generation = 0    # bumped on every invalidation so in-flight loads don't store stale results
+
+
+def _snippet(content, message_type, file_name):
+    # One-line preview of a message
+    if message_type and message_type != 'text':
+        return file_name or f"[{message_type}]"
+    return (content or '').strip().split('\n')[0][:80]
+
+
+def load_dm_list(user_id):
+    # Build the user's DM list in a single query, sorted by most recent message
+    me = aliased(Member)
+    other = aliased(Member)
+    newer = aliased(Message)
+
+    first_channel = select(func.min(Channel.id)).where(
+        Channel.room_id == Room.id
+    ).correlate(Room).scalar_subquery()
+    other_user = select(other.user_id).where(
+        other.room_id == Room.id,
+        other.user_id != user_id
+    ).order_by(other.id.asc()).limit(1).correlate(Room).scalar_subquery()
+    dms = select(
+        Room.id.label('room_id'),
+        first_channel.label('channel_id'),
+        other_user.label('other_user_id')
+    ).join(me, and_(me.room_id == Room.id, me.user_id == user_id)).where(
+        Room.type == 'dm'
+    ).subquery()
+
+    last_message_id = select(func.max(newer.id)).where(
+        newer.channel_id == dms.c.channel_id
+    ).correlate(dms).scalar_subquery()
+    rows = db.session.execute(
+        select(
+            dms.c.room_id, dms.c.channel_id,
+            User.id, User.username, User.avatar_url, User.presence_status,
+            UnreadCounter.count,
+            Message.id, Message.user_id, Message.content, Message.timestamp,
+            Message.message_type, Message.file_name
+        ).select_from(dms).outerjoin(
+            User, User.id == dms.c.other_user_id
+        ).outerjoin(
+            UnreadCounter, and_(UnreadCounter.channel_id == dms.c.channel_id, UnreadCounter.user_id == user_id)
+        ).outerjoin(
+            Message, Message.id == last_message_id
+        ).order_by(
+            func.coalesce(Message.id, 0).desc(), dms.c.room_id.desc()
+        )
+    ).all()
+
+    items = []
+    for (room_id, channel_id, other_id, username, avatar_url, presence_status, unread,
+         message_id, sender_id, content, timestamp, message_type, file_name) in rows:
+        items.append({
+            'room_id': room_id,
+            'channel_id': channel_id,
+            'other_user': {
+                'id': other_id,
+                'username': username,
+                'avatar_url': avatar_url,
+                'presence_status': presence_status or 'offline'
+            } if other_id else None,
+            'unread_count': unread or 0,
+            'last_message': {
+                'id': message_id,
+                'user_id': sender_id,
+                'snippet': _snippet(content, message_type, file_name),
+                'timestamp_iso': timestamp.strftime('%Y-%m-%dT%H:%M:%SZ') if timestamp else None
+            } if message_id else None
+        })
+    return items
+
+
+def get_dm_list(user_id):
+    # Cached DM list of a user (see load_dm_list)
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(user_id)
+        generation = _generation
+    if entry and entry[0] > now:
+        return entry[1]
+    items = load_dm_list(user_id)
+    with _lock:
+        if generation == _generation:
+            _cache[user_id] = (now + DM_LIST_CACHE_SECONDS, items)
+    return items
+
+
+def invalidate_dm_list(*user_ids):
+    # Drop cached DM lists of the given users (all users when called without arguments)
+    global _generation
+    with _lock:
+        _generation += 1
+        if not user_ids:
+            _cache.clear()
+        for user_id in user_ids:
+            _cache.pop(user_id, None)
+
+
+def invalidate_dm_room(room):
+    # Drop cached DM lists of every member of a DM room (no-op for other room types)
+    if room is None or room.type != 'dm':
+        return
+    user_ids = [uid for (uid,) in db.session.query(Member.user_id).filter_by(room_id=room.id).all()]
+    invalidate_dm_list(*user_ids)
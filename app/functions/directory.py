@@ -0,0 +1,98 @@
+# User and room name search functions
+# Candidates come from two index lookups instead of a LIKE scan: a range scan of the lower(name)
+# index for prefix matches, and the trigram FTS5 index (see app/models/search.py) for substring
+# matches of 3+ characters. Each lookup is capped at NAME_SEARCH_CANDIDATES rows, so typeahead cost
+# stays flat as the tables grow. Results are ranked exact > prefix > substring, then rooms by
+# member count, then shorter names first.
+
+from sqlalchemy import select, func, table, column, literal_column
+from app.extensions import db
+from app.models import User, Room, Member, USER_NAME_FTS_TABLE, ROOM_NAME_FTS_TABLE
+from config import NAME_SEARCH_LIMIT, NAME_SEARCH_CANDIDATES
+
+# Upper bound for a prefix range: sorts after any character that can follow the prefix
+_PREFIX_END = '\U0010ffff'
+# Trigram indexes need at least one full trigram
+_SUBSTRING_MIN_LENGTH = 3
+
+
+def _clamp_limit(limit):
+    try:
+        return max(1, min(int(limit), NAME_SEARCH_CANDIDATES))
+    except (TypeError, ValueError):
+        return NAME_SEARCH_LIMIT
+
+
+def _phrase(query):
+    # Quote a query as one FTS5 phrase (a substring match with the trigram tokenizer)
+    return '"' + query.replace('"', '""') + '"'
+
+
+def match_tier(name, query):
+    # 0 = exact, 1 = prefix, 2 = substring (case-insensitive)
+    name = (name or '').casefold()
+    if name == query:
+        return 0
+    if name.startswith(query):
+        return 1
+    return 2
+
+
+def _candidates(model, name_column, fts_table, query, filters, needed):
+    # (id, name) of rows whose `name_column` starts with or contains `query`
+    # Substring matches always rank below prefix matches, so they are only looked up when the prefix
+    # scan found fewer than `needed` rows
+    lowered = func.lower(name_column)
+    rows = db.session.execute(
+        select(model.id, name_column).where(
+            lowered >= query, lowered < query + _PREFIX_END, *filters
+        ).order_by(lowered).limit(NAME_SEARCH_CANDIDATES)
+    ).all()
+    if len(rows) < needed and len(query) >= _SUBSTRING_MIN_LENGTH and db.engine.dialect.name == 'sqlite':
+        fts = table(fts_table, column('rowid'))
+        rows += db.session.execute(
+            select(model.id, name_column).select_from(fts).join(model, model.id == fts.c.rowid).where(
+                literal_column(fts_table).op('MATCH')(_phrase(query)), *filters
+            ).limit(NAME_SEARCH_CANDIDATES)
+        ).all()
+    return list(dict(rows).items())
+
+
+def _load_in_order(model, ids):
+    # Load rows by id, keeping the order of `ids`
+    by_id = {obj.id: obj for obj in model.query.filter(model.id.in_(ids)).all()}
+    return [by_id[i] for i in ids if i in by_id]
+
+
+def find_users(query, limit=None):
+    # Searchable users whose username matches `query`, best matches first
+    query = (query or '').strip().casefold()
+    if not query:
+        return []
+    limit = _clamp_limit(limit)
+    rows = _candidates(User, User.username, USER_NAME_FTS_TABLE, query, [User.privacy_searchable == True], limit)
+    rows.sort(key=lambda r: (match_tier(r[1], query), len(r[1]), r[1].casefold()))
+    return _load_in_order(User, [user_id for user_id, _ in rows[:limit]])
+
+
+def find_rooms(query, limit=None):
+    # Public non-DM rooms whose name matches `query`, best matches and most popular first
+    # Sets `member_count` on each returned room
+    query = (query or '').strip().casefold()
+    if not query:
+        return []
+    limit = _clamp_limit(limit)
+    filters = [Room.type != 'dm', Room.is_public == True]
+    rows = _candidates(Room, Room.name, ROOM_NAME_FTS_TABLE, query, filters, limit)
+    if not rows:
+        return []
+    counts = dict(db.session.query(Member.room_id, func.count(Member.id)).filter(
+        Member.room_id.in_([room_id for room_id, _ in rows])
+    ).group_by(Member.room_id).all())
+    rows.sort(key=lambda r: (
+        match_tier(r[1], query), -counts.get(r[0], 0), len(r[1] or ''), (r[1] or '').casefold()
+    ))
+    rooms = _load_in_order(Room, [room_id for room_id, _ in rows[:limit]])
+    for room in rooms:
+        room.member_count = counts.get(room.id, 0)
+    return rooms
@@ -1,10 +1,11 @@
 
 # File handling functions
 
+import mimetypes
 import os
-import uuid
-from werkzeug.utils import secure_filename
 from PIL import Image
+from app.file_storage import get_storage
+from app.functions.storage import spool_to_disk, store_file, record_upload, file_extension
 from config import ALLOWED_EXTENSIONS, IMAGE_EXTENSIONS, MUSIC_EXTENSIONS, VIDEO_EXTENSIONS
 
 
@@ -28,51 +29,58 @@ def is_video_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in VIDEO_EXTENSIONS
 
 
-def save_uploaded_file(file, subfolder='files', upload_folder='uploads'):
+def upload_subfolder(filename):
+    # (subfolder, message type) an uploaded file is stored under, by extension
+    if is_image_file(filename):
+        return 'files', 'image'
+    if is_music_file(filename):
+        return 'music', 'music'
+    if is_video_file(filename):
+        return 'videos', 'video'
+    return 'files', 'file'
+
+
+def clean_filename(filename):
+    # Client-supplied file name reduced to a displayable base name
+    return os.path.basename(str(filename or '').replace('\\', '/')).strip()[:200]
+
+
+def describe_file(path, filename):
+    # (MIME type, width, height) of a file; dimensions are read from image headers only
+    if is_image_file(filename):
+        try:
+            with Image.open(path) as img:
+                return Image.MIME.get(img.format) or 'application/octet-stream', img.width, img.height
+        except Exception:
+            pass
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream', None, None
+
+
+def save_uploaded_file(file, subfolder='files', upload_folder='uploads', owner_id=None):
     
-    # Save uploaded file to subfolder with UUID prefix
+    # Save uploaded file under its content hash (identical files are stored once)
     # Args:
     #   file: Flask FileStorage object
     #   subfolder: subdirectory name (avatars, files, music, etc.)
     #   upload_folder: base upload folder path (default 'uploads')
+    #   owner_id: user to record the upload for (files a user may attach to messages)
     # Returns:
     #   str: URL path to saved file, or None if failed
+    # Images are stored as uploaded; stickers, avatars and icons are processed afterwards by
+    # queue_image_job() (app/functions/images.py)
+    # Caller commits (the file is registered in stored_file and upload)
     
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        filepath = os.path.join(upload_folder, subfolder, unique_filename)
-        
-        # Ensure directory exists
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        
-        file.save(filepath)
+        path, digest, size = spool_to_disk(file.stream, get_storage(upload_folder).incoming_folder())
         
-        # Process stickers: make square thumbnail
-        if subfolder == 'stickers' and is_image_file(file.filename):
-            try:
-                img = Image.open(filepath)
-                size = min(img.size)
-                img = img.crop((0, 0, size, size))
-                img.thumbnail((256, 256), Image.Resampling.LANCZOS)
-                img.save(filepath)
-            except Exception as e:
-                print(f"Error processing sticker: {e}")
+        if owner_id is not None:
+            mime_type, width, height = describe_file(path, file.filename)
         
-        return f"/uploads/{subfolder}/{unique_filename}"
+        url = store_file(path, digest, size, subfolder, file_extension(file.filename), upload_folder)
+        if owner_id is not None:
+            record_upload(owner_id, url, clean_filename(file.filename) or os.path.basename(url), size, digest,
+                          mime_type, width, height)
+        return url
     
     return None
 
-
-def resize_image(filepath, max_size=(32, 32)):
-    #Resize image to fit within max_size while maintaining aspect ratio
-    #Args:
-    #    filepath: path to image file
-    #    max_size: tuple of (width, height)
-    
-    try:
-        img = Image.open(filepath)
-        img.thumbnail(max_size, Image.Resampling.LANCZOS)
-        img.save(filepath)
-    except Exception as e:
-        print(f"Error resizing image: {e}")
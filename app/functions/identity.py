@@ -0,0 +1,122 @@
+# User identity cache functions
+# Users are cached per worker for USER_CACHE_SECONDS; commits bypassing the ORM must call invalidate_user()
+
+import threading
+import time
+from flask import session
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from app.extensions import db
+from app.models import User
+from config import USER_CACHE_SECONDS
+
+_lock = threading.Lock()
+_cache = {}  # user_id -> (expires_at, column values, identity snapshot)
+
+# Entries kept before expired ones are swept out
+USER_CACHE_MAX_ENTRIES = 50000
+_STALE_KEY = 'stale_user_ids'
+
+
+def _columns():
+    return [attr.key for attr in inspect(User).column_attrs]
+
+
+def _in_session(user_id):
+    # User already present in the current session, if any (no query)
+    return db.session.identity_map.get(inspect(User).identity_key_from_primary_key((user_id,)))
+
+
+def _identity_of(values):
+    # Fields socket handlers read on hot paths
+    return {
+        'id': values['id'],
+        'username': values['username'],
+        'avatar_url': values['avatar_url'],
+        'hide_status': bool(values['hide_status']),
+        'is_superuser': bool(values['is_superuser'])
+    }
+
+
+def _get_entry(user_id):
+    # Cached (values, identity) of a user, loaded on a miss; None when the user does not exist
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(user_id)
+    if entry is not None and entry[0] > now:
+        return entry[1], entry[2]
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    values = {key: getattr(user, key) for key in _columns()}
+    identity = _identity_of(values)
+    with _lock:
+        if len(_cache) >= USER_CACHE_MAX_ENTRIES:
+            for key in [k for k, e in _cache.items() if e[0] <= now]:
+                del _cache[key]
+        _cache[user_id] = (now + USER_CACHE_SECONDS, values, identity)
+    return values, identity
+
+
+def load_cached_user(user_id):
+    # User for the login manager: served from the cache and attached to the current session
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    existing = _in_session(user_id)
+    if existing is not None:
+        return existing
+    entry = _get_entry(user_id)
+    if entry is None:
+        return None
+    # A cache miss just loaded the row into the session
+    existing = _in_session(user_id)
+    if existing is not None:
+        return existing
+    user = User(**entry[0])
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def get_user_identity(user_id):
+    # Lightweight identity dict of a user (see _identity_of), or None
+    try:
+        entry = _get_entry(int(user_id))
+    except (TypeError, ValueError):
+        return None
+    return entry[1] if entry else None
+
+
+def socket_identity():
+    # Identity of the user behind the current socket event, without loading the User row
+    # (the socket keeps a copy of the Flask session it connected with)
+    user_id = session.get('_user_id')
+    if user_id is None:
+        return None
+    return get_user_identity(user_id)
+
+
+def invalidate_user(user_id):
+    # Drop a user's cached identity (call after committing changes that bypass the ORM)
+    with _lock:
+        _cache.pop(user_id, None)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_users(db_session, flush_context):
+    # Remember users changed in this transaction; they are dropped from the cache on commit
+    changed = [obj.id for obj in list(db_session.dirty) + list(db_session.deleted) if isinstance(obj, User)]
+    if changed:
+        db_session.info.setdefault(_STALE_KEY, set()).update(changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _drop_changed_users(db_session):
+    for user_id in db_session.info.pop(_STALE_KEY, ()):
+        invalidate_user(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_users(db_session):
+    db_session.info.pop(_STALE_KEY, None)
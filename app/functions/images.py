@@ -0,0 +1,202 @@
+# Image processing functions
+# Decoding and resizing with Pillow is CPU-bound: on the request green thread a 20 MP photo would
+# stall every client of the worker. Stickers, avatars and channel icons are therefore stored as
+# uploaded, and queue_image_job() hands the processing to a bounded pool of worker processes
+# (app/image_worker.py: at most IMAGE_WORKERS per server worker, started on demand and reused,
+# talking JSON lines over pipes) and returns a job id at once. When the processed image is stored,
+# the row that pointed at the original is switched to it and 'image_ready' is emitted to the
+# uploader. Images over IMAGE_MAX_PIXELS, decoder errors, timeouts and a full queue (more than
+# IMAGE_MAX_QUEUE waiting jobs) all keep the original file. image_pool_stats() reports the load.
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import uuid
+from app.extensions import db, socketio
+from app.file_storage import get_storage, url_key
+from app.functions.files import is_image_file
+from app.functions.storage import hash_file, store_file, file_extension
+from config import IMAGE_WORKERS, IMAGE_MAX_QUEUE, IMAGE_MAX_PIXELS, IMAGE_JOB_TIMEOUT
+
+# Processing of each image kind: (operation, (width, height)), see app/image_worker.py
+IMAGE_KINDS = {
+    'sticker': ('square', (256, 256)),
+    'avatar': ('fit', (256, 256)),
+    'channel_icon': ('fit', (32, 32)),
+}
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'image_worker.py')
+
+_lock = threading.Lock()
+_slots = None
+_idle = []  # worker processes waiting for a job
+_stats = {'in_flight': 0, 'queued': 0, 'peak_queued': 0, 'completed': 0, 'failed': 0, 'rejected': 0}
+_app = None
+
+
+def init_image_jobs(app):
+    # Remember the app so background jobs can open an app context
+    global _app
+    _app = app
+
+
+def _eventlet_mode():
+    return socketio.server is not None and socketio.async_mode == 'eventlet'
+
+
+def _get_slots():
+    # Semaphore bounding concurrent jobs (a green one under eventlet, so waiting yields to the hub)
+    global _slots
+    if _slots is None:
+        if _eventlet_mode():
+            from eventlet.semaphore import Semaphore
+            _slots = Semaphore(IMAGE_WORKERS)
+        else:
+            _slots = threading.Semaphore(IMAGE_WORKERS)
+    return _slots
+
+
+def _start_worker():
+    # New worker process (green pipes under eventlet, so waiting for it yields to the hub)
+    if _eventlet_mode():
+        from eventlet.green import subprocess as green_subprocess
+        popen = green_subprocess.Popen
+    else:
+        popen = subprocess.Popen
+    return popen([sys.executable, WORKER_SCRIPT], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+
+def _call_worker(job):
+    # Run one job on a pooled worker process; returns its reply ({'ok': False, ...} on any failure)
+    slots = _get_slots()
+    with _lock:
+        if _stats['in_flight'] >= IMAGE_WORKERS and _stats['queued'] >= IMAGE_MAX_QUEUE:
+            _stats['rejected'] += 1
+            return {'ok': False, 'error': 'image pool busy'}
+        _stats['queued'] += 1
+        _stats['peak_queued'] = max(_stats['peak_queued'], _stats['queued'])
+    slots.acquire()
+    with _lock:
+        _stats['queued'] -= 1
+        _stats['in_flight'] += 1
+        proc = _idle.pop() if _idle else None
+    reply = None
+    try:
+        if proc is None or proc.poll() is not None:
+            proc = _start_worker()
+        # A job stuck in the decoder gets its process killed, which ends the read below
+        timer = threading.Timer(IMAGE_JOB_TIMEOUT, proc.kill)
+        timer.start()
+        try:
+            proc.stdin.write((json.dumps(job) + '\n').encode('utf-8'))
+            proc.stdin.flush()
+            line = proc.stdout.readline()
+        finally:
+            timer.cancel()
+        if not line:
+            raise RuntimeError('worker exited (timed out or crashed)')
+        reply = json.loads(line)
+        with _lock:
+            _idle.append(proc)
+        proc = None
+        return reply
+    except Exception as e:
+        return {'ok': False, 'error': str(e)}
+    finally:
+        if proc is not None:
+            proc.kill()
+            proc.wait()
+        with _lock:
+            _stats['in_flight'] -= 1
+            _stats['completed' if reply and reply.get('ok') else 'failed'] += 1
+        slots.release()
+
+
+def queue_image_job(upload_folder, url, kind, user_id, target=None):
+    # Process a stored image (IMAGE_KINDS[kind]) in the background; returns the job id at once, or None
+    # when there is nothing to process. `target` = (Model, id, attr) is switched to the processed image
+    # if it still holds `url`. Call after committing the row, so the job never sees it half-written
+    key = url_key(url)
+    if kind not in IMAGE_KINDS or not key or not is_image_file(key):
+        return None
+    job_id = uuid.uuid4().hex
+    socketio.start_background_task(_run_job, job_id, upload_folder, url, kind, user_id, target)
+    return job_id
+
+
+def _run_job(job_id, upload_folder, url, kind, user_id, target):
+    # Background task: process the image, store the result and point the target row at it
+    # status: 'done', 'unchanged' (already small enough), 'superseded' (target changed meanwhile)
+    # or 'failed' (original kept)
+    status = 'failed'
+    final_url = url
+    key = url_key(url)
+    storage = get_storage(upload_folder)
+    src = storage.path(key)
+    dst = None
+    try:
+        if src is None:
+            raise RuntimeError('image is not on local disk')
+        operation, size = IMAGE_KINDS[kind]
+        ext = file_extension(key)
+        os.makedirs(storage.incoming_folder(), exist_ok=True)
+        fd, dst = tempfile.mkstemp(prefix='.derived-', suffix='.' + ext, dir=storage.incoming_folder())
+        os.close(fd)
+        reply = _call_worker({
+            'op': operation, 'src': src, 'dst': dst, 'size': list(size), 'max_pixels': IMAGE_MAX_PIXELS
+        })
+        if not reply.get('ok'):
+            print(f"[IMAGES] Job {job_id} kept the original {url}: {reply.get('error')}")
+        elif not reply.get('changed'):
+            status = 'unchanged'
+        else:
+            with _app.app_context():
+                try:
+                    digest, file_size = hash_file(dst)
+                    processed_url = store_file(dst, digest, file_size, key.split('/', 1)[0], ext, upload_folder)
+                    dst = None
+                    status = 'superseded'
+                    if target is not None:
+                        model, row_id, attr = target
+                        row = model.query.get(row_id)
+                        if row is not None and getattr(row, attr) == url:
+                            setattr(row, attr, processed_url)
+                            status = 'done'
+                    else:
+                        status = 'done'
+                    db.session.commit()
+                    if status == 'done':
+                        final_url = processed_url
+                except Exception:
+                    db.session.rollback()
+                    raise
+    except Exception as e:
+        status = 'failed'
+        print(f"[IMAGES] Job {job_id} failed for {url}: {e}")
+    finally:
+        if dst is not None:
+            try:
+                os.remove(dst)
+            except OSError:
+                pass
+    socketio.emit('image_ready', {
+        'job_id': job_id,
+        'kind': kind,
+        'status': status,
+        'url': final_url,
+        'original_url': url
+    }, room=f'user_{user_id}')
+
+
+def image_pool_stats():
+    # Current load of the image pool (queued = jobs waiting for a worker process)
+    with _lock:
+        stats = dict(_stats)
+        stats['idle_processes'] = len(_idle)
+    stats['workers'] = IMAGE_WORKERS
+    stats['max_queue'] = IMAGE_MAX_QUEUE
+    stats['max_pixels'] = IMAGE_MAX_PIXELS
+    return stats
@@ -0,0 +1,156 @@
+
+# Message loading functions
+# Pages are addressed by a (channel_id, id) keyset cursor so loading cost does not grow with history depth
+
+from datetime import datetime
+from sqlalchemy import select, literal, func
+from sqlalchemy.orm import joinedload
+from app.extensions import db
+from app.models import Message, MessageChange
+from app.functions.reactions import load_reactions
+from config import MESSAGE_PAGE_SIZE, MESSAGE_PAGE_MAX
+
+
+def clamp_page_size(limit):
+    # Keep client-supplied page sizes within sane bounds
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return MESSAGE_PAGE_SIZE
+    return max(1, min(limit, MESSAGE_PAGE_MAX))
+
+
+def load_message_page(channel_id, before_id=None, after_id=None, limit=None):
+    # Load one page of a channel by keyset cursor
+    # Without `after_id` the page is the newest messages older than `before_id` (or the channel tail);
+    # with `after_id` it is the oldest messages newer than it
+    # Returns (messages in ascending order, has_more in the paging direction)
+    limit = clamp_page_size(limit if limit is not None else MESSAGE_PAGE_SIZE)
+    query = Message.query.options(joinedload(Message.user)).filter(Message.channel_id == channel_id)
+    if after_id is not None:
+        rows = query.filter(Message.id > after_id).order_by(Message.id.asc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        return rows[:limit], has_more
+    if before_id:
+        query = query.filter(Message.id < before_id)
+    rows = query.order_by(Message.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    return rows, has_more
+
+
+def load_messages_around(channel_id, around_id, limit=None):
+    # Load a page centered on `around_id` (the target itself is included when it exists)
+    # Returns (messages in ascending order, has_more_before, has_more_after)
+    limit = clamp_page_size(limit if limit is not None else MESSAGE_PAGE_SIZE)
+    before_limit = max(1, limit // 2)
+    older, has_more_before = load_message_page(channel_id, before_id=around_id, limit=before_limit)
+    newer, has_more_after = load_message_page(channel_id, after_id=around_id - 1, limit=max(1, limit - len(older)))
+    return older + newer, has_more_before, has_more_after
+
+
+def attach_message_extras(messages, viewer_id=None):
+    # Batch-load reactions and reply targets for a page of messages
+    # Sets `reactions_grouped` ({emoji: {'count', 'users', 'me'}}, see app/functions/reactions.py)
+    # and `reply_to` on each message using a fixed number of queries
+    for msg in messages:
+        msg.reactions_grouped = {}
+        msg.reply_to = None
+    if not messages:
+        return messages
+
+    by_id = {msg.id: msg for msg in messages}
+    for message_id, reactions in load_reactions(by_id, viewer_id).items():
+        by_id[message_id].reactions_grouped = reactions
+
+    reply_ids = {msg.reply_to_id for msg in messages if getattr(msg, 'reply_to_id', None)}
+    if reply_ids:
+        originals = Message.query.options(joinedload(Message.user)).filter(Message.id.in_(list(reply_ids))).all()
+        originals = {orig.id: orig for orig in originals}
+        for msg in messages:
+            orig = originals.get(msg.reply_to_id)
+            if orig:
+                msg.reply_to = {
+                    'id': orig.id,
+                    'username': orig.user.username if orig.user else 'Unknown',
+                    'snippet': (orig.content or '').split('\n')[0][:200]
+                }
+    return messages
+
+
+def serialize_message(msg):
+    # Build a message payload in the same shape as the `receive_message` socket event
+    return {
+        'id': msg.id,
+        'user_id': msg.user_id,
+        'username': msg.user.username if msg.user else 'Unknown',
+        'avatar': msg.user.avatar_url if msg.user else None,
+        'msg': msg.content,
+        'timestamp_iso': msg.timestamp.strftime('%Y-%m-%dT%H:%M:%SZ') if msg.timestamp else None,
+        'message_type': msg.message_type,
+        'file_url': msg.file_url,
+        'file_name': msg.file_name,
+        'file_size': msg.file_size,
+        'edited_at_iso': msg.edited_at.strftime('%Y-%m-%dT%H:%M:%SZ') if msg.edited_at else None,
+        'reactions': getattr(msg, 'reactions_grouped', None) or {},
+        'reply_to': getattr(msg, 'reply_to', None)
+    }
+
+
+# --- DELTA SYNC ---
+
+def log_message_change(message, change):
+    # Append a create/edit/delete entry to the sync log; caller commits
+    db.session.add(MessageChange(
+        channel_id=message.channel_id,
+        message_id=message.id,
+        change=change
+    ))
+
+
+def log_bulk_deletion(*criteria):
+    # Record tombstones for every message matching `criteria` before a bulk delete; caller commits
+    tombstones = select(
+        Message.channel_id, Message.id, literal('deleted'), literal(datetime.utcnow())
+    ).where(*criteria)
+    db.session.execute(
+        MessageChange.__table__.insert().from_select(
+            ['channel_id', 'message_id', 'change', 'changed_at'], tombstones
+        )
+    )
+
+
+def current_sync_token(channel_id):
+    # Latest change id of a channel; clients hand it back as `since` to fetch deltas
+    token = db.session.query(func.max(MessageChange.id)).filter(
+        MessageChange.channel_id == channel_id
+    ).scalar()
+    return token or 0
+
+
+def load_changes_since(channel_id, since, limit=None):
+    # Collapse the sync log after `since` into current state
+    # Returns (changed messages in ascending order, deleted message ids, next token, has_more)
+    limit = clamp_page_size(limit if limit is not None else MESSAGE_PAGE_MAX)
+    rows = MessageChange.query.filter(
+        MessageChange.channel_id == channel_id,
+        MessageChange.id > since
+    ).order_by(MessageChange.id.asc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_token = rows[-1].id if rows else since
+
+    # Later entries win: a message created then deleted in the window is reported as deleted only
+    latest = {}
+    for row in rows:
+        latest[row.message_id] = row.change
+    deleted_ids = sorted(mid for mid, change in latest.items() if change == 'deleted')
+    changed_ids = [mid for mid, change in latest.items() if change != 'deleted']
+
+    messages = []
+    if changed_ids:
+        messages = Message.query.options(joinedload(Message.user)).filter(
+            Message.id.in_(changed_ids)
+        ).order_by(Message.id.asc()).all()
+    return messages, deleted_ids, next_token, has_more
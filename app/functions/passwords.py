@@ -0,0 +1,82 @@
+# Password hashing functions
+# scrypt takes tens of milliseconds of CPU. Under eventlet that would stall every socket and request
+# of the process, so hashing and verification run on eventlet's native thread pool (hashlib releases
+# the GIL while it works) and the calling green thread just waits. At most PASSWORD_HASH_WORKERS jobs
+# run at once; up to PASSWORD_HASH_MAX_QUEUE more wait for a slot, and beyond that callers get
+# PasswordPoolBusy instead of piling up behind a login storm. password_pool_stats() reports the load.
+
+import threading
+from werkzeug.security import generate_password_hash, check_password_hash
+from app.extensions import socketio
+from config import PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE
+
+_lock = threading.Lock()
+_slots = None
+_stats = {'in_flight': 0, 'queued': 0, 'peak_queued': 0, 'completed': 0, 'rejected': 0}
+
+
+class PasswordPoolBusy(Exception):
+    # Raised when too many hashing jobs are already waiting
+    pass
+
+
+def _eventlet_mode():
+    return socketio.server is not None and socketio.async_mode == 'eventlet'
+
+
+def _get_slots():
+    # Semaphore bounding concurrent jobs (a green one under eventlet, so waiting yields to the hub)
+    global _slots
+    if _slots is None:
+        if _eventlet_mode():
+            from eventlet.semaphore import Semaphore
+            _slots = Semaphore(PASSWORD_HASH_WORKERS)
+        else:
+            _slots = threading.Semaphore(PASSWORD_HASH_WORKERS)
+    return _slots
+
+
+def _run(func, *args, **kwargs):
+    # Run `func` on a pool slot; raises PasswordPoolBusy when the wait queue is full
+    slots = _get_slots()
+    with _lock:
+        if _stats['in_flight'] >= PASSWORD_HASH_WORKERS and _stats['queued'] >= PASSWORD_HASH_MAX_QUEUE:
+            _stats['rejected'] += 1
+            raise PasswordPoolBusy()
+        _stats['queued'] += 1
+        _stats['peak_queued'] = max(_stats['peak_queued'], _stats['queued'])
+    slots.acquire()
+    with _lock:
+        _stats['queued'] -= 1
+        _stats['in_flight'] += 1
+    try:
+        if _eventlet_mode():
+            from eventlet import tpool
+            return tpool.execute(func, *args, **kwargs)
+        return func(*args, **kwargs)
+    finally:
+        with _lock:
+            _stats['in_flight'] -= 1
+            _stats['completed'] += 1
+        slots.release()
+
+
+def hash_password(password):
+    # scrypt hash of a password, computed off the event loop
+    return _run(generate_password_hash, password, method='scrypt')
+
+
+def verify_password(pwhash, password):
+    # Check a password against a stored hash, computed off the event loop
+    if not pwhash or password is None:
+        return False
+    return _run(check_password_hash, pwhash, password)
+
+
+def password_pool_stats():
+    # Current load of the hashing pool (queued = jobs waiting for a slot)
+    with _lock:
+        stats = dict(_stats)
+    stats['workers'] = PASSWORD_HASH_WORKERS
+    stats['max_queue'] = PASSWORD_HASH_MAX_QUEUE
+    return stats
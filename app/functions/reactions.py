@@ -0,0 +1,130 @@
+# Reaction functions
+# Reactions are shown per message as {emoji: {'count', 'users', 'me'}}: the count comes from the
+# ReactionCount table (maintained on every toggle, so it is never a COUNT over a viral message),
+# `users` holds the first REACTION_NAMES_LIMIT reactors and `me` tells whether the viewer reacted.
+# A page of messages is loaded with three queries regardless of its size or reaction counts.
+# Toggles broadcast a `reaction_delta` event with the absolute count of the one emoji that changed,
+# so clients can apply it idempotently without receiving the whole reaction map again. Every toggle
+# is also logged as a 'reacted' change, so clients catching up with ?since= get the message with its
+# current reactions instead of the deltas they missed.
+
+from sqlalchemy import select, and_, exists, literal, func
+from app.extensions import db
+from app.models import Message, MessageReaction, ReactionCount, User
+from config import REACTION_NAMES_LIMIT
+
+
+def load_reactions(message_ids, viewer_id=None):
+    # {message_id: {emoji: {'count', 'users', 'me'}}} for the given messages
+    message_ids = list(message_ids)
+    result = {message_id: {} for message_id in message_ids}
+    if not message_ids:
+        return result
+
+    counts = db.session.query(ReactionCount.message_id, ReactionCount.emoji, ReactionCount.count).filter(
+        ReactionCount.message_id.in_(message_ids), ReactionCount.count > 0
+    ).order_by(ReactionCount.id.asc()).all()
+    for message_id, emoji, count in counts:
+        result[message_id][emoji] = {'count': count, 'users': [], 'me': False}
+
+    # First reactors of every (message, emoji), at most REACTION_NAMES_LIMIT each
+    ranked = select(
+        MessageReaction.message_id, MessageReaction.emoji, MessageReaction.user_id, MessageReaction.id,
+        func.row_number().over(
+            partition_by=(MessageReaction.message_id, MessageReaction.emoji),
+            order_by=MessageReaction.id
+        ).label('position')
+    ).where(MessageReaction.message_id.in_(message_ids)).subquery()
+    names = db.session.query(ranked.c.message_id, ranked.c.emoji, User.username).join(
+        User, User.id == ranked.c.user_id
+    ).filter(ranked.c.position <= REACTION_NAMES_LIMIT).order_by(ranked.c.id.asc()).all()
+    for message_id, emoji, username in names:
+        entry = result[message_id].get(emoji)
+        if entry is not None:
+            entry['users'].append(username)
+
+    if viewer_id is not None:
+        mine = db.session.query(MessageReaction.message_id, MessageReaction.emoji).filter(
+            MessageReaction.message_id.in_(message_ids), MessageReaction.user_id == viewer_id
+        ).all()
+        for message_id, emoji in mine:
+            entry = result[message_id].get(emoji)
+            if entry is not None:
+                entry['me'] = True
+    return result
+
+
+def _bump_count(message_id, emoji, amount):
+    # Add `amount` to the (message, emoji) counter, creating it when missing; returns the new count
+    ReactionCount.query.filter_by(message_id=message_id, emoji=emoji).update(
+        {ReactionCount.count: ReactionCount.count + amount}, synchronize_session=False
+    )
+    missing = select(literal(message_id), literal(emoji), literal(max(amount, 0))).where(
+        ~exists().where(and_(ReactionCount.message_id == message_id, ReactionCount.emoji == emoji))
+    )
+    db.session.execute(
+        ReactionCount.__table__.insert().from_select(['message_id', 'emoji', 'count'], missing)
+    )
+    return db.session.query(ReactionCount.count).filter_by(message_id=message_id, emoji=emoji).scalar() or 0
+
+
+def toggle_reaction(message, user_id, emoji, reaction_type='emoji'):
+    # Add the user's reaction, or remove it when it exists; returns (action, new count of the emoji)
+    # Caller commits
+    from app.functions.messages import log_message_change  # messages imports this module
+
+    existing = MessageReaction.query.filter_by(message_id=message.id, user_id=user_id, emoji=emoji).first()
+    if existing:
+        db.session.delete(existing)
+        action, amount = 'removed', -1
+    else:
+        db.session.add(MessageReaction(
+            message_id=message.id,
+            user_id=user_id,
+            emoji=emoji,
+            reaction_type=reaction_type
+        ))
+        action, amount = 'added', 1
+    db.session.flush()
+    log_message_change(message, 'reacted')
+    return action, _bump_count(message.id, emoji, amount)
+
+
+def reaction_delta(message, emoji, action, count, user_id, username):
+    # Payload of the `reaction_delta` socket event (also returned to the user who toggled)
+    return {
+        'message_id': message.id,
+        'channel_id': message.channel_id,
+        'emoji': emoji,
+        'action': action,
+        'count': count,
+        'user_id': user_id,
+        'username': username
+    }
+
+
+def delete_message_reactions(*criteria):
+    # Delete reactions and counters of every message matching `criteria` before a bulk delete
+    # (bulk deletes skip ORM cascades, and SQLite reuses the ids of deleted messages); caller commits
+    message_ids = select(Message.id).where(*criteria)
+    MessageReaction.query.filter(MessageReaction.message_id.in_(message_ids)).delete(synchronize_session=False)
+    ReactionCount.query.filter(ReactionCount.message_id.in_(message_ids)).delete(synchronize_session=False)
+
+
+def rebuild_reaction_counts(message_ids=None):
+    # Recount reactions of the given messages (all messages when None), e.g. after bulk deletes
+    # Caller commits
+    delete = ReactionCount.__table__.delete()
+    source = select(
+        MessageReaction.message_id, MessageReaction.emoji, func.count(MessageReaction.id)
+    ).group_by(MessageReaction.message_id, MessageReaction.emoji)
+    if message_ids is not None:
+        message_ids = list(message_ids)
+        if not message_ids:
+            return
+        delete = delete.where(ReactionCount.message_id.in_(message_ids))
+        source = source.where(MessageReaction.message_id.in_(message_ids))
+    db.session.execute(delete)
+    db.session.execute(
+        ReactionCount.__table__.insert().from_select(['message_id', 'emoji', 'count'], source)
+    )
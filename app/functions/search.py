@@ -0,0 +1,148 @@
+# Message search functions
+# Queries the `message_fts` FTS5 index (see app/models/search.py), restricted to channels of rooms the
+# caller belongs to and is not banned from. Results are ranked by bm25 (content weighs more than file
+# names) and paged by an opaque (rank, id) keyset cursor, so deep pages cost the same as the first.
+
+import base64
+import re
+from sqlalchemy import select, func, and_, or_, literal_column, table, column
+from app.extensions import db
+from app.models import Message, Channel, Room, Member, RoomBan, User, MESSAGE_FTS_TABLE
+from config import SEARCH_PAGE_SIZE, MESSAGE_PAGE_MAX
+
+# Markers around matched terms in FTS5 output; control characters never typed in messages
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+_MAX_TERMS = 16
+_SNIPPET_TOKENS = 16
+
+_fts = literal_column(MESSAGE_FTS_TABLE)
+_fts_table = table(MESSAGE_FTS_TABLE, column('rowid'))
+
+
+def search_available():
+    # Full-text search needs the SQLite FTS5 index
+    return db.engine.dialect.name == 'sqlite'
+
+
+def build_match_query(query):
+    # Turn free text into a safe FTS5 expression: every word must match, the last one as a prefix
+    terms = re.findall(r'\w+', query or '')[:_MAX_TERMS]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def encode_search_cursor(rank, message_id):
+    # Opaque cursor pointing after the given result
+    raw = f"{rank!r}:{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_search_cursor(cursor):
+    # (rank, message_id) from a cursor, or None when it is malformed
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        rank, message_id = raw.split(':')
+        return float(rank), int(message_id)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        return None
+
+
+def _strip_marks(marked):
+    # Plain text plus [start, end) offsets of the highlighted terms (in characters)
+    plain = []
+    highlights = []
+    start = None
+    length = 0
+    for char in marked or '':
+        if char == _MARK_START:
+            start = length
+        elif char == _MARK_END:
+            if start is not None and length > start:
+                highlights.append([start, length])
+            start = None
+        else:
+            plain.append(char)
+            length += 1
+    return ''.join(plain), highlights
+
+
+def searchable_channel_ids(user_id):
+    # Subquery of channels the user may search: member rooms without a room ban
+    banned = select(RoomBan.room_id).where(RoomBan.user_id == user_id)
+    return select(Channel.id).join(
+        Member, and_(Member.room_id == Channel.room_id, Member.user_id == user_id)
+    ).where(Channel.room_id.not_in(banned))
+
+
+def search_messages(user_id, query, cursor=None, limit=None, room_id=None, channel_id=None):
+    # Ranked full-text search over the user's channels
+    # Returns (results, next_cursor); next_cursor is None on the last page
+    match = build_match_query(query)
+    if match is None:
+        return [], None
+    try:
+        limit = max(1, min(int(limit), MESSAGE_PAGE_MAX))
+    except (TypeError, ValueError):
+        limit = SEARCH_PAGE_SIZE
+
+    rank = func.bm25(_fts, 1.0, 0.5)
+    stmt = select(
+        Message.id, Message.channel_id, Message.user_id, Message.timestamp, Message.message_type,
+        Message.file_name, Channel.name, Channel.room_id, Room.name, Room.type, User.username,
+        rank.label('rank'),
+        func.snippet(_fts, -1, _MARK_START, _MARK_END, '…', _SNIPPET_TOKENS)
+    ).select_from(
+        _fts_table
+    ).join(
+        Message, Message.id == _fts_table.c.rowid
+    ).join(
+        Channel, Channel.id == Message.channel_id
+    ).join(
+        Room, Room.id == Channel.room_id
+    ).outerjoin(
+        User, User.id == Message.user_id
+    ).where(
+        _fts.op('MATCH')(match),
+        Message.channel_id.in_(searchable_channel_ids(user_id))
+    )
+    if room_id is not None:
+        stmt = stmt.where(Channel.room_id == room_id)
+    if channel_id is not None:
+        stmt = stmt.where(Message.channel_id == channel_id)
+
+    after = decode_search_cursor(cursor) if cursor else None
+    if after is not None:
+        after_rank, after_id = after
+        # bm25 is lower for better matches; ties are broken by newest message first
+        stmt = stmt.where(or_(rank > after_rank, and_(rank == after_rank, Message.id < after_id)))
+
+    rows = db.session.execute(stmt.order_by(rank.asc(), Message.id.desc()).limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    results = []
+    for (message_id, msg_channel_id, sender_id, timestamp, message_type, file_name, channel_name,
+         msg_room_id, room_name, room_type, username, score, marked) in rows:
+        snippet, highlights = _strip_marks(marked)
+        results.append({
+            'id': message_id,
+            'channel_id': msg_channel_id,
+            'channel_name': channel_name,
+            'room_id': msg_room_id,
+            'room_name': room_name,
+            'room_type': room_type,
+            'user_id': sender_id,
+            'username': username or 'Unknown',
+            'timestamp_iso': timestamp.strftime('%Y-%m-%dT%H:%M:%SZ') if timestamp else None,
+            'message_type': message_type,
+            'file_name': file_name,
+            'snippet': snippet,
+            'highlights': highlights,
+            'rank': score
+        })
+    next_cursor = encode_search_cursor(results[-1]['rank'], results[-1]['id']) if has_more and results else None
+    return results, next_cursor
@@ -0,0 +1,279 @@
+# Content-addressed upload storage
+# One file per SHA-256 with a ref-counted StoredFile row; see readme.md ("Uploaded files")
+
+import hashlib
+import os
+import re
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import event, func, select, literal, exists, union_all, bindparam, inspect
+from sqlalchemy.orm import Session
+from app.extensions import db, socketio
+from app.file_storage import get_storage, shard_key, url_key, key_url
+from app.models import StoredFile, Upload, Message, UserMusic, Sticker, User, Room, Channel
+from config import STORED_FILE_GRACE_SECONDS, STORED_FILE_SWEEP_SECONDS
+
+# Bytes read and written at a time while copying or hashing
+STREAM_BLOCK = 1024 * 1024
+
+# Columns holding upload URLs; each non-NULL value is one reference to a stored file
+FILE_REFERENCES = (
+    (Message, 'file_url'),
+    (UserMusic, 'file_url'),
+    (UserMusic, 'cover_url'),
+    (Sticker, 'file_url'),
+    (User, 'avatar_url'),
+    (Room, 'avatar_url'),
+    (Channel, 'icon_image_url'),
+)
+_REFERENCE_ATTRS = {}
+for _model, _attr in FILE_REFERENCES:
+    _REFERENCE_ATTRS.setdefault(_model, []).append(_attr)
+
+_STORED_NAME = re.compile(r'^[0-9a-f]{64}(\.[a-z0-9]+)?$')
+_stored_file = StoredFile.__table__
+_upload = Upload.__table__
+_sweeper_started = False
+
+
+def file_extension(filename):
+    # Lower-case extension without the dot ('' when there is none)
+    return filename.rsplit('.', 1)[1].lower() if filename and '.' in filename else ''
+
+
+def stored_url(subfolder, digest, ext):
+    # URL of the stored copy of a content hash
+    return key_url(shard_key(subfolder, digest, ext))
+
+
+def is_stored_url(url):
+    # True for content-addressed /uploads/ URLs (never rewritten, safe to cache forever)
+    # Also true for the flat /uploads/<subfolder>/<sha256>.<ext> URLs used before sharding
+    if not url or not url.startswith('/uploads/'):
+        return False
+    return bool(_STORED_NAME.match(url.rsplit('/', 1)[-1]))
+
+
+def hash_file(path):
+    # (sha256 hex digest, size) of a file, read in blocks
+    hasher = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(STREAM_BLOCK), b''):
+            hasher.update(block)
+            size += len(block)
+    return hasher.hexdigest(), size
+
+
+def spool_to_disk(stream, folder):
+    # Copy a stream to a temporary file in `folder`, hashing it on the way
+    # Returns (path, sha256 hex digest, size); the caller stores or removes the file
+    # (use the storage backend's incoming_folder() so storing it is a rename)
+    os.makedirs(folder, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix='.incoming-', dir=folder)
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for block in iter(lambda: stream.read(STREAM_BLOCK), b''):
+                hasher.update(block)
+                f.write(block)
+                size += len(block)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, hasher.hexdigest(), size
+
+
+def store_file(path, digest, size, subfolder, ext, upload_folder, move=True):
+    # File the bytes at `path` under their content hash and return the URL
+    # An identical stored file is reused (the new copy is dropped). With move=False the source is
+    # left in place (hard-linked or copied). Caller commits
+    url = stored_url(subfolder, digest, ext)
+    get_storage(upload_folder).put(path, url_key(url), move=move)
+
+    now = datetime.utcnow()
+    missing = select(literal(url), literal(digest), literal(size), literal(0), literal(now), literal(now)).where(
+        ~exists().where(_stored_file.c.url == url)
+    )
+    db.session.execute(_stored_file.insert().from_select(
+        ['url', 'sha256', 'size', 'ref_count', 'created_at', 'last_used_at'], missing
+    ))
+    # Restart the grace period of an unreferenced file that is being uploaded again
+    db.session.execute(_stored_file.update().where(_stored_file.c.url == url).values(last_used_at=now))
+    return url
+
+
+def record_upload(user_id, url, file_name, size, digest, mime_type, width=None, height=None):
+    # Register a user's upload of a stored file (once per user and URL; the latest name is kept)
+    # Caller commits
+    missing = select(
+        literal(user_id), literal(url), literal(file_name), literal(size), literal(mime_type), literal(digest),
+        literal(width), literal(height), literal(datetime.utcnow())
+    ).where(~exists().where(_upload.c.user_id == user_id, _upload.c.url == url))
+    db.session.execute(_upload.insert().from_select(
+        ['user_id', 'url', 'file_name', 'size', 'mime_type', 'sha256', 'width', 'height', 'created_at'], missing
+    ))
+    db.session.execute(_upload.update().where(_upload.c.user_id == user_id, _upload.c.url == url).values(
+        file_name=file_name
+    ))
+
+
+def find_upload(user_id, url):
+    # The user's registered upload of `url`, or None (other users' uploads are not visible)
+    return Upload.query.filter_by(user_id=user_id, url=url).first()
+
+
+def discard_upload(upload_folder, url):
+    # Delete the file behind an URL that is no longer used, unless it is a shared stored file
+    # (those are freed by sweep_unreferenced_files once nothing references them)
+    key = url_key(url)
+    if key and not is_stored_url(url):
+        get_storage(upload_folder).delete(key)
+
+
+def _adjust_references(connection, deltas):
+    now = datetime.utcnow()
+    for url, delta in deltas.items():
+        if delta and is_stored_url(url):
+            connection.execute(_stored_file.update().where(_stored_file.c.url == url).values(
+                ref_count=_stored_file.c.ref_count + delta, last_used_at=now
+            ))
+
+
+def _committed_values(db_session, obj, attr):
+    # Database value(s) of an attribute before this flush
+    history = inspect(obj).attrs[attr].history
+    if history.deleted or history.unchanged:
+        return list(history.deleted or history.unchanged)
+    if not history.added:
+        return [getattr(obj, attr)]
+    # Overwritten without being loaded first: read the stored value
+    model = type(obj)
+    return [db_session.connection().execute(
+        select(getattr(model, attr)).where(model.id == obj.id)
+    ).scalar()]
+
+
+@event.listens_for(Session, 'before_flush')
+def _count_references(db_session, flush_context, instances):
+    # Turn inserted, changed and deleted URL values into ref_count updates of the same transaction
+    deltas = Counter()
+    with db_session.no_autoflush:
+        for obj in db_session.new:
+            for attr in _REFERENCE_ATTRS.get(type(obj), ()):
+                deltas[getattr(obj, attr)] += 1
+        for obj in db_session.deleted:
+            for attr in _REFERENCE_ATTRS.get(type(obj), ()):
+                for value in _committed_values(db_session, obj, attr):
+                    deltas[value] -= 1
+        for obj in db_session.dirty:
+            for attr in _REFERENCE_ATTRS.get(type(obj), ()):
+                history = inspect(obj).attrs[attr].history
+                if not history.has_changes():
+                    continue
+                for value in _committed_values(db_session, obj, attr):
+                    deltas[value] -= 1
+                for value in history.added:
+                    deltas[value] += 1
+    deltas.pop(None, None)
+    if any(is_stored_url(url) for url in deltas):
+        _adjust_references(db_session.connection(), deltas)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _count_bulk_references(orm_execute_state):
+    # Bulk DELETE of rows holding URLs: release their references before the rows go
+    # (bulk UPDATEs of URL columns are not tracked; run rebuild_file_references() after those)
+    if not orm_execute_state.is_delete:
+        return
+    mapper = orm_execute_state.bind_mapper
+    attrs = _REFERENCE_ATTRS.get(mapper.class_) if mapper is not None else None
+    if not attrs:
+        return
+    whereclause = orm_execute_state.statement.whereclause
+    connection = orm_execute_state.session.connection()
+    deltas = Counter()
+    for attr in attrs:
+        column = getattr(mapper.class_, attr)
+        query = select(column, func.count()).where(column.like('/uploads/%')).group_by(column)
+        if whereclause is not None:
+            query = query.where(whereclause)
+        for url, count in connection.execute(query):
+            deltas[url] -= count
+    _adjust_references(connection, deltas)
+
+
+def rebuild_file_references():
+    # Recount every stored file's references from the URL columns (after bulk URL rewrites)
+    # Caller commits
+    references = union_all(*[
+        select(getattr(model, attr).label('url')).where(getattr(model, attr).like('/uploads/%'))
+        for model, attr in FILE_REFERENCES
+    ]).subquery()
+    counts = db.session.execute(
+        select(references.c.url, func.count()).group_by(references.c.url)
+    ).all()
+    db.session.execute(_stored_file.update().values(ref_count=0))
+    rows = [{'match_url': url, 'new_count': count} for url, count in counts if is_stored_url(url)]
+    if rows:
+        db.session.execute(
+            _stored_file.update().where(_stored_file.c.url == bindparam('match_url')).values(
+                ref_count=bindparam('new_count')
+            ),
+            rows
+        )
+
+
+def sweep_unreferenced_files(upload_folder, grace_seconds=None, limit=500):
+    # Delete up to `limit` stored files unreferenced for longer than the grace period; returns how
+    # many were removed. Commits (rows go first, so a file is never removed while still listed)
+    grace_seconds = STORED_FILE_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    stale = StoredFile.query.filter(
+        StoredFile.ref_count <= 0, StoredFile.last_used_at < cutoff
+    ).order_by(StoredFile.id.asc()).limit(limit).all()
+    if not stale:
+        return 0
+    urls = [f.url for f in stale]
+    StoredFile.query.filter(
+        StoredFile.url.in_(urls), StoredFile.ref_count <= 0, StoredFile.last_used_at < cutoff
+    ).delete(synchronize_session=False)
+    # Files re-uploaded or re-referenced in the meantime kept their row
+    kept = {url for (url,) in db.session.query(StoredFile.url).filter(StoredFile.url.in_(urls))}
+    removed_urls = [url for url in urls if url not in kept]
+    if removed_urls:
+        Upload.query.filter(Upload.url.in_(removed_urls)).delete(synchronize_session=False)
+    db.session.commit()
+    storage = get_storage(upload_folder)
+    for url in removed_urls:
+        storage.delete(url_key(url))
+    return len(removed_urls)
+
+
+def start_file_sweeper(app):
+    # Run sweep_unreferenced_files every STORED_FILE_SWEEP_SECONDS in a background task
+    global _sweeper_started
+    if _sweeper_started or STORED_FILE_SWEEP_SECONDS <= 0:
+        return
+    _sweeper_started = True
+    socketio.start_background_task(_sweep_loop, app)
+
+
+def _sweep_loop(app):
+    # Background task: free unreferenced stored files, a batch at a time
+    while True:
+        socketio.sleep(STORED_FILE_SWEEP_SECONDS)
+        try:
+            with app.app_context():
+                upload_folder = app.config.get('UPLOAD_FOLDER', 'uploads')
+                removed = total = sweep_unreferenced_files(upload_folder)
+                while removed:
+                    socketio.sleep(0)
+                    removed = sweep_unreferenced_files(upload_folder)
+                    total += removed
+            if total:
+                print(f"[STORAGE] Removed {total} unreferenced files")
+        except Exception as e:
+            print(f"[STORAGE] Sweep error: {e}")
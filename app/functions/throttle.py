@@ -0,0 +1,160 @@
+# Login throttling functions
+# Token buckets per client address and per username and address, kept in-process or in Redis
+
+import ipaddress
+import time
+from config import (
+    LOGIN_THROTTLE_ENABLED, LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE, LOGIN_USER_BURST, LOGIN_USER_PER_MINUTE,
+    LOGIN_THROTTLE_MAX_KEYS, LOGIN_THROTTLE_STORAGE
+)
+
+_stats = {'allowed': 0, 'rejected_ip': 0, 'rejected_username': 0, 'backend_errors': 0}
+_memory = None
+_redis = None
+_redis_script = None
+_redis_retry_at = 0.0
+
+# Seconds to stay on the in-process buckets after a Redis error
+REDIS_RETRY_SECONDS = 30
+
+# Atomic token bucket for Redis: KEYS[1] = bucket, ARGV = capacity, refill per second, now
+_REDIS_TAKE = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class TokenBuckets:
+    # In-process buckets: key -> (tokens, updated_at, full_at)
+    # Updated without a lock: nothing yields inside take() under eventlet, and a thread race loses one update
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self.buckets = {}
+
+    def take(self, key, capacity, rate, now):
+        # Take one token; returns (allowed, tokens left)
+        state = self.buckets.get(key)
+        if state is None:
+            tokens = capacity
+        else:
+            tokens = min(capacity, state[0] + (now - state[1]) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        if state is None and len(self.buckets) >= self.max_keys:
+            self.prune(now)
+        self.buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+        return allowed, tokens
+
+    def prune(self, now):
+        # Forget buckets that have refilled (they behave like new ones); if that is not enough,
+        # forget the ones closest to full
+        self.buckets = {key: state for key, state in self.buckets.items() if state[2] > now}
+        excess = len(self.buckets) - self.max_keys * 9 // 10
+        if excess > 0:
+            for key in sorted(self.buckets, key=lambda k: self.buckets[k][2])[:excess]:
+                del self.buckets[key]
+
+
+def _get_memory():
+    global _memory
+    if _memory is None:
+        _memory = TokenBuckets(max(1, LOGIN_THROTTLE_MAX_KEYS))
+    return _memory
+
+
+def _get_redis():
+    # Redis client for LOGIN_THROTTLE_STORAGE, or None when not configured or not installed
+    global _redis, _redis_script
+    if not LOGIN_THROTTLE_STORAGE:
+        return None
+    if _redis is None:
+        try:
+            import redis
+        except ImportError:
+            print("[LOGIN THROTTLE] `redis` package is not installed, using in-process buckets")
+            _redis = False
+            return None
+        _redis = redis.Redis.from_url(LOGIN_THROTTLE_STORAGE, socket_timeout=0.5)
+        _redis_script = _redis.register_script(_REDIS_TAKE)
+    return _redis or None
+
+
+def _take(key, capacity, per_minute, now):
+    # Take one token from bucket `key`; returns seconds until a token is available (0 = allowed)
+    global _redis_retry_at
+    rate = per_minute / 60.0
+    allowed, tokens = None, 0.0
+    if now >= _redis_retry_at and _get_redis() is not None:
+        try:
+            result = _redis_script(keys=[f"boxchat:login:{key}"], args=[capacity, rate, now])
+            allowed, tokens = bool(int(result[0])), float(result[1])
+        except Exception as e:
+            # Skip Redis for a while instead of waiting for its timeout on every attempt
+            _stats['backend_errors'] += 1
+            _redis_retry_at = now + REDIS_RETRY_SECONDS
+            print(f"[LOGIN THROTTLE] Redis error, using in-process buckets for {REDIS_RETRY_SECONDS}s: {e}")
+    if allowed is None:
+        allowed, tokens = _get_memory().take(key, capacity, rate, now)
+    if allowed:
+        return 0
+    return max(1, int((1 - tokens) / rate + 0.999))
+
+
+def _ip_key(client_ip):
+    # Bucket key for a client address: IPv6 by /64 (one subscriber), IPv4 as is
+    try:
+        address = ipaddress.ip_address((client_ip or '').strip())
+    except ValueError:
+        return f"ip:{client_ip or '-'}"
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    if address.version == 6:
+        return f"ip:{ipaddress.ip_network(f'{address}/64', strict=False)}"
+    return f"ip:{address}"
+
+
+def check_login_rate(client_ip, username):
+    # Spend one login attempt for this address and for this username from this address
+    # Returns 0 when the attempt may proceed, otherwise the seconds to wait before retrying
+    if not LOGIN_THROTTLE_ENABLED:
+        return 0
+    now = time.time()
+    ip_key = _ip_key(client_ip)
+    wait = _take(ip_key, LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE, now)
+    if wait:
+        _stats['rejected_ip'] += 1
+        return wait
+    if username:
+        # Keyed by address too, so guesses from elsewhere cannot lock the owner out of the account
+        user_key = f"user:{username.strip().casefold()}:{ip_key}"
+        wait = _take(user_key, LOGIN_USER_BURST, LOGIN_USER_PER_MINUTE, now)
+        if wait:
+            _stats['rejected_username'] += 1
+            return wait
+    _stats['allowed'] += 1
+    return 0
+
+
+def login_throttle_stats():
+    # Attempt counters of this worker process
+    stats = dict(_stats)
+    if _get_redis() is None:
+        stats['backend'] = 'memory'
+    else:
+        stats['backend'] = 'redis' if time.time() >= _redis_retry_at else 'memory (redis unreachable)'
+    stats['tracked_keys'] = len(_memory.buckets) if _memory is not None else 0
+    return stats
@@ -0,0 +1,118 @@
+
+# Unread counter functions
+# Counters live in the UnreadCounter table and are kept up to date by the write paths
+# (send, read, delete), so readers never have to COUNT messages
+
+from sqlalchemy import select, and_, exists, literal, func
+from app.extensions import db
+from app.models import Member, Message, ReadMessage, UnreadCounter, Channel
+from app.functions.conversations import invalidate_dm_list
+
+
+def increment_unread(room_id, channel_id, sender_id, amount=1):
+    # Bump the counter of every room member except the sender
+    # Runs two statements regardless of room size; caller commits
+    recipients = select(Member.user_id).where(
+        Member.room_id == room_id,
+        Member.user_id != sender_id
+    )
+    UnreadCounter.query.filter(
+        UnreadCounter.channel_id == channel_id,
+        UnreadCounter.user_id.in_(recipients)
+    ).update({UnreadCounter.count: UnreadCounter.count + amount}, synchronize_session=False)
+
+    # Create counters for members that never had one in this channel
+    missing = select(Member.user_id, literal(channel_id), literal(amount)).where(
+        Member.room_id == room_id,
+        Member.user_id != sender_id,
+        ~exists().where(and_(
+            UnreadCounter.user_id == Member.user_id,
+            UnreadCounter.channel_id == channel_id
+        ))
+    )
+    db.session.execute(
+        UnreadCounter.__table__.insert().from_select(['user_id', 'channel_id', 'count'], missing)
+    )
+
+
+def reset_unread(user_id, channel_id):
+    # Zero the user's counter for a channel; caller commits
+    UnreadCounter.query.filter_by(
+        user_id=user_id,
+        channel_id=channel_id
+    ).update({UnreadCounter.count: 0}, synchronize_session=False)
+    invalidate_dm_list(user_id)
+
+
+def get_unread_counts(user_id, channel_ids):
+    # Return {channel_id: unread} for the given channels in a single query
+    channel_ids = [int(c) for c in channel_ids]
+    counts = {cid: 0 for cid in channel_ids}
+    if not channel_ids:
+        return counts
+    rows = db.session.query(UnreadCounter.channel_id, UnreadCounter.count).filter(
+        UnreadCounter.user_id == user_id,
+        UnreadCounter.channel_id.in_(channel_ids)
+    ).all()
+    for channel_id, count in rows:
+        counts[channel_id] = count or 0
+    return counts
+
+
+def get_room_unread_counts(user_id, room_id):
+    # Return {channel_id: unread} for every channel of a room in a single query
+    rows = db.session.query(Channel.id, UnreadCounter.count).outerjoin(
+        UnreadCounter, and_(UnreadCounter.channel_id == Channel.id, UnreadCounter.user_id == user_id)
+    ).filter(Channel.room_id == room_id).all()
+    return {channel_id: (count or 0) for channel_id, count in rows}
+
+
+def get_channel_unread_counts(channel_id):
+    # Return {user_id: unread} for every counter of a channel in a single query
+    rows = db.session.query(UnreadCounter.user_id, UnreadCounter.count).filter(
+        UnreadCounter.channel_id == channel_id
+    ).all()
+    return {user_id: (count or 0) for user_id, count in rows}
+
+
+def discount_unread(message):
+    # Decrement counters of users who had not read the message yet (used on delete); caller commits
+    last_read = select(func.max(ReadMessage.last_read_message_id)).where(
+        ReadMessage.user_id == UnreadCounter.user_id,
+        ReadMessage.channel_id == message.channel_id
+    ).scalar_subquery()
+    UnreadCounter.query.filter(
+        UnreadCounter.channel_id == message.channel_id,
+        UnreadCounter.user_id != message.user_id,
+        UnreadCounter.count > 0,
+        func.coalesce(last_read, 0) < message.id
+    ).update({UnreadCounter.count: UnreadCounter.count - 1}, synchronize_session=False)
+
+
+def rebuild_unread(channel_ids):
+    # Recompute counters for whole channels from messages and read markers
+    # Used after bulk deletes and to backfill existing databases; caller commits
+    channel_ids = [int(c) for c in channel_ids]
+    if not channel_ids:
+        return
+    UnreadCounter.query.filter(
+        UnreadCounter.channel_id.in_(channel_ids)
+    ).delete(synchronize_session=False)
+
+    last_read = select(func.max(ReadMessage.last_read_message_id)).where(
+        ReadMessage.user_id == Member.user_id,
+        ReadMessage.channel_id == Channel.id
+    ).scalar_subquery()
+    unread = select(Member.user_id, Channel.id, func.count(Message.id)).select_from(Member).join(
+        Channel, Channel.room_id == Member.room_id
+    ).join(
+        Message, Message.channel_id == Channel.id
+    ).where(
+        Channel.id.in_(channel_ids),
+        Message.user_id != Member.user_id,
+        Message.id > func.coalesce(last_read, 0)
+    ).group_by(Member.user_id, Channel.id)
+    db.session.execute(
+        UnreadCounter.__table__.insert().from_select(['user_id', 'channel_id', 'count'], unread)
+    )
+    invalidate_dm_list()
@@ -0,0 +1,247 @@
+# Chunked upload functions
+# Resumable sessions kept on disk (<id>.json and <id>.part), so any worker can continue them
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from app.extensions import socketio
+from app.functions.files import allowed_file, upload_subfolder, clean_filename, describe_file
+from app.functions.storage import store_file, record_upload, file_extension, hash_file
+from config import MAX_CONTENT_LENGTH, UPLOAD_CHUNK_SIZE, UPLOAD_SESSION_SECONDS
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent writes to one session are not excluded
+    fcntl = None
+
+# Bytes read from the request and written to disk at a time
+UPLOAD_STREAM_BLOCK = 1024 * 1024
+
+_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+_lock = threading.Lock()
+_hashers = {}  # upload_id -> (offset hashed so far, sha256 object); per worker
+
+
+class UploadError(Exception):
+    # Rejected upload request; `status` is the HTTP code, `offset` the current resume offset if known
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def _paths(staging_folder, upload_id):
+    if not upload_id or not _UPLOAD_ID.match(upload_id):
+        raise UploadError('upload not found', 404)
+    base = os.path.join(staging_folder, upload_id)
+    return base + '.json', base + '.part'
+
+
+def _read_meta(staging_folder, upload_id, user_id):
+    meta_path, part_path = _paths(staging_folder, upload_id)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        raise UploadError('upload not found', 404)
+    if meta.get('user_id') != user_id:
+        raise UploadError('upload not found', 404)
+    return meta, part_path
+
+
+def _offset(part_path):
+    # Resume offset: the bytes already in the staging file
+    try:
+        return os.path.getsize(part_path)
+    except OSError:
+        return 0
+
+
+def _eventlet_mode():
+    return socketio.server is not None and socketio.async_mode == 'eventlet'
+
+
+def _forget(upload_id):
+    with _lock:
+        _hashers.pop(upload_id, None)
+
+
+def _remove_session(staging_folder, upload_id):
+    _forget(upload_id)
+    for path in _paths(staging_folder, upload_id):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def prune_stale_uploads(staging_folder, max_age=None):
+    # Delete sessions untouched for UPLOAD_SESSION_SECONDS; returns how many were removed
+    max_age = UPLOAD_SESSION_SECONDS if max_age is None else max_age
+    try:
+        names = os.listdir(staging_folder)
+    except OSError:
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for name in names:
+        if not name.endswith('.json'):
+            continue
+        upload_id = name[:-len('.json')]
+        try:
+            meta_path, part_path = _paths(staging_folder, upload_id)
+            last_touched = max(os.path.getmtime(meta_path), os.path.getmtime(part_path))
+        except (UploadError, OSError):
+            continue
+        if last_touched < cutoff:
+            _remove_session(staging_folder, upload_id)
+            removed += 1
+    return removed
+
+
+def start_upload(staging_folder, user_id, filename, size, sha256=None):
+    # Open an upload session; returns its status (upload_id, offset, size, chunk_size)
+    # The file name is only kept for display (the stored file is named by its hash)
+    filename = clean_filename(filename)
+    if not filename or not allowed_file(filename):
+        raise UploadError('file type not allowed')
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadError('size not specified')
+    if size < 0 or size > MAX_CONTENT_LENGTH:
+        raise UploadError('file too large', 413)
+    if sha256 is not None:
+        sha256 = str(sha256).lower()
+        if not re.match(r'^[0-9a-f]{64}$', sha256):
+            raise UploadError('invalid sha256')
+
+    os.makedirs(staging_folder, exist_ok=True)
+    prune_stale_uploads(staging_folder)
+    upload_id = uuid.uuid4().hex
+    meta_path, part_path = _paths(staging_folder, upload_id)
+    open(part_path, 'wb').close()
+    meta = {
+        'user_id': user_id,
+        'filename': filename,
+        'size': size,
+        'sha256': sha256,
+        'created_at': time.time()
+    }
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    with _lock:
+        _hashers[upload_id] = (0, hashlib.sha256())
+    return {'upload_id': upload_id, 'offset': 0, 'size': size, 'chunk_size': UPLOAD_CHUNK_SIZE}
+
+
+def upload_status(staging_folder, upload_id, user_id):
+    # Resume point of a session: {upload_id, offset, size, chunk_size}
+    meta, part_path = _read_meta(staging_folder, upload_id, user_id)
+    return {'upload_id': upload_id, 'offset': _offset(part_path), 'size': meta['size'],
+            'chunk_size': UPLOAD_CHUNK_SIZE}
+
+
+def write_chunk(staging_folder, upload_id, user_id, offset, stream, length=None, chunk_sha256=None):
+    # Append one chunk read from `stream` at `offset` (must equal the bytes already received)
+    # `length` is the declared chunk size (Content-Length); `chunk_sha256` optionally verifies it
+    # Returns the session status; bytes of an interrupted chunk are kept so the client can resume
+    meta, part_path = _read_meta(staging_folder, upload_id, user_id)
+    try:
+        offset = int(offset)
+    except (TypeError, ValueError):
+        raise UploadError('offset not specified')
+    limit = min(UPLOAD_CHUNK_SIZE, meta['size'] - offset)
+    if length is not None and length > limit:
+        raise UploadError('chunk too large', 413, _offset(part_path))
+
+    with open(part_path, 'r+b') as f:
+        if fcntl is not None:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                raise UploadError('chunk already in progress', 409, _offset(part_path))
+        current = os.fstat(f.fileno()).st_size
+        if offset != current:
+            raise UploadError('offset mismatch', 409, current)
+
+        with _lock:
+            cached = _hashers.pop(upload_id, None)
+        hasher = cached[1] if cached and cached[0] == offset else None
+        chunk_hasher = hashlib.sha256() if chunk_sha256 else None
+        f.seek(offset)
+        written = 0
+        try:
+            while written <= limit:
+                block = stream.read(min(UPLOAD_STREAM_BLOCK, limit - written + 1))
+                if not block:
+                    break
+                if written + len(block) > limit:
+                    f.truncate(offset + written)
+                    raise UploadError('chunk too large', 413, offset + written)
+                f.write(block)
+                written += len(block)
+                if hasher is not None:
+                    hasher.update(block)
+                if chunk_hasher is not None:
+                    chunk_hasher.update(block)
+        finally:
+            f.flush()
+
+        if chunk_hasher is not None and chunk_hasher.hexdigest() != str(chunk_sha256).lower():
+            f.truncate(offset)
+            raise UploadError('chunk checksum mismatch', 400, offset)
+        if hasher is not None:
+            with _lock:
+                _hashers[upload_id] = (offset + written, hasher)
+    return {'upload_id': upload_id, 'offset': offset + written, 'size': meta['size'],
+            'chunk_size': UPLOAD_CHUNK_SIZE}
+
+
+def finish_upload(staging_folder, upload_folder, upload_id, user_id, sha256=None):
+    # Verify size and checksum, then move the file into place and record it as the user's upload
+    # Returns {'url', 'type', 'filename', 'size', 'sha256'} with the same URL scheme as /upload_file
+    # Caller commits
+    meta, part_path = _read_meta(staging_folder, upload_id, user_id)
+    offset = _offset(part_path)
+    if offset != meta['size']:
+        raise UploadError('upload incomplete', 409, offset)
+
+    with _lock:
+        cached = _hashers.pop(upload_id, None)
+    if cached and cached[0] == offset:
+        digest = cached[1].hexdigest()
+    elif _eventlet_mode():
+        # Re-reading a multi-GB file must not stall the event loop
+        from eventlet import tpool
+        digest = tpool.execute(hash_file, part_path)[0]
+    else:
+        digest = hash_file(part_path)[0]
+    expected = [str(value).lower() for value in (meta.get('sha256'), sha256) if value]
+    if any(value != digest for value in expected):
+        _remove_session(staging_folder, upload_id)
+        raise UploadError('checksum mismatch', 400)
+
+    # Filed under its hash like every other upload; the original name is returned for display
+    subfolder, filetype = upload_subfolder(meta['filename'])
+    mime_type, width, height = describe_file(part_path, meta['filename'])
+    url = store_file(part_path, digest, offset, subfolder, file_extension(meta['filename']), upload_folder)
+    record_upload(user_id, url, meta['filename'], offset, digest, mime_type, width, height)
+    _remove_session(staging_folder, upload_id)
+    return {
+        'url': url,
+        'type': filetype,
+        'filename': meta['filename'],
+        'size': offset,
+        'sha256': digest
+    }
+
+
+def cancel_upload(staging_folder, upload_id, user_id):
+    # Drop a session and its staged bytes
+    _read_meta(staging_folder, upload_id, user_id)
+    _remove_session(staging_folder, upload_id)
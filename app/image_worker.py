@@ -0,0 +1,54 @@
+# Image processing worker process
+# Started by app/functions/images.py as `python app/image_worker.py` (it imports nothing from the app,
+# so workers start fast and a crashing decoder only takes this process down). Reads one JSON job per
+# line on stdin and answers one JSON line on stdout:
+#   {"op": "square" | "fit", "src": path, "dst": path, "size": [w, h], "max_pixels": n}
+#   -> {"ok": true, "changed": bool, "width": w, "height": h}  or  {"ok": false, "error": "..."}
+# "square" crops to a square and shrinks it to `size` (stickers), "fit" shrinks to fit within `size`
+# (avatars, icons). Images are never enlarged; when nothing changes `dst` is not written.
+
+import json
+import sys
+from PIL import Image
+
+
+def process(op, src, dst, size, max_pixels):
+    # Run one job; returns the reply
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    with Image.open(src) as img:
+        # Dimensions come from the header: refuse before decoding anything
+        if img.width * img.height > max_pixels:
+            return {'ok': False, 'error': f'image too large ({img.width}x{img.height})'}
+        image_format = img.format
+        # Animated images would lose every frame but the first
+        if getattr(img, 'is_animated', False):
+            return {'ok': True, 'changed': False, 'width': img.width, 'height': img.height}
+        width, height = size
+        if op == 'square':
+            side = min(img.size)
+            if img.width == img.height and side <= min(width, height):
+                return {'ok': True, 'changed': False, 'width': img.width, 'height': img.height}
+            img = img.crop((0, 0, side, side))
+        elif op == 'fit':
+            if img.width <= width and img.height <= height:
+                return {'ok': True, 'changed': False, 'width': img.width, 'height': img.height}
+        else:
+            return {'ok': False, 'error': f'unknown operation {op!r}'}
+        img.thumbnail((width, height), Image.Resampling.LANCZOS)
+        img.save(dst, format=image_format)
+        return {'ok': True, 'changed': True, 'width': img.width, 'height': img.height}
+
+
+def main():
+    for line in sys.stdin:
+        try:
+            job = json.loads(line)
+            reply = process(job['op'], job['src'], job['dst'], job['size'], job['max_pixels'])
+        except Exception as e:
+            reply = {'ok': False, 'error': f'{type(e).__name__}: {e}'}
+        sys.stdout.write(json.dumps(reply) + '\n')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
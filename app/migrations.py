@@ -0,0 +1,329 @@
+# Versioned schema migrations
+# Applied versions are recorded in `schema_version`; on boot only MAX(version) is compared with the
+# latest migration below, so startup cost does not depend on the size or shape of the database.
+# Every migration must be idempotent: a run interrupted by a crash is simply retried.
+# Batched migrations receive a cursor and return the next one (None when finished); the cursor is
+# committed together with each batch in `schema_migration_progress`, so long backfills resume.
+
+from datetime import datetime
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, inspect, text, select, func
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from app.extensions import db
+from config import MIGRATION_BATCH_SIZE
+
+_metadata = MetaData()
+
+schema_version = Table(
+    'schema_version', _metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False)
+)
+
+migration_progress = Table(
+    'schema_migration_progress', _metadata,
+    Column('version', Integer, primary_key=True),
+    Column('cursor', Integer, nullable=False)
+)
+
+MIGRATIONS = []  # (version, description, func, batched), ordered by version
+
+
+def migration(version, description, batched=False):
+    # Register a migration step
+    def decorator(func):
+        MIGRATIONS.append((version, description, func, batched))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+
+def latest_version():
+    # Version the code expects
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version():
+    # Highest applied version, or None for databases that predate the version table
+    try:
+        return db.session.execute(select(func.max(schema_version.c.version))).scalar() or 0
+    except (OperationalError, ProgrammingError):
+        db.session.rollback()
+        return None
+
+
+def pending_migrations(version=None):
+    # Migrations newer than `version` (defaults to the current one)
+    if version is None:
+        version = current_version() or 0
+    return [m for m in MIGRATIONS if m[0] > version]
+
+
+def batch_progress():
+    # {version: cursor} of batched migrations that were interrupted
+    try:
+        rows = db.session.execute(select(migration_progress.c.version, migration_progress.c.cursor)).all()
+    except (OperationalError, ProgrammingError):
+        db.session.rollback()
+        return {}
+    return {version: cursor for version, cursor in rows}
+
+
+def run_migrations():
+    # Bring the schema up to date; returns the number of migrations applied
+    version = current_version()
+    if version is not None and version >= latest_version():
+        return 0
+
+    if version is None:
+        existing_tables = inspect(db.engine).get_table_names()
+        _metadata.create_all(db.engine)
+        if not existing_tables:
+            # New database: the models already describe the latest schema
+            print("База данных не найдена, создаем новую...")
+            db.create_all()
+            for v, description, _, _ in MIGRATIONS:
+                _record_version(v, description)
+            db.session.commit()
+            print("База данных успешно создана!")
+            return 0
+        print("[MIGRATION] Database has no schema version yet, upgrading from baseline")
+        version = 0
+
+    applied = 0
+    for v, description, apply, batched in pending_migrations(version):
+        print(f"[MIGRATION] Applying {v}: {description}")
+        try:
+            if batched:
+                _run_batched(v, apply)
+            else:
+                apply()
+            _record_version(v, description)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"[MIGRATION] ✗ Migration {v} failed, database left at version {v - 1}: {e}")
+            raise
+        applied += 1
+    print(f"[MIGRATION] ✓ Schema is at version {latest_version()}")
+    return applied
+
+
+def _record_version(version, description):
+    # Mark a migration as applied; caller commits
+    db.session.execute(schema_version.insert().values(
+        version=version, description=description, applied_at=datetime.utcnow()
+    ))
+
+
+def _run_batched(version, apply):
+    # Drive a batched migration to completion, committing the cursor after every batch
+    cursor = db.session.execute(
+        select(migration_progress.c.cursor).where(migration_progress.c.version == version)
+    ).scalar()
+    if cursor is not None:
+        print(f"[MIGRATION] Resuming {version} after {cursor}")
+    cursor = cursor or 0
+    while True:
+        next_cursor = apply(cursor, MIGRATION_BATCH_SIZE)
+        if next_cursor is None:
+            break
+        db.session.execute(migration_progress.delete().where(migration_progress.c.version == version))
+        db.session.execute(migration_progress.insert().values(version=version, cursor=next_cursor))
+        db.session.commit()
+        cursor = next_cursor
+    db.session.execute(migration_progress.delete().where(migration_progress.c.version == version))
+
+
+# --- HELPERS ---
+
+def _quote(name):
+    return db.engine.dialect.identifier_preparer.quote(name)
+
+
+def _add_column(table, column, ddl):
+    # ALTER TABLE ... ADD COLUMN unless the column already exists
+    columns = [c['name'] for c in inspect(db.engine).get_columns(table)]
+    if column in columns:
+        return
+    db.session.execute(text(f"ALTER TABLE {_quote(table)} ADD COLUMN {column} {ddl}"))
+    print(f"[MIGRATION] Added column {table}.{column}")
+
+
+def _remove_duplicates(table, columns, keep='MIN'):
+    # Delete rows sharing the same `columns`, keeping the MIN or MAX id of each group
+    cols = ', '.join(columns)
+    result = db.session.execute(text(
+        f"DELETE FROM {_quote(table)} WHERE id NOT IN ("
+        f"SELECT keep_id FROM (SELECT {keep}(id) AS keep_id FROM {_quote(table)} GROUP BY {cols}) AS keep)"
+    ))
+    if result.rowcount:
+        print(f"[MIGRATION] Removed {result.rowcount} duplicate rows from {table} ({cols})")
+
+
+def _index_names(inspector):
+    # Names of every index in the database
+    # (SQLite's inspector leaves out expression indexes such as lower(username), so ask sqlite_master)
+    if db.engine.dialect.name == 'sqlite':
+        return {row[0] for row in db.session.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+    return {ix['name'] for table in inspector.get_table_names() for ix in inspector.get_indexes(table)}
+
+
+def _create_missing_indexes():
+    # Create indexes declared on the models that existing tables lack
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    existing = _index_names(inspector)
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.session.connection())
+                print(f"[MIGRATION] Created index {index.name}")
+
+
+# --- MIGRATIONS ---
+# Databases created before versioning run all of these once; keep every step idempotent.
+
+@migration(1, 'Create tables missing from older databases')
+def _create_tables():
+    from app import models  # noqa: register every model on the metadata
+    db.create_all()
+
+
+@migration(2, 'Add message.edited_at and message.reply_to_id')
+def _message_columns():
+    _add_column('message', 'edited_at', 'DATETIME')
+    _add_column('message', 'reply_to_id', 'INTEGER REFERENCES message (id)')
+
+
+@migration(3, 'Add room.invite_token')
+def _room_invite_token():
+    _add_column('room', 'invite_token', 'VARCHAR(100)')
+
+
+@migration(4, 'Add user presence columns')
+def _user_presence_columns():
+    _add_column('user', 'presence_status', "VARCHAR(20) DEFAULT 'offline'")
+    _add_column('user', 'last_seen', 'DATETIME')
+    _add_column('user', 'hide_status', 'BOOLEAN DEFAULT 0')
+
+
+@migration(5, 'Add user ban columns')
+def _user_ban_columns():
+    _add_column('user', 'is_banned', 'BOOLEAN DEFAULT 0')
+    _add_column('user', 'banned_ips', "TEXT DEFAULT ''")
+    _add_column('user', 'ban_reason', 'VARCHAR(500)')
+    _add_column('user', 'banned_at', 'DATETIME')
+
+
+@migration(6, "Move Member.role='banned' rows to room_ban")
+def _banned_members_to_room_ban():
+    from sqlalchemy import literal, exists
+    from app.models import Member, RoomBan
+
+    banned = select(
+        Member.room_id, Member.user_id,
+        literal('Converted from Member.role=banned'), literal(datetime.utcnow())
+    ).where(
+        Member.role == 'banned',
+        ~exists().where(RoomBan.user_id == Member.user_id, RoomBan.room_id == Member.room_id)
+    )
+    db.session.execute(RoomBan.__table__.insert().from_select(
+        ['room_id', 'user_id', 'reason', 'banned_at'], banned
+    ))
+    Member.query.filter_by(role='banned').delete(synchronize_session=False)
+
+
+@migration(7, 'Deduplicate rows and create hot-path indexes')
+def _hot_path_indexes():
+    # Keep the first membership/ban/reaction and the latest read marker
+    _remove_duplicates('member', ('user_id', 'room_id'))
+    _remove_duplicates('room_ban', ('user_id', 'room_id'))
+    _remove_duplicates('message_reaction', ('message_id', 'user_id', 'emoji'))
+    _remove_duplicates('read_message', ('user_id', 'channel_id'), keep='MAX')
+    _create_missing_indexes()
+
+
+@migration(8, 'Backfill unread counters', batched=True)
+def _backfill_unread(cursor, batch_size):
+    from app.models import Channel
+    from app.functions import rebuild_unread
+
+    channel_ids = [row[0] for row in db.session.query(Channel.id).filter(
+        Channel.id > cursor
+    ).order_by(Channel.id.asc()).limit(batch_size)]
+    if not channel_ids:
+        return None
+    rebuild_unread(channel_ids)
+    return channel_ids[-1]
+
+
+@migration(9, 'Create the message full-text index')
+def _message_fts():
+    from app.models import create_message_fts, rebuild_message_fts
+
+    connection = db.session.connection()
+    if create_message_fts(connection):
+        # One statement re-reads every message, so an interrupted run is simply repeated
+        rebuild_message_fts(connection)
+
+
+@migration(10, 'Create username and room name search indexes')
+def _name_search():
+    from app.models import create_name_search, rebuild_name_search
+
+    _create_missing_indexes()
+    connection = db.session.connection()
+    if create_name_search(connection):
+        rebuild_name_search(connection)
+
+
+@migration(11, 'Move User.banned_ips into the banned_ip table', batched=True)
+def _banned_ips_table(cursor, batch_size):
+    from app.models import User, BannedIP
+    from app.functions import add_ip_ban
+
+    BannedIP.__table__.create(db.session.connection(), checkfirst=True)
+    users = User.query.filter(
+        User.id > cursor, User.banned_ips.isnot(None), User.banned_ips != ''
+    ).order_by(User.id.asc()).limit(batch_size).all()
+    if not users:
+        return None
+    for user in users:
+        for value in user.banned_ips.split(','):
+            if not value.strip():
+                continue
+            try:
+                add_ip_ban(value, user_id=user.id, reason=user.ban_reason)
+            except ValueError:
+                print(f"[MIGRATION] Skipped invalid banned IP {value.strip()!r} of user {user.id}")
+        db.session.flush()
+    return users[-1].id
+
+
+@migration(12, 'Create and fill reaction counters')
+def _reaction_counts():
+    from app.models import ReactionCount
+    from app.functions import rebuild_reaction_counts
+
+    ReactionCount.__table__.create(db.session.connection(), checkfirst=True)
+    # One statement recounts every message, so an interrupted run is simply repeated
+    rebuild_reaction_counts()
+
+
+@migration(13, 'Create the stored file registry')
+def _stored_files():
+    from app.models import StoredFile
+
+    StoredFile.__table__.create(db.session.connection(), checkfirst=True)
+    # Files uploaded before content addressing are converted by tools/migration/dedup_uploads.py
+
+
+@migration(14, 'Create the upload registry')
+def _uploads():
+    from app.models import Upload
+
+    Upload.__table__.create(db.session.connection(), checkfirst=True)
+    # Existing messages keep their files; only uploads registered from now on can be attached to new ones
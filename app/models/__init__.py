@@ -1,12 +1,24 @@
 # Models package
 # Import all models here for convenience
 
-from app.models.user import User, UserMusic
+from app.models.user import User, UserMusic, BannedIP
 from app.models.chat import Room, Channel, Member, RoomBan
-from app.models.content import Message, MessageReaction, ReadMessage, StickerPack, Sticker
+from app.models.content import (
+    Message, MessageReaction, ReadMessage, StickerPack, Sticker, UnreadCounter,
+    MessageChange, ReactionCount
+)
+from app.models.storage import StoredFile, Upload
+from app.models.search import (
+    MESSAGE_FTS_TABLE, USER_NAME_FTS_TABLE, ROOM_NAME_FTS_TABLE,
+    create_message_fts, rebuild_message_fts, create_name_search, rebuild_name_search
+)
 
 __all__ = [
-    'User', 'UserMusic',
+    'User', 'UserMusic', 'BannedIP',
     'Room', 'Channel', 'Member', 'RoomBan',
-    'Message', 'MessageReaction', 'ReadMessage', 'StickerPack', 'Sticker'
+    'Message', 'MessageReaction', 'ReadMessage', 'StickerPack', 'Sticker',
+    'UnreadCounter', 'MessageChange', 'ReactionCount',
+    'StoredFile', 'Upload',
+    'MESSAGE_FTS_TABLE', 'USER_NAME_FTS_TABLE', 'ROOM_NAME_FTS_TABLE',
+    'create_message_fts', 'rebuild_message_fts', 'create_name_search', 'rebuild_name_search'
 ]
@@ -3,6 +3,10 @@ from app.extensions import db
 
 class Room(db.Model):
     # Chat room (server, DM, or broadcast)
+    __table_args__ = (
+        # Case-insensitive prefix search (app/functions/directory.py)
+        db.Index('ix_room_name_lower', db.text('lower(name)')),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(150))
     type = db.Column(db.String(20), nullable=False)  # 'dm', 'server', 'broadcast'
@@ -20,6 +24,9 @@ class Room(db.Model):
 
 class Channel(db.Model):
     # Channel within a room
+    __table_args__ = (
+        db.Index('ix_channel_room_id', 'room_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False)
@@ -32,6 +39,11 @@ class Channel(db.Model):
 
 class Member(db.Model):
     # Room membership
+    __table_args__ = (
+        # One membership per user and room; also serves "rooms of a user" lookups
+        db.Index('uq_member_user_room', 'user_id', 'room_id', unique=True),
+        db.Index('ix_member_room_id', 'room_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     room_id = db.Column(db.Integer, db.ForeignKey('room.id', ondelete='CASCADE'), nullable=False)
@@ -39,6 +51,10 @@ class Member(db.Model):
 
 class RoomBan(db.Model):
     # Room ban record (separate from membership)
+    __table_args__ = (
+        db.Index('uq_room_ban_user_room', 'user_id', 'room_id', unique=True),
+        db.Index('ix_room_ban_room_id', 'room_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     room_id = db.Column(db.Integer, db.ForeignKey('room.id', ondelete='CASCADE'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
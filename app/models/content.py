@@ -5,6 +5,12 @@ from app.extensions import db
 
 class Message(db.Model):
     # Chat message
+    __table_args__ = (
+        # Keyset cursor for paging a channel's history
+        db.Index('ix_message_channel_id_id', 'channel_id', 'id'),
+        # Per-user lookups within a channel (moderation, bulk deletes)
+        db.Index('ix_message_user_id_channel_id', 'user_id', 'channel_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
@@ -26,6 +32,10 @@ class Message(db.Model):
 
 class MessageReaction(db.Model):
     # Message reactions (emojis and stickers, stickers is not implemented yet)
+    __table_args__ = (
+        # A user reacts with a given emoji once; also serves "reactions of a message" lookups
+        db.Index('uq_message_reaction_message_user_emoji', 'message_id', 'user_id', 'emoji', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -35,8 +45,24 @@ class MessageReaction(db.Model):
     # Relationships
     user = db.relationship('User', backref='reactions')
 
+class ReactionCount(db.Model):
+    # Materialized reaction count per (message, emoji), maintained by the reaction toggle
+    __table_args__ = (
+        db.UniqueConstraint('message_id', 'emoji', name='uq_reaction_count_message_emoji'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('message.id', ondelete='CASCADE'), nullable=False)
+    emoji = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    # Relationships
+    message = db.relationship('Message', backref=db.backref('reaction_counts', cascade='all, delete-orphan'))
+
 class ReadMessage(db.Model):
     #Track read messages in channels
+    __table_args__ = (
+        db.Index('uq_read_message_user_channel', 'user_id', 'channel_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     channel_id = db.Column(db.Integer, db.ForeignKey('channel.id'), nullable=False)
@@ -70,3 +96,30 @@ class Sticker(db.Model):
     
     # Relationships
     owner = db.relationship('User', backref='stickers')
+
+class UnreadCounter(db.Model):
+    # Materialized unread message count per (user, channel), maintained on send and reset on read
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'channel_id', name='uq_unread_counter_user_channel'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    channel_id = db.Column(db.Integer, db.ForeignKey('channel.id', ondelete='CASCADE'), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    # Relationships
+    channel = db.relationship('Channel', backref=db.backref('unread_counters', cascade='all, delete-orphan'))
+
+class MessageChange(db.Model):
+    # Append-only log of message creates, edits, reaction changes and deletes; its id is the delta-sync token
+    __table_args__ = (
+        db.Index('ix_message_change_channel_id_id', 'channel_id', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    channel_id = db.Column(db.Integer, db.ForeignKey('channel.id', ondelete='CASCADE'), nullable=False)
+    message_id = db.Column(db.Integer, nullable=False)  # no FK: deleted messages keep their tombstone
+    change = db.Column(db.String(20), nullable=False)  # 'created', 'edited', 'reacted', 'deleted'
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    channel = db.relationship('Channel', backref=db.backref('message_changes', cascade='all, delete-orphan'))
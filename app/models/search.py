@@ -0,0 +1,109 @@
+# Full-text indexes (SQLite FTS5)
+# Each index is an external-content FTS5 table: it stores only the index and reads text back from the
+# base table. Triggers keep it in sync on every insert, edit and delete, including bulk deletes that
+# bypass the ORM. New databases get them from create_all; existing ones from migrations 9 and 10.
+# - message_fts: words of message content and file names (message search)
+# - user_name_fts / room_name_fts: trigrams of usernames and room names (substring name search)
+
+from sqlalchemy import event, text
+from app.models.user import User
+from app.models.chat import Room
+from app.models.content import Message
+
+MESSAGE_FTS_TABLE = 'message_fts'
+USER_NAME_FTS_TABLE = 'user_name_fts'
+ROOM_NAME_FTS_TABLE = 'room_name_fts'
+
+MESSAGE_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5("
+    "content, file_name, content='message', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_ai AFTER INSERT ON message BEGIN "
+    "INSERT INTO message_fts (rowid, content, file_name) VALUES (new.id, new.content, new.file_name); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_ad AFTER DELETE ON message BEGIN "
+    "INSERT INTO message_fts (message_fts, rowid, content, file_name) "
+    "VALUES ('delete', old.id, old.content, old.file_name); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_au AFTER UPDATE OF content, file_name ON message BEGIN "
+    "INSERT INTO message_fts (message_fts, rowid, content, file_name) "
+    "VALUES ('delete', old.id, old.content, old.file_name); "
+    "INSERT INTO message_fts (rowid, content, file_name) VALUES (new.id, new.content, new.file_name); "
+    "END",
+]
+
+
+def _name_fts_ddl(fts_table, table, column):
+    # Trigram index over one name column plus its sync triggers
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5("
+        f"{column}, content='{table}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON \"{table}\" BEGIN "
+        f"INSERT INTO {fts_table} (rowid, {column}) VALUES (new.id, new.{column}); "
+        f"END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON \"{table}\" BEGIN "
+        f"INSERT INTO {fts_table} ({fts_table}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+        f"END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {column} ON \"{table}\" BEGIN "
+        f"INSERT INTO {fts_table} ({fts_table}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+        f"INSERT INTO {fts_table} (rowid, {column}) VALUES (new.id, new.{column}); "
+        f"END",
+    ]
+
+
+USER_NAME_FTS_DDL = _name_fts_ddl(USER_NAME_FTS_TABLE, 'user', 'username')
+ROOM_NAME_FTS_DDL = _name_fts_ddl(ROOM_NAME_FTS_TABLE, 'room', 'name')
+
+
+def create_message_fts(connection):
+    # Create the index table and its sync triggers (idempotent, SQLite only)
+    if connection.dialect.name != 'sqlite':
+        return False
+    for statement in MESSAGE_FTS_DDL:
+        connection.execute(text(statement))
+    return True
+
+
+def rebuild_message_fts(connection):
+    # Re-index every message from the content table
+    if connection.dialect.name != 'sqlite':
+        return False
+    connection.execute(text("INSERT INTO message_fts (message_fts) VALUES ('rebuild')"))
+    return True
+
+
+def create_name_search(connection):
+    # Create the username/room name trigram indexes and their sync triggers (idempotent, SQLite only)
+    if connection.dialect.name != 'sqlite':
+        return False
+    for statement in USER_NAME_FTS_DDL + ROOM_NAME_FTS_DDL:
+        connection.execute(text(statement))
+    return True
+
+
+def rebuild_name_search(connection):
+    # Re-index every username and room name
+    if connection.dialect.name != 'sqlite':
+        return False
+    for fts_table in (USER_NAME_FTS_TABLE, ROOM_NAME_FTS_TABLE):
+        connection.execute(text(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')"))
+    return True
+
+
+@event.listens_for(Message.__table__, 'after_create')
+def _after_message_create(target, connection, **kw):
+    create_message_fts(connection)
+
+
+@event.listens_for(User.__table__, 'after_create')
+def _after_user_create(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        for statement in USER_NAME_FTS_DDL:
+            connection.execute(text(statement))
+
+
+@event.listens_for(Room.__table__, 'after_create')
+def _after_room_create(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        for statement in ROOM_NAME_FTS_DDL:
+            connection.execute(text(statement))
@@ -0,0 +1,41 @@
+# Upload storage models: content-addressed files, their reference counts and who uploaded them
+
+from datetime import datetime
+from app.extensions import db
+
+class StoredFile(db.Model):
+    # One stored copy of an uploaded file, shared by every row that links to `url`
+    # ref_count counts Message/UserMusic/Sticker file URLs and user/room/channel avatar URLs
+    # (maintained by app/functions/storage.py); files left at 0 are swept after a grace period
+    __tablename__ = 'stored_file'
+    __table_args__ = (
+        db.Index('ix_stored_file_sha256', 'sha256'),
+        db.Index('ix_stored_file_ref_count', 'ref_count', 'last_used_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    url = db.Column(db.String(500), nullable=False, unique=True)  # /uploads/<subfolder>/<sha256>.<ext>
+    sha256 = db.Column(db.String(64), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Last upload or reference change; unreferenced files younger than the grace period are kept
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Upload(db.Model):
+    # One user's upload of a stored file: who uploaded it and what it is
+    # Messages may only attach files their sender uploaded (one lookup on the unique index)
+    __tablename__ = 'upload'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'url', name='uq_upload_user_url'),
+        db.Index('ix_upload_url', 'url'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    url = db.Column(db.String(500), nullable=False)  # StoredFile.url
+    file_name = db.Column(db.String(200), nullable=False)  # original name, for display
+    size = db.Column(db.BigInteger, nullable=False)
+    mime_type = db.Column(db.String(100), nullable=False)
+    sha256 = db.Column(db.String(64), nullable=False)
+    width = db.Column(db.Integer, nullable=True)  # images only
+    height = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
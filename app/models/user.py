@@ -6,6 +6,10 @@ from app.extensions import db
 
 class User(UserMixin, db.Model):
     # User model with profile and privacy settings
+    __table_args__ = (
+        # Case-insensitive prefix search (app/functions/directory.py); usernames are ASCII
+        db.Index('ix_user_username_lower', db.text('lower(username)')),
+    )
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(150), unique=True, nullable=False)
     password = db.Column(db.String(150), nullable=False)
@@ -29,7 +33,7 @@ class User(UserMixin, db.Model):
     
     # Ban management
     is_banned = db.Column(db.Boolean, default=False)  # Global ban status
-    banned_ips = db.Column(db.Text, default="")  # Comma-separated list of banned IPs
+    banned_ips = db.Column(db.Text, default="")  # Legacy comma-separated IPs, moved to BannedIP (migration 11)
     ban_reason = db.Column(db.String(500), nullable=True)
     banned_at = db.Column(db.DateTime, nullable=True)
     
@@ -46,3 +50,17 @@ class UserMusic(db.Model):
     file_url = db.Column(db.String(500), nullable=False)
     cover_url = db.Column(db.String(500), nullable=True)
     added_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class BannedIP(db.Model):
+    # Banned IP address or CIDR range, optionally tied to the banned user
+    __tablename__ = 'banned_ip'
+    __table_args__ = (
+        db.Index('ix_banned_ip_user_id', 'user_id'),
+        db.Index('ix_banned_ip_network', 'network'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    network = db.Column(db.String(64), nullable=False)  # canonical CIDR, e.g. '203.0.113.7/32'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    banned_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    reason = db.Column(db.String(500), nullable=True)
+    banned_at = db.Column(db.DateTime, default=datetime.utcnow)
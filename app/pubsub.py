@@ -0,0 +1,202 @@
+# Socket.IO message queue backends for multi-worker deployments
+# Every `socketio.emit` is published to the queue so clients connected to other workers receive it.
+# `SOCKETIO_MESSAGE_QUEUE` selects the backend:
+#   memory://                  in-process bus (tests, several Socket.IO servers in one process)
+#   unix:///path/to/boxchat.sock  local broker over a Unix socket (started by run_workers.py)
+#   redis://, amqp://, kafka://, zmq+tcp://  handled natively by Flask-SocketIO
+
+import os
+import socket
+import threading
+import socketio
+
+
+class LocalManager(socketio.PubSubManager):
+    # In-process backend: managers created in the same process on the same channel share one bus
+    name = 'local'
+    _buses = {}
+    _buses_lock = threading.Lock()
+
+    def __init__(self, url='memory://', channel='socketio', write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self._queue = None
+
+    def initialize(self):
+        if not self.write_only:
+            self._queue = self.server.eio.create_queue()
+            with LocalManager._buses_lock:
+                LocalManager._buses.setdefault(self.channel, []).append(self._queue)
+        super().initialize()
+
+    def _publish(self, data):
+        with LocalManager._buses_lock:
+            queues = list(LocalManager._buses.get(self.channel, []))
+        for q in queues:
+            if q is not self._queue:
+                q.put(data)
+
+    def _listen(self):
+        while True:
+            yield self._queue.get()
+
+
+class UnixSocketManager(socketio.PubSubManager):
+    # Backend that talks to a UnixSocketBroker; each message is one "<channel> <json>\n" line
+    name = 'unix'
+
+    def __init__(self, url='unix:///tmp/boxchat.sock', channel='socketio', write_only=False, logger=None, json=None):
+        self.path = url[len('unix://'):] if url.startswith('unix://') else url
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self._prefix = (self.channel + ' ').encode('utf-8')
+        self._send_sock = None
+        self._send_lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        return sock
+
+    def _publish(self, data):
+        line = self._prefix + self.json.dumps(data).encode('utf-8') + b'\n'
+        with self._send_lock:
+            for retries_left in range(1, -1, -1):  # 2 attempts
+                try:
+                    if self._send_sock is None:
+                        self._send_sock = self._connect()
+                    self._send_sock.sendall(line)
+                    return
+                except OSError as e:
+                    self._send_sock = None
+                    if retries_left == 0:
+                        self._get_logger().error(f'Cannot publish to {self.path}: {e}')
+
+    def _listen(self):
+        retry_sleep = 1
+        while True:
+            try:
+                sock = self._connect()
+                retry_sleep = 1
+                with sock.makefile('rb') as stream:
+                    for line in stream:
+                        if line.startswith(self._prefix):
+                            yield line[len(self._prefix):].decode('utf-8')
+            except OSError as e:
+                self._get_logger().error(f'Cannot receive from {self.path}, retrying in {retry_sleep} secs: {e}')
+            self.server.sleep(retry_sleep)
+            retry_sleep = min(retry_sleep * 2, 30)
+
+
+class UnixSocketBroker:
+    # Minimal fan-out broker: every line received from one connection is sent to all others
+
+    def __init__(self, path):
+        self.path = path
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._server = None
+
+    def serve_forever(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        self._server.listen(128)
+        while True:
+            conn, _ = self._server.accept()
+            threading.Thread(target=self._serve_client, args=(conn,), daemon=True).start()
+
+    def start(self):
+        # Run the broker in a background thread and return it
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def _serve_client(self, conn):
+        with self._lock:
+            self._clients.add(conn)
+        try:
+            with conn.makefile('rb') as stream:
+                for line in stream:
+                    with self._lock:
+                        targets = [c for c in self._clients if c is not conn]
+                    for target in targets:
+                        try:
+                            target.sendall(line)
+                        except OSError:
+                            self._drop(target)
+        except OSError:
+            pass
+        finally:
+            self._drop(conn)
+
+    def _drop(self, conn):
+        with self._lock:
+            self._clients.discard(conn)
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+
+def create_client_manager(url, channel='boxchat', write_only=False):
+    # Build a client manager for BoxChat's own queue URLs
+    # Returns None for URLs that Flask-SocketIO understands natively (pass those as `message_queue`)
+    if not url:
+        return None
+    if url.startswith('memory://'):
+        return LocalManager(url, channel=channel, write_only=write_only)
+    if url.startswith('unix://'):
+        return UnixSocketManager(url, channel=channel, write_only=write_only)
+    return None
+
+
+# --- CLUSTER EVENTS ---
+# Server-to-server notifications (cache invalidations) ride on the same queue as client emits: they
+# are emitted on a namespace no client connects to and intercepted by every worker's manager.
+
+CLUSTER_NAMESPACE = '/_cluster'
+_cluster_handlers = {}
+
+
+def on_cluster_event(name, handler):
+    # Register `handler(payload)` for a cluster event (runs in every worker, the sender included)
+    _cluster_handlers.setdefault(name, []).append(handler)
+
+
+def _dispatch_cluster_event(name, payload):
+    for handler in _cluster_handlers.get(name, ()):
+        try:
+            handler(payload)
+        except Exception as e:
+            print(f"[CLUSTER] Handler for {name} failed: {e}")
+
+
+def install_cluster_listener(server):
+    # Hook a Socket.IO server's queue manager so cluster events reach the registered handlers
+    # Returns False for single-process servers (cluster events then only run locally)
+    manager = server.manager
+    if not isinstance(manager, socketio.PubSubManager):
+        return False
+    if getattr(manager, 'cluster_events', False):
+        return True
+    handle_emit = manager._handle_emit
+
+    def _handle_emit(message):
+        if message.get('namespace') != CLUSTER_NAMESPACE:
+            return handle_emit(message)
+        data = message.get('data')
+        if isinstance(data, list):
+            data = data[0] if data else None
+        _dispatch_cluster_event(message.get('event'), data)
+
+    manager._handle_emit = _handle_emit
+    manager.cluster_events = True
+    return True
+
+
+def publish_cluster_event(server, name, payload):
+    # Run the handlers of `name` in this worker and in every other worker sharing the queue
+    if server is not None and getattr(server.manager, 'cluster_events', False):
+        server.emit(name, payload, namespace=CLUSTER_NAMESPACE)
+    else:
+        _dispatch_cluster_event(name, payload)
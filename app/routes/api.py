@@ -1,35 +1,74 @@
 # API routes (uploads, settings, channel management, message actions)
 
 import os
-from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash, send_from_directory, current_app
+from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash, current_app, abort
 from flask_login import login_required, current_user
-from werkzeug.security import check_password_hash, generate_password_hash
 from datetime import datetime
 from app.extensions import db, socketio
 from app.models import (
     User, Room, Channel, Member, Message, UserMusic,
-    MessageReaction, ReadMessage, RoomBan
+    MessageReaction, ReadMessage, RoomBan, UnreadCounter, BannedIP, Upload
 )
-from app.functions import save_uploaded_file, resize_image, is_image_file, is_music_file, is_video_file
+from app.functions import (
+    save_uploaded_file, queue_image_job, image_pool_stats, is_music_file, upload_subfolder, clean_filename,
+    UploadError, start_upload, upload_status, write_chunk, finish_upload, cancel_upload,
+    discard_upload, is_stored_url,
+    increment_unread, reset_unread, discount_unread, rebuild_unread, get_room_unread_counts,
+    get_dm_list, invalidate_dm_list, invalidate_dm_room,
+    load_message_page, load_messages_around, attach_message_extras, serialize_message,
+    log_message_change, log_bulk_deletion, current_sync_token, load_changes_since,
+    search_available, search_messages, find_users, find_rooms,
+    add_ip_ban, remove_user_ip_bans, invalidate_ip_bans, list_ip_bans,
+    hash_password, verify_password, password_pool_stats, PasswordPoolBusy, login_throttle_stats,
+    get_room_access, get_member_role, get_channel_room,
+    toggle_reaction, reaction_delta, delete_message_reactions, rebuild_reaction_counts
+)
+from app.file_storage import get_storage
+from app.sockets.presence import publish_presence, set_status, presence_of
 
 api_bp = Blueprint('api', __name__)
 
+# Cache lifetime of content-addressed uploads (one year)
+STORED_FILE_MAX_AGE = 365 * 24 * 60 * 60
+
+@api_bp.errorhandler(PasswordPoolBusy)
+def password_pool_busy(e):
+    # Password hashing pool is saturated (login storm); the client should retry shortly
+    return jsonify({'error': 'server is busy, try again in a moment'}), 503
+
 # Helper functions
 def get_role(user_id, room_id):
-    # Get user role in room
-    member = Member.query.filter_by(user_id=user_id, room_id=room_id).first()
-    return member.role if member else None
+    # Get user role in room (served from the room access cache)
+    return get_member_role(user_id, room_id)
 
 
-def save_file(file, subfolder='files'):
+def save_file(file, subfolder='files', owner_id=None):
     # Wrapper for save_uploaded_file that uses current_app's upload folder
-    return save_uploaded_file(file, subfolder, current_app.config['UPLOAD_FOLDER'])
+    return save_uploaded_file(file, subfolder, current_app.config['UPLOAD_FOLDER'], owner_id)
+
+
+def process_image(url, kind, target):
+    # Queue the background resize of a just-committed image (see app/functions/images.py)
+    return queue_image_job(get_upload_folder(), url, kind, current_user.id, target)
 
 
 def get_upload_folder():
     # Get upload folder from current app config
     return current_app.config.get('UPLOAD_FOLDER', 'uploads')
 
+
+def get_staging_folder():
+    # Folder where chunked uploads are assembled (never served)
+    return current_app.config.get('UPLOAD_STAGING_FOLDER') or get_upload_folder().rstrip('/\\') + '_staging'
+
+
+def upload_error(e):
+    # JSON response for a rejected chunked upload request
+    body = {'error': str(e)}
+    if e.offset is not None:
+        body['offset'] = e.offset
+    return jsonify(body), e.status
+
 # --- CHANNEL MANAGEMENT ---
 
 @api_bp.route('/room/<int:room_id>/add_channel', methods=['POST'])
@@ -63,18 +102,18 @@ def edit_channel(room_id, channel_id):
     channel.description = request.form.get('description', channel.description)
     channel.icon_emoji = request.form.get('icon_emoji', channel.icon_emoji)
     
+    icon_url = None
     if 'icon_file' in request.files:
         file = request.files['icon_file']
         if file and file.filename:
-            filepath = save_file(file, 'channel_icons')
-            if filepath:
-                # Resize to 32x32
-                full_path = os.path.join(get_upload_folder(), 'channel_icons', filepath.split('/')[-1])
-                resize_image(full_path, (32, 32))
-                channel.icon_image_url = filepath
+            icon_url = save_file(file, 'channel_icons')
+            if icon_url:
+                channel.icon_image_url = icon_url
     
     db.session.commit()
-    return jsonify({'success': True})
+    # Resized to 32x32 in the background; 'image_ready' reports the final URL
+    job_id = process_image(icon_url, 'channel_icon', (Channel, channel.id, 'icon_image_url')) if icon_url else None
+    return jsonify({'success': True, 'image_job_id': job_id})
 
 @api_bp.route('/room/<int:room_id>/channel/<int:channel_id>/delete', methods=['POST'])
 @login_required
@@ -112,25 +151,21 @@ def settings():
             if current_user.presence_status != 'away':
                 current_user.presence_status = 'online'
         
+        avatar_url = None
         if 'avatar_file' in request.files:
             file = request.files['avatar_file']
             if file and file.filename:
-                filepath = save_file(file, 'avatars')
-                if filepath:
-                    current_user.avatar_url = filepath
+                avatar_url = save_file(file, 'avatars')
+                if avatar_url:
+                    current_user.avatar_url = avatar_url
         
         db.session.commit()
+        if avatar_url:
+            process_image(avatar_url, 'avatar', (User, current_user.id, 'avatar_url'))
         
         # Notify all members of status change
-        from app.models import Member
-        memberships = Member.query.filter_by(user_id=current_user.id).all()
-        for m in memberships:
-            for ch in m.room.channels:
-                socketio.emit('presence_updated', {
-                    'user_id': current_user.id,
-                    'username': current_user.username,
-                    'status': current_user.presence_status
-                }, room=str(ch.id), skip_sid=None)
+        set_status(current_user.id, current_user.presence_status)
+        publish_presence(current_user.id, current_user.username, current_user.presence_status)
         
         flash('Settings updated')
     
@@ -141,14 +176,8 @@ def settings():
 def delete_user_avatar():
     # Delete user avatar
     if current_user.avatar_url and current_user.avatar_url != "https://via.placeholder.com/50":
-        if current_user.avatar_url.startswith('/uploads/'):
-            try:
-                filename = current_user.avatar_url.lstrip('/uploads/').lstrip('/')
-                abs_path = os.path.join(get_upload_folder(), filename)
-                if os.path.exists(abs_path):
-                    os.remove(abs_path)
-            except:
-                pass
+        # Shared stored files are freed once nothing references them
+        discard_upload(get_upload_folder(), current_user.avatar_url)
         
         current_user.avatar_url = "https://via.placeholder.com/50"
         db.session.commit()
@@ -166,31 +195,32 @@ def delete_user_account():
     if not password:
         return jsonify({'error': 'no password specified'}), 400
     
-    if not check_password_hash(current_user.password, password):
+    if not verify_password(current_user.password, password):
         return jsonify({'error': 'wrond password'}), 403
     
     user_id = current_user.id
     
     try:
-        # Delete user's music
+        # Delete user's music and upload records
         UserMusic.query.filter_by(user_id=user_id).delete()        
-        # Delete reactions
+        Upload.query.filter_by(user_id=user_id).delete()
+        # Delete reactions and recount the messages they were on
+        reacted_message_ids = [m for (m,) in db.session.query(MessageReaction.message_id).filter(MessageReaction.user_id == user_id).distinct().all()]
         MessageReaction.query.filter_by(user_id=user_id).delete()
-        # Delete read messages
+        rebuild_reaction_counts(reacted_message_ids)
+        # Delete read messages and unread counters
         ReadMessage.query.filter_by(user_id=user_id).delete()
+        UnreadCounter.query.filter_by(user_id=user_id).delete()
         # Delete memberships
         Member.query.filter_by(user_id=user_id).delete()
-        # Delete messages
+        # Delete messages and recount the channels they were in
+        affected_channel_ids = [c for (c,) in db.session.query(Message.channel_id).filter(Message.user_id == user_id).distinct().all()]
+        log_bulk_deletion(Message.user_id == user_id)
+        delete_message_reactions(Message.user_id == user_id)
         Message.query.filter_by(user_id=user_id).delete()
+        rebuild_unread(affected_channel_ids)
         # Delete avatar file
-        if current_user.avatar_url and current_user.avatar_url.startswith('/uploads/'):
-            try:
-                filename = current_user.avatar_url.lstrip('/uploads/').lstrip('/')
-                abs_path = os.path.join(get_upload_folder(), filename)
-                if os.path.exists(abs_path):
-                    os.remove(abs_path)
-            except:
-                pass
+        discard_upload(get_upload_folder(), current_user.avatar_url)
         
         # Delete account
         from flask_login import logout_user
@@ -219,14 +249,17 @@ def room_settings(room_id):
     if request.method == 'POST':
         room.name = request.form.get('name', room.name)
         
+        avatar_url = None
         if 'avatar_file' in request.files:
             file = request.files['avatar_file']
             if file and file.filename:
-                filepath = save_file(file, 'room_avatars')
-                if filepath:
-                    room.avatar_url = filepath
+                avatar_url = save_file(file, 'room_avatars')
+                if avatar_url:
+                    room.avatar_url = avatar_url
         
         db.session.commit()
+        if avatar_url:
+            process_image(avatar_url, 'avatar', (Room, room.id, 'avatar_url'))
         flash('Настройки комнаты обновлены')
         return redirect(url_for('main.view_room', room_id=room_id))
     
@@ -253,6 +286,7 @@ def mark_channel_read(channel_id):
     else:
         rm = ReadMessage(user_id=current_user.id, channel_id=channel_id, last_read_message_id=last_msg.id)
         db.session.add(rm)
+    reset_unread(current_user.id, channel_id)
     db.session.commit()
 
     # notify others in channel about read status
@@ -265,6 +299,48 @@ def mark_channel_read(channel_id):
     return jsonify({'success': True})
 
 
+@api_bp.route('/channel/<int:channel_id>/history', methods=['GET'])
+@login_required
+def channel_history(channel_id):
+    # Page backwards through a channel's history by (channel_id, id) cursor, used by the room page on scroll
+    room_id = get_channel_room(channel_id)
+    access = get_room_access(current_user.id, room_id) if room_id else None
+    if access is None:
+        abort(404)
+    if not access['role'] and not access['is_public']:
+        return jsonify({'error': 'no access'}), 403
+    if access['banned']:
+        return jsonify({'error': 'you are banned from this room'}), 403
+
+    before_id = request.args.get('before_id', type=int)
+    messages, has_more = load_message_page(channel_id, before_id=before_id, limit=request.args.get('limit'))
+    attach_message_extras(messages, current_user.id)
+
+    return jsonify({
+        'messages': [serialize_message(m) for m in messages],
+        'has_more': has_more,
+        'next_before_id': messages[0].id if messages else None
+    })
+
+
+@api_bp.route('/room/<int:room_id>/unread_counts', methods=['GET'])
+@login_required
+def room_unread_counts(room_id):
+    # Unread counts of every channel in a room for the sidebar (one query against the counter cache)
+    access = get_room_access(current_user.id, room_id)
+    if access is None:
+        abort(404)
+    if not access['role']:
+        return jsonify({'error': 'no access'}), 403
+
+    counts = get_room_unread_counts(current_user.id, room_id)
+    return jsonify({
+        'room_id': room_id,
+        'channels': {str(cid): count for cid, count in counts.items()},
+        'total': sum(counts.values())
+    })
+
+
 @api_bp.route('/room/<int:room_id>/avatar/delete', methods=['POST'])
 @login_required
 def delete_room_avatar(room_id):
@@ -276,15 +352,7 @@ def delete_room_avatar(room_id):
         return jsonify({'error': 'no rights'}), 403
     
     if room.avatar_url:
-        if room.avatar_url.startswith('/uploads/'):
-            try:
-                filename = room.avatar_url.lstrip('/uploads/').lstrip('/')
-                abs_path = os.path.join(get_upload_folder(), filename)
-                if os.path.exists(abs_path):
-                    os.remove(abs_path)
-            except:
-                pass
-
+        discard_upload(get_upload_folder(), room.avatar_url)
         room.avatar_url = None
         db.session.commit()
     
@@ -303,34 +371,86 @@ def upload_file():
     if not file or not file.filename:
         return jsonify({'error': 'file not selected'}), 400
     # Save according to type with validation
-    if is_image_file(file.filename):
-        filepath = save_file(file, 'files')
-        filetype = 'image'
-    elif is_music_file(file.filename):
-        filepath = save_file(file, 'music')
-        filetype = 'music'
-    elif is_video_file(file.filename):
-        filepath = save_file(file, 'videos')
-        filetype = 'video'
-    else:
-        filepath = save_file(file, 'files')
-        filetype = 'file'
+    subfolder, filetype = upload_subfolder(file.filename)
+    # Recorded as the current user's upload, which is what lets them attach it to a message
+    filepath = save_file(file, subfolder, owner_id=current_user.id)
 
     if not filepath:
         return jsonify({'error': 'error saving file'}), 500
+    db.session.commit()
 
-    # Ensure filename is returned (basename of saved path)
-    try:
-        filename = os.path.basename(filepath)
-    except Exception:
-        filename = file.filename
+    # The stored file is named by its hash; the original name is returned for display
+    filename = clean_filename(file.filename) or os.path.basename(filepath)
 
     return jsonify({'success': True, 'url': filepath, 'type': filetype, 'filename': filename})
 
+# Chunked uploads for large files: init, PUT chunks at an offset (resumable), then finalize
+@api_bp.route('/upload/init', methods=['POST'])
+@login_required
+def upload_init():
+    # Start a chunked upload: {filename, size, sha256 (optional)}
+    data = request.get_json(silent=True) or {}
+    try:
+        status = start_upload(get_staging_folder(), current_user.id, data.get('filename'), data.get('size'),
+                              data.get('sha256'))
+    except UploadError as e:
+        return upload_error(e)
+    return jsonify(dict(status, success=True))
+
+@api_bp.route('/upload/<upload_id>', methods=['GET'])
+@login_required
+def upload_resume_point(upload_id):
+    # Bytes received so far; the client resumes from `offset`
+    try:
+        return jsonify(upload_status(get_staging_folder(), upload_id, current_user.id))
+    except UploadError as e:
+        return upload_error(e)
+
+@api_bp.route('/upload/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id):
+    # Raw chunk body at ?offset=N, streamed to disk; X-Chunk-SHA256 optionally verifies it
+    try:
+        status = write_chunk(
+            get_staging_folder(), upload_id, current_user.id, request.args.get('offset'), request.stream,
+            request.content_length, request.headers.get('X-Chunk-SHA256')
+        )
+    except UploadError as e:
+        return upload_error(e)
+    return jsonify(dict(status, success=True))
+
+@api_bp.route('/upload/<upload_id>/finalize', methods=['POST'])
+@login_required
+def upload_finalize(upload_id):
+    # Verify the whole file ({sha256} optional if given at init) and publish it under /uploads/
+    data = request.get_json(silent=True) or {}
+    try:
+        result = finish_upload(get_staging_folder(), get_upload_folder(), upload_id, current_user.id,
+                               data.get('sha256'))
+    except UploadError as e:
+        return upload_error(e)
+    db.session.commit()
+    return jsonify(dict(result, success=True))
+
+@api_bp.route('/upload/<upload_id>', methods=['DELETE'])
+@login_required
+def upload_cancel(upload_id):
+    # Abandon a chunked upload
+    try:
+        cancel_upload(get_staging_folder(), upload_id, current_user.id)
+    except UploadError as e:
+        return upload_error(e)
+    return jsonify({'success': True})
+
 @api_bp.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    # Serve uploaded file
-    return send_from_directory(get_upload_folder(), filename)
+    # Serve uploaded file; content-addressed files never change, so clients may cache them for good
+    storage = get_storage(get_upload_folder())
+    if is_stored_url('/uploads/' + filename):
+        response = storage.serve(filename, max_age=STORED_FILE_MAX_AGE)
+        response.cache_control.immutable = True
+        return response
+    return storage.serve(filename)
 
 @api_bp.route('/music/add', methods=['POST'])
 @login_required
@@ -343,7 +463,7 @@ def add_music():
     if not file or not file.filename or not is_music_file(file.filename):
         return jsonify({'error': 'wrong music format'}), 400
     
-    filepath = save_file(file, 'music')
+    filepath = save_file(file, 'music', owner_id=current_user.id)
     if not filepath:
         return jsonify({'error': 'upload error'}), 500
     
@@ -354,7 +474,7 @@ def add_music():
     if 'cover_file' in request.files:
         cover_file = request.files['cover_file']
         if cover_file and cover_file.filename:
-            cover_url = save_file(cover_file, 'avatars')
+            cover_url = save_file(cover_file, 'avatars', owner_id=current_user.id)
     
     music = UserMusic(
         user_id=current_user.id,
@@ -407,8 +527,11 @@ def delete_message(message_id):
         return jsonify({'error': 'no access'}), 403
     
     channel_id = message.channel_id
+    discount_unread(message)
+    log_message_change(message, 'deleted')
     db.session.delete(message)
     db.session.commit()
+    invalidate_dm_room(room)
     
     socketio.emit('message_deleted', {
         'message_id': message_id,
@@ -430,21 +553,16 @@ def edit_message(message_id):
     if new_content:
         message.content = new_content
         message.edited_at = datetime.utcnow()
+        log_message_change(message, 'edited')
         db.session.commit()
+        invalidate_dm_room(message.channel.room)
     
-    # Load reactions
-    reactions_data = {}
-    for reaction in message.reactions:
-        if reaction.emoji not in reactions_data:
-            reactions_data[reaction.emoji] = []
-        reactions_data[reaction.emoji].append(reaction.user.username)
-    
+    # Reactions are unchanged by an edit, so clients keep theirs
     payload = {
         'message_id': message_id,
         'content': new_content,
         'channel_id': message.channel_id,
-        'edited_at_iso': message.edited_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
-        'reactions': reactions_data
+        'edited_at_iso': message.edited_at.strftime('%Y-%m-%dT%H:%M:%SZ')
     }
 
     # Emit to channel room so all connected clients (except possibly the editor) receive update
@@ -485,7 +603,11 @@ def forward_message(message_id):
         file_size=message.file_size
     )
     db.session.add(new_msg)
+    db.session.flush()
+    increment_unread(target_channel.room_id, target_channel.id, current_user.id)
+    log_message_change(new_msg, 'created')
     db.session.commit()
+    invalidate_dm_room(target_channel.room)
     
     socketio.emit('receive_message', {
         'id': new_msg.id,
@@ -504,7 +626,7 @@ def forward_message(message_id):
 
 @api_bp.route('/message/<int:message_id>/reaction', methods=['POST'])
 @login_required
-def toggle_reaction(message_id):
+def toggle_reaction_view(message_id):
     # Add or remove reaction to message
     message = Message.query.get_or_404(message_id)
     emoji = request.json.get('emoji')
@@ -513,45 +635,14 @@ def toggle_reaction(message_id):
     if not emoji:
         return jsonify({'error': 'reaction not specified'}), 400
     
-    # Check if reaction already exists
-    existing = MessageReaction.query.filter_by(
-        message_id=message_id,
-        user_id=current_user.id,
-        emoji=emoji
-    ).first()
-    
-    if existing:
-        db.session.delete(existing)
-        action = 'removed'
-    else:
-        reaction = MessageReaction(
-            message_id=message_id,
-            user_id=current_user.id,
-            emoji=emoji,
-            reaction_type=reaction_type
-        )
-        db.session.add(reaction)
-        action = 'added'
-    
+    action, count = toggle_reaction(message, current_user.id, emoji, reaction_type)
     db.session.commit()
     
-    # Get updated reactions
-    reactions = MessageReaction.query.filter_by(message_id=message_id).all()
-    reaction_data = {}
-    for r in reactions:
-        if r.emoji not in reaction_data:
-            reaction_data[r.emoji] = []
-        reaction_data[r.emoji].append(r.user.username)
+    # Only the changed emoji is sent; clients patch their copy of the reactions
+    delta = reaction_delta(message, emoji, action, count, current_user.id, current_user.username)
+    socketio.emit('reaction_delta', delta, room=str(message.channel_id))
     
-    socketio.emit('reactions_updated', {
-        'message_id': message_id,
-        'reactions': reaction_data,
-        'action': action,
-        'emoji': emoji,
-        'user': current_user.username
-    }, room=str(message.channel_id))
-    
-    return jsonify({'success': True, 'action': action, 'reactions': reaction_data})
+    return jsonify(dict(delta, success=True))
 
 # --- ROOM MANAGEMENT ---
 
@@ -615,6 +706,7 @@ def delete_dm(room_id):
     if not member:
         return jsonify({'error': 'you are not a member'}), 403
     
+    invalidate_dm_room(room)
     db.session.delete(member)
     db.session.commit()
     
@@ -690,7 +782,7 @@ def get_current_user():
         'email': current_user.email,
         'avatar_url': current_user.avatar_url or 'https://via.placeholder.com/50',
         'bio': current_user.bio or '',
-        'presence_status': current_user.presence_status or 'offline',
+        'presence_status': presence_of(current_user),
         'hide_status': current_user.hide_status or False,
         'is_superuser': current_user.is_superuser or False
     })
@@ -735,43 +827,67 @@ def get_channel_messages(channel_id):
     room = channel.room
     
     # Check access
-    member = Member.query.filter_by(user_id=current_user.id, room_id=room.id).first()
-    if not member:
+    if not get_member_role(current_user.id, room.id):
         return jsonify({'error': 'Access denied'}), 403
     
     limit = request.args.get('limit', 50, type=int)
-    offset = request.args.get('offset', 0, type=int)
-    
-    messages = Message.query.filter_by(channel_id=channel_id).order_by(
-        Message.timestamp.desc()
-    ).limit(limit).offset(offset).all()
-    
-    messages_data = []
-    for msg in reversed(messages):
-        reactions = {}
-        for reaction in msg.reactions:
-            if reaction.emoji not in reactions:
-                reactions[reaction.emoji] = []
-            reactions[reaction.emoji].append(reaction.user.username)
-        
-        msg_dict = {
-            'id': msg.id,
-            'user_id': msg.user_id,
-            'username': msg.user.username if msg.user else 'Unknown',
-            'avatar_url': msg.user.avatar_url if msg.user else None,
-            'content': msg.content,
-            'message_type': msg.message_type,
-            'timestamp': msg.timestamp.isoformat(),
-            'edited_at': msg.edited_at.isoformat() if msg.edited_at else None,
-            'file_url': msg.file_url,
-            'file_name': msg.file_name,
-            'file_size': msg.file_size,
-            'reactions': reactions,
-            'reply_to_id': msg.reply_to_id
-        }
-        messages_data.append(msg_dict)
-    
-    return jsonify({'messages': messages_data, 'count': len(messages_data)})
+    before_id = request.args.get('before_id', type=int)
+    after_id = request.args.get('after_id', type=int)
+    around_id = request.args.get('around_id', type=int)
+    since = request.args.get('since', type=int)
+
+    # Delta sync: everything created, edited, reacted to or deleted after the client's token
+    if since is not None:
+        messages, deleted_ids, sync_token, has_more = load_changes_since(channel_id, since, limit)
+        attach_message_extras(messages, current_user.id)
+        return jsonify({
+            'messages': [_api_message_dict(m) for m in messages],
+            'deleted_ids': deleted_ids,
+            'count': len(messages),
+            'sync_token': sync_token,
+            'has_more': has_more
+        })
+
+    # Read the token before the page so nothing committed in between is skipped by the next sync
+    sync_token = current_sync_token(channel_id)
+    has_more_before = has_more_after = False
+    if around_id is not None:
+        messages, has_more_before, has_more_after = load_messages_around(channel_id, around_id, limit)
+    elif after_id is not None:
+        messages, has_more_after = load_message_page(channel_id, after_id=after_id, limit=limit)
+    else:
+        messages, has_more_before = load_message_page(channel_id, before_id=before_id, limit=limit)
+    attach_message_extras(messages, current_user.id)
+
+    messages_data = [_api_message_dict(m) for m in messages]
+    return jsonify({
+        'messages': messages_data,
+        'count': len(messages_data),
+        'has_more_before': has_more_before,
+        'has_more_after': has_more_after,
+        'before_id': messages[0].id if messages else None,
+        'after_id': messages[-1].id if messages else None,
+        'sync_token': sync_token
+    })
+
+
+def _api_message_dict(msg):
+    # Message representation used by the desktop client API (expects attach_message_extras)
+    return {
+        'id': msg.id,
+        'user_id': msg.user_id,
+        'username': msg.user.username if msg.user else 'Unknown',
+        'avatar_url': msg.user.avatar_url if msg.user else None,
+        'content': msg.content,
+        'message_type': msg.message_type,
+        'timestamp': msg.timestamp.isoformat(),
+        'edited_at': msg.edited_at.isoformat() if msg.edited_at else None,
+        'file_url': msg.file_url,
+        'file_name': msg.file_name,
+        'file_size': msg.file_size,
+        'reactions': getattr(msg, 'reactions_grouped', None) or {},
+        'reply_to_id': msg.reply_to_id
+    }
 
 @api_bp.route('/api/v1/user/<int:user_id>/profile', methods=['GET'])
 @login_required
@@ -783,7 +899,7 @@ def get_user_profile(user_id):
         'username': user.username,
         'avatar_url': user.avatar_url or 'https://via.placeholder.com/50',
         'bio': user.bio or '',
-        'presence_status': user.presence_status or 'offline' if not user.hide_status else 'hidden',
+        'presence_status': presence_of(user) if not user.hide_status else 'hidden',
         'last_seen': user.last_seen.isoformat() if user.last_seen else None
     })
 
@@ -795,10 +911,7 @@ def search_users():
     if len(query) < 2:
         return jsonify({'error': 'Query too short', 'users': []}), 400
     
-    users = User.query.filter(
-        User.username.ilike(f'%{query}%'),
-        User.privacy_searchable == True
-    ).limit(20).all()
+    users = find_users(query, request.args.get('limit'))
     
     users_data = [{
         'id': u.id,
@@ -817,22 +930,50 @@ def search_servers():
     if len(query) < 2:
         return jsonify({'error': 'Query too short', 'servers': []}), 400
     
-    rooms = Room.query.filter(
-        Room.name.ilike(f'%{query}%'),
-        Room.type != 'dm'
-    ).limit(20).all()
+    rooms = find_rooms(query, request.args.get('limit'))
     
     rooms_data = [{
         'id': r.id,
         'name': r.name,
-        'description': r.description or '',
+        'description': getattr(r, 'description', None) or '',
         'type': r.type,
         'avatar_url': r.avatar_url or 'https://via.placeholder.com/100',
-        'member_count': len(r.members)
+        'member_count': r.member_count
     } for r in rooms]
     
     return jsonify({'servers': rooms_data})
 
+@api_bp.route('/api/v1/search/messages', methods=['GET'])
+@login_required
+def search_messages_api():
+    # Full-text search over messages in the user's rooms - for desktop clients
+    # Optional room_id/channel_id narrow the scope; pass next_cursor back as `cursor` for the next page
+    query = request.args.get('q', '', type=str).strip()
+    if len(query) < 2:
+        return jsonify({'error': 'Query too short', 'results': []}), 400
+    if not search_available():
+        return jsonify({'error': 'Message search is not available on this database', 'results': []}), 501
+
+    results, next_cursor = search_messages(
+        current_user.id, query,
+        cursor=request.args.get('cursor'),
+        limit=request.args.get('limit'),
+        room_id=request.args.get('room_id', type=int),
+        channel_id=request.args.get('channel_id', type=int)
+    )
+    return jsonify({
+        'results': results,
+        'count': len(results),
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    })
+
+@api_bp.route('/api/v1/dms', methods=['GET'])
+@login_required
+def list_dms():
+    # DM list with last message preview and unread counts, newest activity first - for desktop clients
+    return jsonify({'dms': get_dm_list(current_user.id)})
+
 @api_bp.route('/api/v1/dm/<int:user_id>/create', methods=['POST'])
 @login_required
 def create_dm(user_id):
@@ -863,6 +1004,7 @@ def create_dm(user_id):
     channel = Channel(room_id=dm.id, name='general', emoji='💬')
     db.session.add(channel)
     db.session.commit()
+    invalidate_dm_list(current_user.id, user_id)
     
     return jsonify({'success': True, 'room_id': dm.id})
 
@@ -930,22 +1072,21 @@ def ban_user(user_id):
 
     # If room_id provided, allow room owner/admins to ban within that room
     if room_id:
-        admin_member = Member.query.filter_by(user_id=current_user.id, room_id=room_id).first()
-        room = Room.query.get(room_id)
+        access = get_room_access(current_user.id, room_id)
         # Allow if requester is room owner, room admin, or global superuser
         allowed = False
         if current_user.is_superuser:
             allowed = True
-        if room and room.owner_id == current_user.id:
+        if access and access['owner_id'] == current_user.id:
             allowed = True
-        if admin_member and admin_member.role in ['owner', 'admin']:
+        if access and access['role'] in ['owner', 'admin']:
             allowed = True
         if not allowed:
             debug = {
                 'current_user_id': current_user.id,
                 'room_id': room_id,
-                'room_owner_id': room.owner_id if room else None,
-                'admin_member_role': admin_member.role if admin_member else None
+                'room_owner_id': access['owner_id'] if access else None,
+                'admin_member_role': access['role'] if access else None
             }
             return jsonify({'error': 'not enough rights to ban in this room', 'debug': debug}), 403
 
@@ -957,7 +1098,10 @@ def ban_user(user_id):
                 try:
                     channel_ids = [c.id for c in target_membership.room.channels]
                     if channel_ids:
+                        log_bulk_deletion(Message.user_id == user_id, Message.channel_id.in_(channel_ids))
+                        delete_message_reactions(Message.user_id == user_id, Message.channel_id.in_(channel_ids))
                         deleted = Message.query.filter(Message.user_id == user_id, Message.channel_id.in_(channel_ids)).delete(synchronize_session=False)
+                        rebuild_unread(channel_ids)
                         db.session.commit()
                         try:
                             socketio.emit('bulk_messages_deleted', {'user_id': user_id, 'room_id': room_id, 'deleted': deleted}, room=str(room_id))
@@ -989,6 +1133,7 @@ def ban_user(user_id):
                 pass
 
             # Notify the banned user in real-time to redirect them
+            room = Room.query.get(room_id)
             try:
                 socketio.emit('force_redirect', {
                     'location': '/',
@@ -1010,17 +1155,14 @@ def ban_user(user_id):
     user.ban_reason = ban_reason
     user.banned_at = datetime.utcnow()
 
-    # Add IP to banned list if requested
+    # Add IP to banned list if requested (an explicit address or CIDR range, else the request address)
     if ban_ip:
-        user_ip = get_client_ip()
-        if user.banned_ips:
-            ips = [ip.strip() for ip in user.banned_ips.split(',') if ip.strip()]
-        else:
-            ips = []
-
-        if user_ip not in ips:
-            ips.append(user_ip)
-            user.banned_ips = ','.join(ips)
+        try:
+            add_ip_ban(data.get('ip') or get_client_ip(), user_id=user.id, reason=ban_reason,
+                       banned_by_id=current_user.id)
+        except ValueError:
+            db.session.rollback()
+            return jsonify({'error': 'invalid IP address'}), 400
 
     # Mark the user's memberships as 'banned' in all rooms (create RoomBan records)
     memberships = Member.query.filter_by(user_id=user_id).all()
@@ -1043,11 +1185,16 @@ def ban_user(user_id):
     for m in memberships:
         db.session.delete(m)
     db.session.commit()
+    invalidate_ip_bans()
 
     # Optional deletion of all messages for global ban
     if data.get('delete_messages'):
         try:
+            affected_channel_ids = [c for (c,) in db.session.query(Message.channel_id).filter(Message.user_id == user_id).distinct().all()]
+            log_bulk_deletion(Message.user_id == user_id)
+            delete_message_reactions(Message.user_id == user_id)
             deleted = Message.query.filter(Message.user_id == user_id).delete(synchronize_session=False)
+            rebuild_unread(affected_channel_ids)
             db.session.commit()
             try:
                 for rid in set(room_ids):
@@ -1108,21 +1255,20 @@ def unban_user(user_id):
 
     # If room_id provided, allow room owner/admins to unban within that room
     if room_id:
-        admin_member = Member.query.filter_by(user_id=current_user.id, room_id=room_id).first()
-        room = Room.query.get(room_id)
+        access = get_room_access(current_user.id, room_id)
         allowed = False
         if current_user.is_superuser:
             allowed = True
-        if room and room.owner_id == current_user.id:
+        if access and access['owner_id'] == current_user.id:
             allowed = True
-        if admin_member and admin_member.role in ['owner', 'admin']:
+        if access and access['role'] in ['owner', 'admin']:
             allowed = True
         if not allowed:
             debug = {
                 'current_user_id': current_user.id,
                 'room_id': room_id,
-                'room_owner_id': room.owner_id if room else None,
-                'admin_member_role': admin_member.role if admin_member else None
+                'room_owner_id': access['owner_id'] if access else None,
+                'admin_member_role': access['role'] if access else None
             }
             return jsonify({'error': 'not enough rights no unban in this room', 'debug': debug}), 403
 
@@ -1142,13 +1288,14 @@ def unban_user(user_id):
     user.is_banned = False
     user.ban_reason = None
     user.banned_at = None
-    user.banned_ips = ""
+    remove_user_ip_bans(user.id)
 
     # Unban globally - delete all RoomBan records for this user
     room_bans = RoomBan.query.filter_by(user_id=user_id).all()
     for room_ban in room_bans:
         db.session.delete(room_ban)
     db.session.commit()
+    invalidate_ip_bans()
 
     return jsonify({
         'success': True,
@@ -1170,7 +1317,7 @@ def admin_change_password(user_id):
     if not new_password or len(new_password) < 6:
         return jsonify({'error': 'password should be at least 6 symbols'}), 400
     
-    user.password = generate_password_hash(new_password, method='scrypt')
+    user.password = hash_password(new_password)
     db.session.commit()
     
     return jsonify({
@@ -1191,7 +1338,7 @@ def change_password():
     if not old_password or not new_password:
         return jsonify({'error': 'fill in all fields'}), 400
     
-    if not check_password_hash(current_user.password, old_password):
+    if not verify_password(current_user.password, old_password):
         return jsonify({'error': 'old password is wrong'}), 403
     
     if new_password != confirm_password:
@@ -1203,7 +1350,7 @@ def change_password():
     if new_password == old_password:
         return jsonify({'error': 'new password should differ from old'}), 400
     
-    current_user.password = generate_password_hash(new_password, method='scrypt')
+    current_user.password = hash_password(new_password)
     db.session.commit()
     
     return jsonify({
@@ -1211,35 +1358,71 @@ def change_password():
         'message': 'password changed successfully'
     })
 
+@api_bp.route('/admin/metrics', methods=['GET'])
+@login_required
+def admin_metrics():
+    # Runtime load metrics of this worker process
+    if not current_user.is_superuser:
+        return jsonify({'error': 'not enough rights'}), 403
+    
+    return jsonify({
+        'success': True,
+        'password_hashing': password_pool_stats(),
+        'image_processing': image_pool_stats(),
+        'login_throttle': login_throttle_stats()
+    })
+
 @api_bp.route('/admin/banned_ips', methods=['GET'])
 @login_required
 def get_banned_ips():
-    # Get list of all banned IPs
+    # Get one page of banned IPs and ranges; pass next_after_id back as `after_id` for the next page
     if not current_user.is_superuser:
         return jsonify({'error': 'not enough rights'}), 403
     
-    banned_users = User.query.filter_by(is_banned=True).all()
-    banned_ips_list = {}
-    
-    for user in banned_users:
-        if user.banned_ips:
-            ips = [ip.strip() for ip in user.banned_ips.split(',') if ip.strip()]
-            for ip in ips:
-                if ip not in banned_ips_list:
-                    banned_ips_list[ip] = []
-                banned_ips_list[ip].append({
-                    'username': user.username,
-                    'user_id': user.id,
-                    'reason': user.ban_reason,
-                    'banned_at': user.banned_at.isoformat() if user.banned_at else None
-                })
+    items, next_after_id = list_ip_bans(
+        after_id=request.args.get('after_id', type=int),
+        limit=request.args.get('limit')
+    )
     
     return jsonify({
         'success': True,
-        'banned_ips': banned_ips_list,
-        'total_ips': len(banned_ips_list)
+        'banned_ips': items,
+        'total_ips': BannedIP.query.count(),
+        'next_after_id': next_after_id,
+        'has_more': next_after_id is not None
     })
 
+@api_bp.route('/admin/banned_ips', methods=['POST'])
+@login_required
+def add_banned_ip():
+    # Ban an IP address or CIDR range (IPv4 or IPv6) without a user. Expects JSON {ip, reason}
+    if not current_user.is_superuser:
+        return jsonify({'error': 'not enough rights'}), 403
+    
+    data = request.json or {}
+    try:
+        ban = add_ip_ban(data.get('ip'), reason=data.get('reason'), banned_by_id=current_user.id)
+    except ValueError:
+        return jsonify({'error': 'invalid IP address'}), 400
+    db.session.commit()
+    invalidate_ip_bans()
+    
+    return jsonify({'success': True, 'id': ban.id, 'ip': ban.network})
+
+@api_bp.route('/admin/banned_ips/<int:ban_id>/delete', methods=['POST'])
+@login_required
+def delete_banned_ip(ban_id):
+    # Lift a single IP ban
+    if not current_user.is_superuser:
+        return jsonify({'error': 'not enough rights'}), 403
+    
+    ban = BannedIP.query.get_or_404(ban_id)
+    db.session.delete(ban)
+    db.session.commit()
+    invalidate_ip_bans()
+    
+    return jsonify({'success': True, 'id': ban_id})
+
 @api_bp.route('/admin/user/<int:user_id>/kick_from_room/<int:room_id>', methods=['POST'])
 @login_required
 def kick_user_from_room(user_id, room_id):
@@ -1250,21 +1433,20 @@ def kick_user_from_room(user_id, room_id):
     except Exception:
         return jsonify({'error': 'wrong room_id'}), 400
 
-    admin_member = Member.query.filter_by(user_id=current_user.id, room_id=room_id).first()
-    room = Room.query.get(room_id)
+    access = get_room_access(current_user.id, room_id)
     allowed = False
     if current_user.is_superuser:
         allowed = True
-    if room and room.owner_id == current_user.id:
+    if access and access['owner_id'] == current_user.id:
         allowed = True
-    if admin_member and admin_member.role in ['owner', 'admin']:
+    if access and access['role'] in ['owner', 'admin']:
         allowed = True
     if not allowed:
         debug = {
             'current_user_id': current_user.id,
             'room_id': room_id,
-            'room_owner_id': room.owner_id if room else None,
-            'admin_member_role': admin_member.role if admin_member else None
+            'room_owner_id': access['owner_id'] if access else None,
+            'admin_member_role': access['role'] if access else None
         }
         return jsonify({'error': 'not enough rights', 'debug': debug}), 403
     
@@ -1309,21 +1491,20 @@ def promote_user(user_id):
     if not room_id:
         return jsonify({'error': 'room_id is not specified'}), 400
     # Requester must be owner/admin in that room or superuser
-    admin_member = Member.query.filter_by(user_id=current_user.id, room_id=room_id).first()
-    room = Room.query.get(room_id)
+    access = get_room_access(current_user.id, room_id)
     allowed = False
     if current_user.is_superuser:
         allowed = True
-    if room and room.owner_id == current_user.id:
+    if access and access['owner_id'] == current_user.id:
         allowed = True
-    if admin_member and admin_member.role in ['owner', 'admin']:
+    if access and access['role'] in ['owner', 'admin']:
         allowed = True
     if not allowed:
         debug = {
             'current_user_id': current_user.id,
             'room_id': room_id,
-            'room_owner_id': room.owner_id if room else None,
-            'admin_member_role': admin_member.role if admin_member else None
+            'room_owner_id': access['owner_id'] if access else None,
+            'admin_member_role': access['role'] if access else None
         }
         return jsonify({'error': 'not enough rights', 'debug': debug}), 403
 
@@ -1355,19 +1536,18 @@ def demote_user(user_id):
         return jsonify({'error': 'room_id is not specified'}), 400
 
     # Only room creator (owner) or superuser can demote
-    room = Room.query.get(room_id)
+    access = get_room_access(current_user.id, room_id)
     allowed = False
     if current_user.is_superuser:
         allowed = True
-    if room and room.owner_id == current_user.id:
+    if access and access['owner_id'] == current_user.id:
         allowed = True
     if not allowed:
-        admin_member = Member.query.filter_by(user_id=current_user.id, room_id=room_id).first()
         debug = {
             'current_user_id': current_user.id,
             'room_id': room_id,
-            'room_owner_id': room.owner_id if room else None,
-            'admin_member_role': admin_member.role if admin_member else None
+            'room_owner_id': access['owner_id'] if access else None,
+            'admin_member_role': access['role'] if access else None
         }
         return jsonify({'error': 'not enough rights', 'debug': debug}), 403
 
@@ -1405,20 +1585,20 @@ def delete_user_messages(user_id):
     if not room:
         return jsonify({'error': 'room is not found'}), 404
 
-    admin_member = Member.query.filter_by(user_id=current_user.id, room_id=room_id).first()
+    access = get_room_access(current_user.id, room_id)
     allowed = False
     if current_user.is_superuser:
         allowed = True
-    if room and room.owner_id == current_user.id:
+    if access and access['owner_id'] == current_user.id:
         allowed = True
-    if admin_member and admin_member.role in ['owner', 'admin']:
+    if access and access['role'] in ['owner', 'admin']:
         allowed = True
     if not allowed:
         debug = {
             'current_user_id': current_user.id,
             'room_id': room_id,
-            'room_owner_id': room.owner_id if room else None,
-            'admin_member_role': admin_member.role if admin_member else None
+            'room_owner_id': access['owner_id'] if access else None,
+            'admin_member_role': access['role'] if access else None
         }
         return jsonify({'error': 'not enough rights', 'debug': debug}), 403
 
@@ -1428,7 +1608,10 @@ def delete_user_messages(user_id):
         return jsonify({'success': True, 'deleted': 0})
 
     # delete messages from these channels by user
+    log_bulk_deletion(Message.user_id == user_id, Message.channel_id.in_(channel_ids))
+    delete_message_reactions(Message.user_id == user_id, Message.channel_id.in_(channel_ids))
     deleted = Message.query.filter(Message.user_id == user_id, Message.channel_id.in_(channel_ids)).delete(synchronize_session=False)
+    rebuild_unread(channel_ids)
     db.session.commit()
 
     # Notify room listeners that messages from this user were removed
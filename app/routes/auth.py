@@ -2,9 +2,9 @@
 
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_user, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 from app.extensions import db
 from app.models import User
+from app.functions import is_ip_banned, hash_password, verify_password, PasswordPoolBusy, check_login_rate
 import re
 
 auth_bp = Blueprint('auth', __name__)
@@ -48,16 +48,6 @@ def validate_password(password):
     
     return True, ""
 
-def is_ip_banned(ip):
-    # Check if IP is in banned list
-    banned_users = User.query.filter_by(is_banned=True).all()
-    for user in banned_users:
-        if user.banned_ips:
-            ips = [ip_addr.strip() for ip_addr in user.banned_ips.split(',') if ip_addr.strip()]
-            if ip in ips:
-                return True
-    return False
-
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
     # Login page and handler
@@ -66,6 +56,12 @@ def login():
         password = request.form.get('password')
         client_ip = get_client_ip()
         
+        # Turn away guessing before any database or hashing work
+        retry_after = check_login_rate(client_ip, username)
+        if retry_after:
+            flash(f'too many login attempts. try again in {retry_after} seconds')
+            return render_template('login.html'), 429, {'Retry-After': str(retry_after)}
+        
         # Check if IP is banned
         if is_ip_banned(client_ip):
             flash('your IP address is banned')
@@ -78,7 +74,12 @@ def login():
             flash(f'account banned. reason: {user.ban_reason or "not specified"}')
             return render_template('login.html')
         
-        if user and check_password_hash(user.password, password):
+        try:
+            password_ok = user is not None and verify_password(user.password, password)
+        except PasswordPoolBusy:
+            flash('server is busy, please try again in a moment')
+            return render_template('login.html'), 503
+        if password_ok:
             login_user(user)
             return redirect(url_for('main.dashboard'))
         
@@ -130,9 +131,14 @@ def register():
         # Note: This is simplified. For production, consider using Redis for rate limiting
         # For now, just create the account
         
+        try:
+            password_hash = hash_password(password)
+        except PasswordPoolBusy:
+            flash('server is busy, please try again in a moment')
+            return render_template('register.html'), 503
         new_user = User(
             username=username,
-            password=generate_password_hash(password, method='scrypt')
+            password=password_hash
         )
         db.session.add(new_user)
         db.session.commit()
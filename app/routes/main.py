@@ -4,7 +4,12 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required, current_user
 from datetime import datetime
 from app.extensions import db, socketio
-from app.models import Room, Channel, Member, Message, ReadMessage, User, RoomBan
+from app.models import Room, Channel, Member, ReadMessage, User, RoomBan
+from app.functions import (
+    get_room_unread_counts, reset_unread, get_dm_list, invalidate_dm_list, load_message_page, attach_message_extras,
+    find_users, find_rooms, get_room_access
+)
+from config import NAME_SEARCH_CANDIDATES
 
 main_bp = Blueprint('main', __name__)
 
@@ -12,54 +17,8 @@ main_bp = Blueprint('main', __name__)
 @login_required
 def dashboard():
     # Main dashboard - shows DMs and servers
-    # Get DMs with unread count
-    dms_query = db.session.query(Room, Member).join(Member).filter(
-        Member.user_id == current_user.id, 
-        Room.type == 'dm'
-    ).all()
-    
-    dms_with_info = []
-    for room, member in dms_query:
-        # Find other member
-        other_member = Member.query.filter(
-            Member.room_id == room.id,
-            Member.user_id != current_user.id
-        ).first()
-        other_user = other_member.user if other_member else None
-        
-        # Get DM channel and unread count
-        channel = Channel.query.filter_by(room_id=room.id).first()
-        unread_count = 0
-        
-        if channel:
-            read_msg = ReadMessage.query.filter_by(
-                user_id=current_user.id,
-                channel_id=channel.id
-            ).first()
-            
-            if read_msg and read_msg.last_read_message_id:
-                unread_count = Message.query.filter(
-                    Message.channel_id == channel.id,
-                    Message.id > read_msg.last_read_message_id,
-                    Message.user_id != current_user.id
-                ).count()
-            elif not read_msg:
-                unread_count = Message.query.filter(
-                    Message.channel_id == channel.id,
-                    Message.user_id != current_user.id
-                ).count()
-        
-        dms_with_info.append({
-            'room': room,
-            'other_user': other_user,
-            'unread_count': unread_count
-        })
-    
-    # Sort by unread count, then by ID
-    dms_with_info.sort(key=lambda x: (
-        x['unread_count'] == 0,
-        -x['room'].id
-    ))
+    # DM list with other participant, unread count and last message, from one cached query
+    dms_with_info = get_dm_list(current_user.id)
     
     # Get servers/channels with roles
     servers_query = db.session.query(Room, Member).join(Member).filter(
@@ -101,14 +60,8 @@ def explore():
     rooms = []
     
     if query:
-        users = User.query.filter(
-            User.username.contains(query),
-            User.privacy_searchable == True
-        ).all()
-        rooms = Room.query.filter(
-            Room.name.contains(query),
-            Room.is_public == True
-        ).all()
+        users = find_users(query, NAME_SEARCH_CANDIDATES)
+        rooms = find_rooms(query, NAME_SEARCH_CANDIDATES)
     else:
         if current_user.is_superuser:
             users = User.query.all()
@@ -171,6 +124,7 @@ def start_dm(user_id):
     
     db.session.add_all([m1, m2, c1])
     db.session.commit()
+    invalidate_dm_list(current_user.id, other.id)
     
     # Notify other user via Socket.IO
     socketio.emit('new_dm_created', {
@@ -188,13 +142,15 @@ def start_dm(user_id):
 def view_room(room_id):
     # View room and messages
     room = Room.query.get_or_404(room_id)
-    member = Member.query.filter_by(user_id=current_user.id, room_id=room_id).first()
+    access = get_room_access(current_user.id, room_id)
+    # The template only reads member.role
+    member = {'role': access['role']} if access['role'] else None
     
     # Check if user is banned from this room
-    room_ban = RoomBan.query.filter_by(user_id=current_user.id, room_id=room_id).first()
-    
-    if room_ban:
-        flash(f'you are banned from this room{": " + room_ban.reason if room_ban.reason else ""}')
+    if access['banned']:
+        room_ban = RoomBan.query.filter_by(user_id=current_user.id, room_id=room_id).first()
+        reason = room_ban.reason if room_ban else None
+        flash(f'you are banned from this room{": " + reason if reason else ""}')
         return redirect(url_for('main.dashboard'))
     
     if not member:
@@ -208,31 +164,11 @@ def view_room(room_id):
         active_channel_id = room.channels[0].id
     
     messages = []
+    has_more_messages = False
     if active_channel_id:
-        messages = Message.query.filter_by(channel_id=active_channel_id).order_by(Message.timestamp.asc()).all()
-        
-        # Load reactions for each message
-        for msg in messages:
-            msg.reactions_grouped = {}
-            reactions = Message.query.filter_by(id=msg.id).first().reactions
-            for reaction in reactions:
-                if reaction.emoji not in msg.reactions_grouped:
-                    msg.reactions_grouped[reaction.emoji] = []
-                msg.reactions_grouped[reaction.emoji].append(reaction.user.username)
-            # If this message is a reply to another persisted message, include reply metadata
-            try:
-                if getattr(msg, 'reply_to_id', None):
-                    orig = Message.query.get(msg.reply_to_id)
-                    if orig:
-                        # build a small snippet (first line) for display
-                        snippet = (orig.content or '').split('\n')[0][:200]
-                        msg.reply_to = {
-                            'id': orig.id,
-                            'username': orig.user.username if orig.user else 'Unknown',
-                            'snippet': snippet
-                        }
-            except Exception:
-                msg.reply_to = None
+        # Render only the newest page; older history is fetched on scroll by cursor
+        messages, has_more_messages = load_message_page(int(active_channel_id))
+        attach_message_extras(messages, current_user.id)
         
         # Mark messages as read
         if messages:
@@ -252,6 +188,7 @@ def view_room(room_id):
                     last_read_message_id=last_message.id
                 )
                 db.session.add(read_msg)
+            reset_unread(current_user.id, int(active_channel_id))
             
             db.session.commit()
             
@@ -269,15 +206,8 @@ def view_room(room_id):
         active_channel_id=int(active_channel_id) if active_channel_id else None,
         active_channel=Channel.query.get(active_channel_id) if active_channel_id else None,
         messages=messages,
-        channel_unread_counts={
-            ch.id: (
-                Message.query.filter(
-                    Message.channel_id == ch.id,
-                    Message.user_id != current_user.id,
-                    Message.id > (ReadMessage.query.filter_by(user_id=current_user.id, channel_id=ch.id).first().last_read_message_id if ReadMessage.query.filter_by(user_id=current_user.id, channel_id=ch.id).first() and ReadMessage.query.filter_by(user_id=current_user.id, channel_id=ch.id).first().last_read_message_id else 0)
-                ).count()
-            ) for ch in room.channels
-        }
+        has_more_messages=has_more_messages,
+        channel_unread_counts=get_room_unread_counts(current_user.id, room.id)
     )
 
 @main_bp.route('/join_room/<int:room_id>')
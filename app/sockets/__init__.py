@@ -1,5 +1,7 @@
 # Sockets package - Socket.IO event handlers
 
 from app.sockets import events  # noqa
+from app.sockets import presence  # noqa
+from app.sockets import message_writer  # noqa
 
-__all__ = ['events']
+__all__ = ['events', 'presence', 'message_writer']
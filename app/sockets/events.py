@@ -1,28 +1,42 @@
 # Socket.IO event handlers
 
 from flask_socketio import join_room, leave_room, emit
+from flask import request
 from flask_login import current_user
 from app.extensions import db, socketio
-from app.models import Message, Member, Room, Channel, ReadMessage, User
+from app.models import Message, Member, Room, Channel, User, Sticker
+from app.functions import (
+    get_channel_unread_counts, invalidate_dm_room, socket_identity, get_room_access, get_channel_room,
+    file_extension, clean_filename, find_upload
+)
+from app.sockets.presence import presence_room, publish_presence, register_session, unregister_session
+from app.sockets.message_writer import submit_message
 from datetime import datetime
-import os
 
 @socketio.on('join')
 def on_join(data):
     # Join a channel room
     channel_id = data.get('channel_id')
+    identity = socket_identity()
     
     if channel_id:
         join_room(str(channel_id))
-        if hasattr(current_user, 'id'):
-            print(f"[SOCKET JOIN] User {current_user.id} joined channel room: {channel_id}")
+        if identity:
+            print(f"[SOCKET JOIN] User {identity['id']} joined channel room: {channel_id}")
+        # Subscribe to presence batches of the room this channel belongs to
+        try:
+            channel = Channel.query.get(int(channel_id))
+            if channel:
+                join_room(presence_room(channel.room_id))
+        except Exception as e:
+            print(f"[SOCKET JOIN ERROR] Failed to join presence room: {e}")
     
     # Join personal notification room
     try:
-        if hasattr(current_user, 'is_authenticated') and current_user.is_authenticated:
-            room_name = f"user_{current_user.id}"
+        if identity:
+            room_name = f"user_{identity['id']}"
             join_room(room_name)
-            print(f"[SOCKET JOIN] User {current_user.id} joined notification room: {room_name}")
+            print(f"[SOCKET JOIN] User {identity['id']} joined notification room: {room_name}")
     except Exception as e:
         print(f"[SOCKET JOIN ERROR] Failed to join notification room: {e}")
         pass
@@ -46,29 +60,13 @@ def on_connect():
                 raise
             
             # Respect user's hide_status preference
-            if getattr(current_user, 'hide_status', False):
-                current_user.presence_status = 'hidden'
-            else:
-                current_user.presence_status = 'online'
-            current_user.last_seen = None
-            db.session.commit()
-            print(f"[SOCKET CONNECT] ✓ User {user_id} status set to online")
+            status = 'hidden' if getattr(current_user, 'hide_status', False) else 'online'
             
-            # Notify members in all channels of the rooms user is member of
-            memberships = Member.query.filter_by(user_id=user_id).all()
-            print(f"[SOCKET CONNECT] User {user_id} has {len(memberships)} memberships")
-            
-            for m in memberships:
-                # For each channel in the room, emit presence update so clients viewing channel update status
-                for ch in m.room.channels:
-                    try:
-                        socketio.emit('presence_updated', {
-                            'user_id': current_user.id,
-                            'username': current_user.username,
-                            'status': current_user.presence_status
-                        }, room=str(ch.id), skip_sid=None)  # Include sender in emission
-                    except Exception as e:
-                        print(f"[SOCKET CONNECT] Error emitting presence for channel {ch.id}: {e}")
+            # Track the session in memory; only the first tab changes presence (persisted by write-behind)
+            if register_session(user_id, request.sid, status):
+                print(f"[SOCKET CONNECT] ✓ User {user_id} status set to {status}")
+                # Notify rooms the user is member of (coalesced into presence_batch events)
+                publish_presence(user_id, current_user.username, status)
             
             print(f"[SOCKET CONNECT] ✓ User {user_id} fully connected")
         else:
@@ -90,22 +88,13 @@ def on_disconnect():
             user_id = current_user.id
             print(f"[SOCKET DISCONNECT] User {user_id} disconnecting...")
             # Respect hide_status: if hidden, keep hidden; otherwise set offline
-            if getattr(current_user, 'hide_status', False):
-                current_user.presence_status = 'hidden'
-            else:
-                current_user.presence_status = 'offline'
-            current_user.last_seen = datetime.utcnow()
-            db.session.commit()
-            print(f"[SOCKET DISCONNECT] User {user_id} status set to offline, notifying rooms...")
-            memberships = Member.query.filter_by(user_id=user_id).all()
-            for m in memberships:
-                for ch in m.room.channels:
-                    socketio.emit('presence_updated', {
-                        'user_id': current_user.id,
-                        'username': current_user.username,
-                        'status': current_user.presence_status,
-                        'last_seen_iso': current_user.last_seen.strftime('%Y-%m-%dT%H:%M:%SZ') if current_user.last_seen else None
-                    }, room=str(ch.id), skip_sid=None)  # Include sender in emission
+            status = 'hidden' if getattr(current_user, 'hide_status', False) else 'offline'
+            last_seen = datetime.utcnow()
+            
+            # Other tabs keep the user online; only the last session changes presence
+            if unregister_session(user_id, request.sid, status, last_seen):
+                print(f"[SOCKET DISCONNECT] User {user_id} status set to {status}, notifying rooms...")
+                publish_presence(user_id, current_user.username, status, last_seen)
             print(f"[SOCKET DISCONNECT] User {user_id} disconnect complete")
     except Exception as e:
         print(f"[SOCKET DISCONNECT ERROR] {e}")
@@ -119,7 +108,13 @@ def on_disconnect():
 def handle_send_message(data):
     # Handle incoming message
     import sys
-    print(f"[handle_send_message] START - from user {current_user.id} ({current_user.username})", file=sys.stderr)
+    # Cached identity of the sender instead of loading the User row for every message
+    identity = socket_identity()
+    if identity is None:
+        emit('error', {'message': 'Нет доступа'})
+        return
+    user_id = identity['id']
+    print(f"[handle_send_message] START - from user {user_id} ({identity['username']})", file=sys.stderr)
     
     channel_id = data.get('channel_id')
     content = data.get('msg', '')
@@ -128,6 +123,7 @@ def handle_send_message(data):
     file_url = data.get('file_url')
     file_name = data.get('file_name')
     file_size = data.get('file_size')
+    sticker_id = data.get('sticker_id')
     reply_to = data.get('reply_to')
     
     # Normalize content: strip whitespace but preserve internal line breaks
@@ -154,65 +150,61 @@ def handle_send_message(data):
     except Exception:
         pass
 
-    # Validate room and channel exist
-    room = Room.query.get(room_id)
-    if not room:
+    # Validate room, channel and membership from the access cache (no queries when warm)
+    access = get_room_access(user_id, room_id)
+    if not access:
         emit('error', {'message': 'Комната не найдена'})
         return
 
-    channel = Channel.query.get(channel_id)
-    if not channel or channel.room_id != room_id:
+    if get_channel_room(channel_id) != room_id:
         emit('error', {'message': 'Канал не найден'})
         return
 
-    member = Member.query.filter_by(user_id=current_user.id, room_id=room_id).first()
-    
-    if not member:
+    if not access['role']:
         emit('error', {'message': 'Нет доступа'})
         return
     
     can_post = True
-    if room.type == 'broadcast' and member.role not in ['owner', 'admin']:
+    if access['room_type'] == 'broadcast' and access['role'] not in ['owner', 'admin']:
         can_post = False
     
     if not can_post:
         emit('error', {'message': 'Только владельцы и администраторы могут публиковать'})
         return
     
-    # Validate file_url if provided: only allow files from '/uploads/' that exist on disk
-    if file_url:
+    # Attachments: a sticker by id (primary key lookup, the sender's own stickers only), or an upload
+    # URL checked with one lookup in the upload registry (the sender's own uploads only); size and
+    # name always come from the server to avoid spoofing
+    if message_type == 'sticker':
         try:
-            # only accept relative uploads path
-            if not file_url.startswith('/uploads/'):
-                file_url = None
-            else:
-                base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-                abs_path = os.path.join(base_dir, file_url.lstrip('/'))
-                if not os.path.exists(abs_path):
-                    file_url = None
-        except Exception:
+            sticker = Sticker.query.get(int(sticker_id)) if sticker_id is not None else None
+        except (TypeError, ValueError):
+            sticker = None
+        if sticker is None or sticker.owner_id != user_id:
+            emit('error', {'message': 'Стикер не найден'})
+            return
+        file_url = sticker.file_url
+        file_name = None
+        file_size = None
+    elif file_url:
+        upload = find_upload(user_id, file_url)
+        if upload is not None:
+            file_size = upload.size
+            # Stored files are named by their hash: keep the sender's display name when it has the
+            # same extension as the uploaded file
+            display_name = clean_filename(file_name)
+            if not display_name or file_extension(display_name) != file_extension(upload.file_name):
+                display_name = upload.file_name
+            file_name = display_name
+        else:
             file_url = None
+            file_name = None
+            file_size = None
 
-    # If file_url was validated, derive server-side filename and size to avoid spoofing
-    if file_url:
-        try:
-            file_name = os.path.basename(file_url)
-        except Exception:
-            pass
-        try:
-            base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-            abs_path = os.path.join(base_dir, file_url.lstrip('/'))
-            try:
-                file_size = os.path.getsize(abs_path)
-            except Exception:
-                pass
-        except Exception:
-            pass
-
-    # Create and save message
+    # Create the message; the group-commit writer stores it and assigns the ID
     msg = Message(
         content=content,
-        user_id=current_user.id,
+        user_id=user_id,
         channel_id=channel_id,
         message_type=message_type,
         file_url=file_url,
@@ -220,16 +212,34 @@ def handle_send_message(data):
         file_size=file_size,
         reply_to_id=(reply_to.get('id') if isinstance(reply_to, dict) and reply_to.get('id') else None)
     )
-    db.session.add(msg)
-    db.session.commit()
-    
-    # Load reactions for the message
-    reactions_data = {}
-    for reaction in msg.reactions:
-        if reaction.emoji not in reactions_data:
-            reactions_data[reaction.emoji] = []
-        reactions_data[reaction.emoji].append(reaction.user.username)
-    
+    sender = {
+        'id': user_id,
+        'username': identity['username'],
+        'avatar': identity['avatar_url']
+    }
+    room_type = access['room_type']
+
+    def on_commit(saved):
+        broadcast_new_message(saved, room_id, room_type, sender, reply_to)
+
+    try:
+        result = submit_message(msg, room_id, on_commit)
+    except RuntimeError as e:
+        emit('error', {'message': str(e)})
+        return
+    if room_type == 'dm':
+        invalidate_dm_room(Room.query.get(room_id))
+
+    # Acknowledge the sender once the message is durable; the broadcast follows from the writer
+    return dict(result, ok=True)
+
+
+def broadcast_new_message(msg, room_id, room_type, sender, reply_to=None):
+    # Send a committed message to its channel and notify room members (runs in the message writer)
+    import sys
+    channel_id = msg.channel_id
+    content = msg.content
+
     # Build reply metadata from saved message reference if available
     reply_payload = None
     try:
@@ -247,75 +257,61 @@ def handle_send_message(data):
 
     # Broadcast to channel (include server-built reply metadata)
     print(f"[handle_send_message] Broadcasting receive_message to channel {channel_id}", file=sys.stderr)
-    emit('receive_message', {
+    socketio.emit('receive_message', {
         'id': msg.id,
-        'user_id': current_user.id,
-        'username': current_user.username,
-        'avatar': current_user.avatar_url,
+        'user_id': sender['id'],
+        'username': sender['username'],
+        'avatar': sender['avatar'],
         'msg': content,
         'timestamp_iso': msg.timestamp.strftime('%Y-%m-%dT%H:%M:%SZ'),
-        'message_type': message_type,
-        'file_url': file_url,
-        'file_name': file_name,
-        'file_size': file_size,
+        'message_type': msg.message_type,
+        'file_url': msg.file_url,
+        'file_name': msg.file_name,
+        'file_size': msg.file_size,
         'edited_at_iso': msg.edited_at.strftime('%Y-%m-%dT%H:%M:%SZ') if msg.edited_at else None,
-        'reactions': reactions_data,
+        'reactions': {},  # a new message has no reactions yet
         'reply_to': reply_payload
     }, room=str(channel_id))
 
     # Send per-user notifications and unread counts to members' personal rooms
     try:
-        members = Member.query.filter_by(room_id=room_id).all()
-        print(f"[handle_send_message] Sending notifications to {len(members)} members", file=sys.stderr)
-        for m in members:
-            uid = m.user_id
-            # skip sender
-            if uid == current_user.id:
-                continue
+        member_ids = [uid for (uid,) in db.session.query(Member.user_id).filter_by(room_id=room_id).all()]
+        unread_counts = get_channel_unread_counts(channel_id)
+        print(f"[handle_send_message] Sending notifications to {len(member_ids)} members", file=sys.stderr)
 
-            # compute unread count for this user in this channel
-            # Count all messages after last_read_message_id, excluding the current user's own messages
-            unread_count = 0
-            rm = ReadMessage.query.filter_by(user_id=uid, channel_id=channel_id).first()
-            if rm and rm.last_read_message_id:
-                # Messages after what they've read
-                unread_count = Message.query.filter(
-                    Message.channel_id == channel_id,
-                    Message.id > rm.last_read_message_id
-                ).count()
-            else:
-                # No reading history, count all messages
-                unread_count = Message.query.filter(
-                    Message.channel_id == channel_id
-                ).count()
+        # Build small snippet for notification
+        snippet = (content or '')
+        if snippet:
+            snippet = snippet.strip().split('\n')[0][:140]
 
-            # Build small snippet for notification
-            snippet = (content or '')
-            if snippet:
-                snippet = snippet.strip().split('\n')[0][:140]
+        for uid in member_ids:
+            # skip sender
+            if uid == sender['id']:
+                continue
 
             payload = {
                 'room_id': room_id,
                 'channel_id': channel_id,
                 'message_id': msg.id,
-                'from_user': current_user.username,
-                'from_user_id': current_user.id,
+                'from_user': sender['username'],
+                'from_user_id': sender['id'],
                 'snippet': snippet,
-                'unread_count': unread_count
+                'unread_count': unread_counts.get(uid, 0)
             }
 
             # Emit a generic notification event to the user's personal room
-            print(f"[handle_send_message] Sending notification to user {uid}: {payload}", file=sys.stderr)
             socketio.emit('message_notification', payload, room=f"user_{uid}")
 
             # For DM rooms, keep the legacy dashboard handler name
             try:
-                if room.type == 'dm':
-                    socketio.emit('new_dm_message', {'room_id': room.id}, room=f"user_{uid}")
+                if room_type == 'dm':
+                    socketio.emit('new_dm_message', {
+                        'room_id': room_id,
+                        'snippet': snippet,
+                        'timestamp_iso': msg.timestamp.strftime('%Y-%m-%dT%H:%M:%SZ')
+                    }, room=f"user_{uid}")
             except Exception:
                 pass
     except Exception:
         db.session.rollback()
         pass
-    
-    print(f"[handle_send_message] COMPLETE", file=sys.stderr)
\ No newline at end of file
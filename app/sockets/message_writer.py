@@ -0,0 +1,152 @@
+# Group-commit message writer
+# handle_send_message hands validated messages to a single background writer instead of committing
+# them itself. The writer collects messages arriving within MESSAGE_BATCH_DELAY_MS (at most
+# MESSAGE_BATCH_MAX) and stores them in one transaction, so a burst costs one fsync instead of one
+# per message. IDs are assigned in arrival order and the post-commit callbacks (the receive_message
+# broadcast) run in that same order, so every channel sees its messages in ID order.
+
+import threading
+from collections import deque
+from app.extensions import db, socketio
+from config import MESSAGE_BATCH_DELAY_MS, MESSAGE_BATCH_MAX
+
+_lock = threading.Lock()
+_queue = deque()     # pending writes, oldest first
+_wakeup = None       # event set when the queue goes from empty to non-empty
+_writer_started = False
+_app = None
+
+# How long a sender waits for its batch before giving up
+SUBMIT_TIMEOUT_SECONDS = 30
+
+
+class PendingWrite:
+    # One queued message: the transient Message, its room, and the sender's completion state
+    def __init__(self, msg, room_id, on_commit=None):
+        self.msg = msg
+        self.room_id = room_id
+        self.on_commit = on_commit
+        self.done = socketio.server.eio.create_event()
+        self.result = None
+        self.error = None
+
+
+def init_message_writer(app):
+    # Remember the app so the writer task can open an app context
+    global _app
+    _app = app
+
+
+def submit_message(msg, room_id, on_commit=None):
+    # Queue a new Message and wait until its batch is committed
+    # Returns {'id', 'timestamp_iso'} once durable; raises RuntimeError when the batch failed.
+    # `on_commit(msg)` is called by the writer after the commit, in message order.
+    global _wakeup, _writer_started
+    pending = PendingWrite(msg, room_id, on_commit)
+    with _lock:
+        if _wakeup is None:
+            _wakeup = socketio.server.eio.create_event()
+        _queue.append(pending)
+        _wakeup.set()
+        start_writer = not _writer_started
+        _writer_started = True
+    if start_writer:
+        socketio.start_background_task(_writer_loop)
+
+    if not pending.done.wait(SUBMIT_TIMEOUT_SECONDS):
+        raise RuntimeError('message write timed out')
+    if pending.error:
+        raise RuntimeError(pending.error)
+    return pending.result
+
+
+def _take_batch():
+    # Pop up to MESSAGE_BATCH_MAX queued writes
+    with _lock:
+        batch = []
+        while _queue and len(batch) < MESSAGE_BATCH_MAX:
+            batch.append(_queue.popleft())
+        if not _queue:
+            _wakeup.clear()
+    return batch
+
+
+def _writer_loop():
+    # Background task: wait for messages, give the batch time to fill, then commit it
+    while True:
+        _wakeup.wait()
+        if MESSAGE_BATCH_DELAY_MS > 0:
+            with _lock:
+                full = len(_queue) >= MESSAGE_BATCH_MAX
+            if not full:
+                socketio.sleep(MESSAGE_BATCH_DELAY_MS / 1000.0)
+        batch = _take_batch()
+        if not batch:
+            continue
+        try:
+            if _app is not None:
+                with _app.app_context():
+                    write_batch(batch)
+            else:
+                write_batch(batch)
+        except Exception as e:
+            print(f"[MESSAGES] Writer loop error: {e}")
+
+
+def _insert(batch):
+    # Insert queued messages, bump unread counters and log them, all in one transaction
+    from app.functions import increment_unread, log_message_change
+
+    for pending in batch:
+        db.session.add(pending.msg)
+    db.session.flush()
+    for pending in batch:
+        increment_unread(pending.room_id, pending.msg.channel_id, pending.msg.user_id)
+        log_message_change(pending.msg, 'created')
+        pending.result = {
+            'id': pending.msg.id,
+            'timestamp_iso': pending.msg.timestamp.strftime('%Y-%m-%dT%H:%M:%SZ')
+        }
+    db.session.commit()
+
+
+def write_batch(batch):
+    # Insert a batch of queued messages in one transaction, acknowledge senders, then run callbacks
+    written = list(batch)
+    try:
+        _insert(batch)
+    except Exception as e:
+        db.session.rollback()
+        print(f"[MESSAGES] Batch of {len(batch)} failed: {e}")
+        written = []
+        if len(batch) > 1:
+            # Retry one message per transaction, in arrival order, so only the bad ones fail
+            for pending in batch:
+                pending.msg.id = None
+                try:
+                    _insert([pending])
+                    written.append(pending)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"[MESSAGES] Message write failed: {e}")
+        for pending in batch:
+            if pending not in written:
+                pending.result = None
+                pending.error = 'Не удалось сохранить сообщение'
+
+    for pending in batch:
+        pending.done.set()
+    if not written:
+        return 0
+    # Let the senders' handlers return their acks before the broadcasts go out
+    socketio.sleep(0)
+    for pending in written:
+        if pending.on_commit is None:
+            continue
+        try:
+            pending.on_commit(pending.msg)
+        except Exception as e:
+            db.session.rollback()
+            # The message may already be gone (deleted right after the ack), so log the captured id
+            print(f"[MESSAGES] Post-commit callback failed for message {pending.result['id']}: {e}")
+    return len(written)
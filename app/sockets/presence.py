@@ -0,0 +1,197 @@
+# Presence registry and fan-out
+# Live socket sessions are tracked in memory per user (several tabs count once), and status changes
+# are written behind to the User table in batches every PRESENCE_FLUSH_SECONDS and at shutdown.
+# Broadcasts are coalesced for PRESENCE_COALESCE_MS and sent as one `presence_batch` per room to
+# `presence_<room_id>` (joined in `join`), so fan-out scales with rooms watched and flaps collapse
+
+import atexit
+import threading
+from app.extensions import db, socketio
+from config import PRESENCE_COALESCE_MS, PRESENCE_FLUSH_SECONDS
+
+_lock = threading.Lock()
+_pending = {}        # user_id -> latest update within the current window
+_last_sent = {}      # user_id -> status last broadcast, used to drop flaps that end where they started
+_flush_scheduled = False
+_sessions = {}       # user_id -> set of live socket sids
+_status = {}         # user_id -> current status as seen by this process
+_dirty = {}          # user_id -> (status, last_seen) waiting to be written to the User table
+_writer_started = False
+_app = None
+
+
+def init_presence(app):
+    # Remember the app so background flushes can open an app context
+    global _app
+    if _app is None:
+        atexit.register(_run_in_app, flush_presence_writes)
+    _app = app
+
+
+def _run_in_app(func, *args):
+    # Run `func` inside the registered app context (background tasks have none of their own)
+    if _app is not None:
+        with _app.app_context():
+            return func(*args)
+    return func(*args)
+
+
+# --- REGISTRY ---
+
+def register_session(user_id, sid, status):
+    # Track a new socket session; returns True when it is the user's first one (user came online)
+    global _writer_started
+    with _lock:
+        sids = _sessions.setdefault(user_id, set())
+        first = not sids
+        sids.add(sid)
+        if first:
+            _status[user_id] = status
+            _dirty[user_id] = (status, None)
+        start_writer = not _writer_started
+        _writer_started = True
+    if start_writer:
+        socketio.start_background_task(_write_behind_loop)
+    return first
+
+
+def unregister_session(user_id, sid, status, last_seen):
+    # Drop a socket session; returns True when it was the user's last one (user went offline)
+    with _lock:
+        sids = _sessions.get(user_id)
+        if not sids or sid not in sids:
+            return False
+        sids.discard(sid)
+        if sids:
+            return False
+        del _sessions[user_id]
+        _status[user_id] = status
+        _dirty[user_id] = (status, last_seen)
+    return True
+
+
+def set_status(user_id, status):
+    # Record a status change that was already persisted by the caller (e.g. the settings page)
+    with _lock:
+        _status[user_id] = status
+        if user_id in _dirty:
+            _dirty[user_id] = (status, _dirty[user_id][1])
+
+
+def session_count(user_id):
+    # Number of live socket sessions of a user in this process
+    with _lock:
+        return len(_sessions.get(user_id, ()))
+
+
+def presence_of(user):
+    # Current presence of a User row, preferring the in-memory registry over the stored column
+    if user is None:
+        return 'offline'
+    with _lock:
+        status = _status.get(user.id)
+    return status or user.presence_status or 'offline'
+
+
+def flush_presence_writes():
+    # Write queued status/last_seen changes to the User table in one transaction
+    from app.models import User
+    from app.functions import invalidate_user
+
+    global _dirty
+    with _lock:
+        dirty, _dirty = _dirty, {}
+    if not dirty:
+        return 0
+    mappings = [
+        {'id': uid, 'presence_status': status, 'last_seen': last_seen}
+        for uid, (status, last_seen) in dirty.items()
+    ]
+    try:
+        db.session.bulk_update_mappings(User, mappings)
+        db.session.commit()
+        # Bulk updates bypass the ORM events that keep the user cache fresh
+        for uid in dirty:
+            invalidate_user(uid)
+    except Exception as e:
+        db.session.rollback()
+        # Put the batch back unless a newer change arrived meanwhile
+        with _lock:
+            for uid, value in dirty.items():
+                _dirty.setdefault(uid, value)
+        print(f"[PRESENCE] Write-behind failed: {e}")
+        return 0
+    return len(mappings)
+
+
+def _write_behind_loop():
+    # Background task: periodically persist presence changes
+    while True:
+        socketio.sleep(PRESENCE_FLUSH_SECONDS)
+        try:
+            _run_in_app(flush_presence_writes)
+        except Exception as e:
+            print(f"[PRESENCE] Write-behind loop error: {e}")
+
+
+# --- FAN-OUT ---
+
+def presence_room(room_id):
+    # Socket.IO room that receives presence batches for a chat room
+    return f"presence_{room_id}"
+
+
+def publish_presence(user_id, username, status, last_seen=None):
+    # Queue a presence change; it is broadcast by the next flush
+    global _flush_scheduled
+    update = {
+        'user_id': user_id,
+        'username': username,
+        'status': status,
+        'last_seen_iso': last_seen.strftime('%Y-%m-%dT%H:%M:%SZ') if last_seen else None
+    }
+    with _lock:
+        _pending[user_id] = update
+        start = not _flush_scheduled
+        _flush_scheduled = True
+    if start:
+        socketio.start_background_task(_flush_after_window)
+
+
+def _flush_after_window():
+    # Background task: wait out the coalescing window, then broadcast everything queued in it
+    global _pending, _flush_scheduled
+    socketio.sleep(PRESENCE_COALESCE_MS / 1000.0)
+    with _lock:
+        batch, _pending = _pending, {}
+        _flush_scheduled = False
+    try:
+        _run_in_app(flush_presence, batch)
+    except Exception as e:
+        print(f"[PRESENCE] Flush failed: {e}")
+
+
+def flush_presence(batch):
+    # Emit one `presence_batch` per room for the given {user_id: update} map
+    from app.models import Member
+
+    updates = {uid: u for uid, u in batch.items() if _last_sent.get(uid) != u['status']}
+    if not updates:
+        return 0
+    for uid, u in updates.items():
+        _last_sent[uid] = u['status']
+
+    # One query resolves every room the changed users belong to
+    rows = db.session.query(Member.room_id, Member.user_id).filter(
+        Member.user_id.in_(list(updates))
+    ).all()
+    by_room = {}
+    for room_id, user_id in rows:
+        by_room.setdefault(room_id, []).append(updates[user_id])
+
+    for room_id, room_updates in by_room.items():
+        socketio.emit('presence_batch', {
+            'room_id': room_id,
+            'updates': room_updates
+        }, room=presence_room(room_id))
+    return len(by_room)
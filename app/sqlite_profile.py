@@ -0,0 +1,71 @@
+# SQLite performance profile
+# WAL lets readers keep reading while a writer commits, synchronous=NORMAL is crash-safe in WAL mode
+# and skips an fsync per transaction, and busy_timeout makes a writer wait for the lock instead of
+# failing with "database is locked". The PRAGMAs are applied to every new pooled connection.
+
+from sqlalchemy import event
+from config import (
+    SQLITE_PROFILE, SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE_KB,
+    SQLITE_BUSY_TIMEOUT_MS, SQLITE_FOREIGN_KEYS, DB_POOL_SIZE, DB_POOL_MAX_OVERFLOW, DB_POOL_TIMEOUT
+)
+
+JOURNAL_MODES = {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'}
+SYNCHRONOUS_LEVELS = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+
+
+def _is_file_sqlite(uri):
+    # In-memory databases use a single shared connection and take no pool options
+    if not uri or not uri.startswith('sqlite'):
+        return False
+    return ':memory:' not in uri and uri.rstrip('/') not in ('sqlite:', 'sqlite+pysqlite:')
+
+
+def sqlite_engine_options(uri, enabled=SQLITE_PROFILE):
+    # SQLALCHEMY_ENGINE_OPTIONS for a SQLite file database
+    # Pooled connections are handed between green threads, so the same-thread check is disabled;
+    # pool_timeout bounds how long a request waits for a free connection
+    if not enabled or not _is_file_sqlite(uri):
+        return {}
+    return {
+        'connect_args': {'check_same_thread': False, 'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000.0},
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_POOL_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+    }
+
+
+def sqlite_pragmas():
+    # PRAGMA statements for a new connection, built from config
+    journal_mode = str(SQLITE_JOURNAL_MODE).upper()
+    synchronous = str(SQLITE_SYNCHRONOUS).upper()
+    if journal_mode not in JOURNAL_MODES:
+        raise ValueError(f"Unsupported SQLITE_JOURNAL_MODE: {SQLITE_JOURNAL_MODE}")
+    if synchronous not in SYNCHRONOUS_LEVELS:
+        raise ValueError(f"Unsupported SQLITE_SYNCHRONOUS: {SQLITE_SYNCHRONOUS}")
+    return [
+        f"PRAGMA journal_mode={journal_mode}",
+        f"PRAGMA synchronous={synchronous}",
+        f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT_MS)}",
+        f"PRAGMA mmap_size={int(SQLITE_MMAP_SIZE)}",
+        f"PRAGMA cache_size=-{int(SQLITE_CACHE_SIZE_KB)}",  # negative = KiB instead of pages
+        "PRAGMA temp_store=MEMORY",
+        f"PRAGMA foreign_keys={'ON' if SQLITE_FOREIGN_KEYS else 'OFF'}",
+    ]
+
+
+def install_sqlite_profile(engine, enabled=SQLITE_PROFILE):
+    # Run the profile PRAGMAs on every connection the engine opens; returns True when installed
+    if not enabled or engine.dialect.name != 'sqlite':
+        return False
+    pragmas = sqlite_pragmas()
+
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    return True
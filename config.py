@@ -12,9 +12,24 @@ _JSON_PATH = os.path.join(_BASE_DIR, 'config.json')
 _defaults = {
     'SQLALCHEMY_DATABASE_URI': 'sqlite:///thecomboxmsgr.db',
     'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+    'SQLITE_PROFILE': True,
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,
+    'SQLITE_CACHE_SIZE_KB': 64 * 1024,
+    'SQLITE_BUSY_TIMEOUT_MS': 5000,
+    'SQLITE_FOREIGN_KEYS': False,
+    'DB_POOL_SIZE': 10,
+    'DB_POOL_MAX_OVERFLOW': 20,
+    'DB_POOL_TIMEOUT': 30,
     'SECRET_KEY': 'super_secret_key_v2',
     'UPLOAD_FOLDER': 'uploads',
     'MAX_CONTENT_LENGTH': 50 * 1024 * 1024 * 1024 * 1024 * 1024 * 1024,
+    'UPLOAD_CHUNK_SIZE': 8 * 1024 * 1024,
+    'UPLOAD_SESSION_SECONDS': 24 * 60 * 60,
+    'STORED_FILE_GRACE_SECONDS': 24 * 60 * 60,
+    'STORED_FILE_SWEEP_SECONDS': 60 * 60,
+    'UPLOAD_STORAGE': 'local',
     'ALLOWED_EXTENSIONS': [
         'png', 'jpg', 'jpeg', 'gif', 'webp',
         'mp3', 'ogg', 'flac', 'wav', 'midi', 'mid',
@@ -24,6 +39,39 @@ _defaults = {
     'IMAGE_EXTENSIONS': ['png', 'jpg', 'jpeg', 'gif', 'webp'],
     'MUSIC_EXTENSIONS': ['mp3', 'ogg', 'flac', 'wav'],
     'VIDEO_EXTENSIONS': ['mp4', 'webm', 'mov', 'avi', 'mkv'],
+    'MESSAGE_PAGE_SIZE': 50,
+    'MESSAGE_PAGE_MAX': 200,
+    'SEARCH_PAGE_SIZE': 20,
+    'REACTION_NAMES_LIMIT': 10,
+    'NAME_SEARCH_LIMIT': 20,
+    'NAME_SEARCH_CANDIDATES': 200,
+    'PRESENCE_COALESCE_MS': 250,
+    'PRESENCE_FLUSH_SECONDS': 5,
+    'DM_LIST_CACHE_SECONDS': 60,
+    'MESSAGE_BATCH_DELAY_MS': 5,
+    'MESSAGE_BATCH_MAX': 100,
+    'IP_BAN_REFRESH_SECONDS': 30,
+    'IP_BAN_PAGE_SIZE': 50,
+    'PASSWORD_HASH_WORKERS': 4,
+    'PASSWORD_HASH_MAX_QUEUE': 64,
+    'IMAGE_WORKERS': 2,
+    'IMAGE_MAX_QUEUE': 32,
+    'IMAGE_MAX_PIXELS': 50000000,
+    'IMAGE_JOB_TIMEOUT': 30,
+    'USER_CACHE_SECONDS': 15,
+    'MEMBERSHIP_CACHE_SECONDS': 60,
+    'LOGIN_THROTTLE_ENABLED': True,
+    'LOGIN_IP_BURST': 20,
+    'LOGIN_IP_PER_MINUTE': 10,
+    'LOGIN_USER_BURST': 10,
+    'LOGIN_USER_PER_MINUTE': 5,
+    'LOGIN_THROTTLE_MAX_KEYS': 100000,
+    'LOGIN_THROTTLE_STORAGE': None,
+    'SOCKETIO_MESSAGE_QUEUE': None,
+    'SOCKETIO_CHANNEL': 'boxchat',
+    'SOCKETIO_WEBSOCKET_ONLY': False,
+    'WORKERS': 1,
+    'MIGRATION_BATCH_SIZE': 200,
     'UPLOAD_SUBDIRS': {
         'avatars': 'avatars',
         'room_avatars': 'room_avatars',
@@ -53,12 +101,35 @@ def _get(key):
 SQLALCHEMY_DATABASE_URI = _get('SQLALCHEMY_DATABASE_URI')
 SQLALCHEMY_TRACK_MODIFICATIONS = _get('SQLALCHEMY_TRACK_MODIFICATIONS')
 
+# SQLite performance profile (see app/sqlite_profile.py); ignored for other databases
+SQLITE_PROFILE = bool(_get('SQLITE_PROFILE'))
+SQLITE_JOURNAL_MODE = _get('SQLITE_JOURNAL_MODE')
+SQLITE_SYNCHRONOUS = _get('SQLITE_SYNCHRONOUS')
+SQLITE_MMAP_SIZE = int(_get('SQLITE_MMAP_SIZE'))
+SQLITE_CACHE_SIZE_KB = int(_get('SQLITE_CACHE_SIZE_KB'))
+SQLITE_BUSY_TIMEOUT_MS = int(_get('SQLITE_BUSY_TIMEOUT_MS'))
+# Off by default: bulk deletes (e.g. account removal) rely on SQLite not enforcing references
+SQLITE_FOREIGN_KEYS = bool(_get('SQLITE_FOREIGN_KEYS'))
+# Connection pool (per worker process)
+DB_POOL_SIZE = int(_get('DB_POOL_SIZE'))
+DB_POOL_MAX_OVERFLOW = int(_get('DB_POOL_MAX_OVERFLOW'))
+DB_POOL_TIMEOUT = float(_get('DB_POOL_TIMEOUT'))
+
 # Security
 SECRET_KEY = _get('SECRET_KEY')
 
 # File uploads
 UPLOAD_FOLDER = _get('UPLOAD_FOLDER')
 MAX_CONTENT_LENGTH = int(_get('MAX_CONTENT_LENGTH'))
+# Chunked uploads: largest chunk accepted per request, and how long an idle session is kept for resuming
+UPLOAD_CHUNK_SIZE = max(64 * 1024, int(_get('UPLOAD_CHUNK_SIZE')))
+UPLOAD_SESSION_SECONDS = float(_get('UPLOAD_SESSION_SECONDS'))
+# How long a stored file may stay unreferenced (uploaded but not sent yet) before it can be swept
+STORED_FILE_GRACE_SECONDS = float(_get('STORED_FILE_GRACE_SECONDS'))
+# How often each worker deletes stored files nothing references any more (0 = only by hand, see readme)
+STORED_FILE_SWEEP_SECONDS = float(_get('STORED_FILE_SWEEP_SECONDS'))
+# Upload storage backend (see app/file_storage.py; 'local' = the upload folder)
+UPLOAD_STORAGE = _get('UPLOAD_STORAGE') or 'local'
 
 # Allowed file extensions (store as sets in runtime for quick membership checks)
 ALLOWED_EXTENSIONS = set(_get('ALLOWED_EXTENSIONS') or [])
@@ -68,6 +139,79 @@ IMAGE_EXTENSIONS = set(_get('IMAGE_EXTENSIONS') or [])
 MUSIC_EXTENSIONS = set(_get('MUSIC_EXTENSIONS') or [])
 VIDEO_EXTENSIONS = set(_get('VIDEO_EXTENSIONS') or [])
 
+# Message history paging (messages per page and the largest page a client may request)
+MESSAGE_PAGE_SIZE = int(_get('MESSAGE_PAGE_SIZE'))
+MESSAGE_PAGE_MAX = int(_get('MESSAGE_PAGE_MAX'))
+# Message search results per page
+SEARCH_PAGE_SIZE = int(_get('SEARCH_PAGE_SIZE'))
+# Reactor names sent per (message, emoji); counts are always exact
+REACTION_NAMES_LIMIT = max(0, int(_get('REACTION_NAMES_LIMIT')))
+# User/room name search: results per typeahead request, and rows read per index lookup (also the max limit)
+NAME_SEARCH_LIMIT = int(_get('NAME_SEARCH_LIMIT'))
+NAME_SEARCH_CANDIDATES = int(_get('NAME_SEARCH_CANDIDATES'))
+
+# Presence: how long status changes are buffered before a batched broadcast
+PRESENCE_COALESCE_MS = int(_get('PRESENCE_COALESCE_MS'))
+# Presence: how often status/last_seen changes are written behind to the database
+PRESENCE_FLUSH_SECONDS = float(_get('PRESENCE_FLUSH_SECONDS'))
+
+# How long a user's dashboard DM list may be served from cache (writes invalidate it earlier)
+DM_LIST_CACHE_SECONDS = float(_get('DM_LIST_CACHE_SECONDS'))
+
+# Group commit: how long the message writer waits for more messages before committing a batch
+MESSAGE_BATCH_DELAY_MS = float(_get('MESSAGE_BATCH_DELAY_MS'))
+# Group commit: most messages stored in one transaction
+MESSAGE_BATCH_MAX = max(1, int(_get('MESSAGE_BATCH_MAX')))
+
+# How often each worker reloads its in-memory IP ban index (local bans/unbans apply immediately)
+IP_BAN_REFRESH_SECONDS = float(_get('IP_BAN_REFRESH_SECONDS'))
+# Banned IPs per page in the admin listing
+IP_BAN_PAGE_SIZE = int(_get('IP_BAN_PAGE_SIZE'))
+
+# Password hashing: scrypt jobs run at once on native threads (keep <= EVENTLET_THREADPOOL_SIZE, default 20)
+PASSWORD_HASH_WORKERS = max(1, int(_get('PASSWORD_HASH_WORKERS')))
+# Password hashing: jobs allowed to wait for a thread before logins are turned away as busy
+PASSWORD_HASH_MAX_QUEUE = int(_get('PASSWORD_HASH_MAX_QUEUE'))
+
+# Image processing (stickers, avatars, icons): worker processes per server worker, started on demand
+IMAGE_WORKERS = max(1, int(_get('IMAGE_WORKERS')))
+# Image processing: jobs allowed to wait for a worker; beyond that the original image is kept as is
+IMAGE_MAX_QUEUE = int(_get('IMAGE_MAX_QUEUE'))
+# Image processing: largest image (width * height) decoded; bigger ones keep the original file
+IMAGE_MAX_PIXELS = max(1, int(_get('IMAGE_MAX_PIXELS')))
+# Image processing: seconds a job may take before its worker process is killed
+IMAGE_JOB_TIMEOUT = float(_get('IMAGE_JOB_TIMEOUT'))
+
+# How long each worker keeps a user's row in memory for the login manager and socket handlers
+USER_CACHE_SECONDS = float(_get('USER_CACHE_SECONDS'))
+# Upper bound on how long a worker trusts cached memberships, roles and room bans (changes are
+# pushed to every worker right after commit; this only matters if a notification is lost)
+MEMBERSHIP_CACHE_SECONDS = float(_get('MEMBERSHIP_CACHE_SECONDS'))
+
+# Login throttling: token buckets per client address and per username and address (see app/functions/throttle.py)
+LOGIN_THROTTLE_ENABLED = bool(_get('LOGIN_THROTTLE_ENABLED'))
+# Login throttling: attempts allowed in a burst from one address, and how many it regains per minute
+LOGIN_IP_BURST = max(1, int(_get('LOGIN_IP_BURST')))
+LOGIN_IP_PER_MINUTE = max(0.01, float(_get('LOGIN_IP_PER_MINUTE')))
+# Login throttling: the same for one username from one address
+LOGIN_USER_BURST = max(1, int(_get('LOGIN_USER_BURST')))
+LOGIN_USER_PER_MINUTE = max(0.01, float(_get('LOGIN_USER_PER_MINUTE')))
+# Login throttling: most buckets kept in memory per worker (idle, refilled buckets are dropped first)
+LOGIN_THROTTLE_MAX_KEYS = int(_get('LOGIN_THROTTLE_MAX_KEYS'))
+# Login throttling: redis:// URL to share buckets between workers (None = per-process buckets)
+LOGIN_THROTTLE_STORAGE = _get('LOGIN_THROTTLE_STORAGE') or None
+
+# Socket.IO message queue shared by all workers (None = single process, see app/pubsub.py for URLs)
+SOCKETIO_MESSAGE_QUEUE = _get('SOCKETIO_MESSAGE_QUEUE') or None
+SOCKETIO_CHANNEL = _get('SOCKETIO_CHANNEL')
+# Restrict clients to websocket (required behind several workers without sticky sessions)
+SOCKETIO_WEBSOCKET_ONLY = bool(_get('SOCKETIO_WEBSOCKET_ONLY'))
+# Number of worker processes started by run_workers.py
+WORKERS = int(_get('WORKERS'))
+
+# Rows (or channels) processed per committed batch by long-running schema migrations
+MIGRATION_BATCH_SIZE = int(_get('MIGRATION_BATCH_SIZE'))
+
 # Upload subdirectories (relative names only)
 UPLOAD_SUBDIRS = dict(_get('UPLOAD_SUBDIRS') or {})
 
@@ -0,0 +1,121 @@
+# Multi-worker entry point for the BoxChat application
+# Binds one listening socket, forks N eventlet workers that accept on it, and relays Socket.IO
+# emits between them. Without SOCKETIO_MESSAGE_QUEUE a local Unix-socket broker is started here;
+# set it to a redis:// (or other) URL to share the queue with workers on other hosts.
+#
+#   python run_workers.py --workers 4 --port 5000
+
+import eventlet
+import eventlet.hubs
+eventlet.monkey_patch()
+
+import argparse
+import os
+import signal
+import tempfile
+
+
+def _parse_args():
+    # Command line options (defaults come from config)
+    from config import WORKERS
+    parser = argparse.ArgumentParser(description='Run BoxChat on several worker processes')
+    parser.add_argument('--workers', type=int, default=max(WORKERS, 1))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    return parser.parse_args()
+
+
+def _run_worker(listener, index):
+    # Worker body: build the app in this process and serve on the shared socket
+    import eventlet.wsgi
+    from app import create_app
+
+    app = create_app()
+    print(f"[WORKER {index}] pid {os.getpid()} ready")
+    eventlet.wsgi.server(listener, app, log_output=False)
+
+
+def main():
+    # Start the broker, bind the port and supervise the workers
+    args = _parse_args()
+
+    # Create tables and the admin user once, before workers race for them
+    # (in a throwaway child: socket handlers bind to the first app built in a process)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            from app import create_app
+            create_app()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+    # Workers are forked from this process, so they inherit the settings patched here
+    import config
+    broker_path = None
+    if not config.SOCKETIO_MESSAGE_QUEUE:
+        from app.pubsub import UnixSocketBroker
+        broker_path = os.path.join(tempfile.gettempdir(), f"boxchat-{os.getpid()}.sock")
+        UnixSocketBroker(broker_path).start()
+        config.SOCKETIO_MESSAGE_QUEUE = f"unix://{broker_path}"
+    # Long-polling needs sticky sessions, which a shared accept socket cannot provide
+    config.SOCKETIO_WEBSOCKET_ONLY = True
+
+    listener = eventlet.listen((args.host, args.port))
+    print(f"[SERVER STARTUP] Starting BoxChat with {args.workers} workers")
+    print(f"[SERVER CONFIG] Listening on {args.host}:{args.port}, queue {config.SOCKETIO_MESSAGE_QUEUE}")
+
+    children = {}
+    stopping = []
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            # The parent's hub (and its epoll fd) must not be shared with the child
+            eventlet.hubs.use_hub()
+            try:
+                _run_worker(listener, index)
+            finally:
+                os._exit(0)
+        children[pid] = index
+
+    def shutdown(signum, frame):
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for index in range(args.workers):
+        spawn(index)
+
+    # Restart workers that die; the broker keeps running in this process
+    while not stopping:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid and pid in children:
+            index = children.pop(pid)
+            print(f"[WORKER {index}] exited with status {status}, restarting")
+            spawn(index)
+        eventlet.sleep(1)
+
+    print("[SERVER] Stopping workers...")
+    for pid in list(children):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+    for pid in list(children):
+        try:
+            os.waitpid(pid, 0)
+        except OSError:
+            pass
+    if broker_path and os.path.exists(broker_path):
+        os.unlink(broker_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# Benchmark: typeahead latency of user and room name search (app/functions/directory.py).
+# Builds a throwaway database with generated usernames and room names (inserted through the sync
+# triggers, like registrations and room creation), then times find_users/find_rooms per keystroke.
+# Usage:
+#   python3 tools/benchmark/name_search_bench.py [--users 1000000] [--rooms 100000] [--repeat 20]
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from flask import Flask
+from sqlalchemy import text
+from app.extensions import db
+from app.sqlite_profile import sqlite_engine_options, install_sqlite_profile
+
+SYLLABLES = ['al', 'ex', 'ma', 'ri', 'ko', 'an', 'na', 'li', 'se', 'ta', 'vo', 'mi', 'da', 'ne', 'or',
+             'ka', 'ze', 'lu', 'pe', 'io', 'ra', 'st', 'er', 'on']
+QUERIES = ['a', 'al', 'ale', 'alex', 'alexma', 'ma', 'mar', 'rik', 'xyz', 'dane', 'ko_ta', 'server']
+
+
+def make_name(rng, index):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 5))) + (str(index) if index % 3 else '')
+
+
+def make_app(path):
+    uri = f"sqlite:///{path}"
+    app = Flask('app')
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = sqlite_engine_options(uri)
+    db.init_app(app)
+    with app.app_context():
+        install_sqlite_profile(db.engine)
+    from app import models  # noqa: register every model on the metadata
+    return app
+
+
+def populate(users, rooms):
+    rng = random.Random(42)
+    started = time.perf_counter()
+    chunk = 50000
+    for start in range(0, users, chunk):
+        db.session.execute(text(
+            "INSERT INTO user (username, password, privacy_searchable) VALUES (:name, '-', 1)"
+        ), [{'name': f"{make_name(rng, i)}_{i}"} for i in range(start, min(users, start + chunk))])
+        db.session.commit()
+    for start in range(0, rooms, chunk):
+        db.session.execute(text(
+            "INSERT INTO room (name, type, is_public) VALUES (:name, 'server', 1)"
+        ), [{'name': f"{make_name(rng, i).capitalize()} server {i}"} for i in range(start, min(rooms, start + chunk))])
+        db.session.commit()
+    db.session.execute(text(
+        "INSERT INTO member (user_id, room_id, role) SELECT id, (id % :rooms) + 1, 'member' FROM user"
+    ), {'rooms': max(1, rooms // 10)})
+    db.session.commit()
+    db.session.execute(text("ANALYZE"))
+    db.session.commit()
+    return time.perf_counter() - started
+
+
+def timed(func, query, repeat):
+    latencies = []
+    results = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        results = func(query)
+        latencies.append((time.perf_counter() - started) * 1000)
+        db.session.rollback()
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[-1], len(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Name search benchmark')
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--rooms', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    from app.functions import find_users, find_rooms
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, 'bench.db'))
+        with app.app_context():
+            db.create_all()
+            elapsed = populate(args.users, args.rooms)
+            print(f"Indexed {args.users} users and {args.rooms} rooms in {elapsed:.1f}s")
+            print(f"{'query':<10} {'kind':<6} {'p50 ms':>8} {'max ms':>8} {'hits':>5}")
+            for query in QUERIES:
+                for kind, func in (('users', find_users), ('rooms', find_rooms)):
+                    p50, worst, hits = timed(func, query, args.repeat)
+                    print(f"{query:<10} {kind:<6} {p50:>8.2f} {worst:>8.2f} {hits:>5}")
+            db.session.remove()
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
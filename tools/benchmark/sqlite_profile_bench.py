@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# Benchmark: SQLite throughput with the performance profile off vs on.
+# Writer processes mimic send_message (insert a message, bump unread counters, commit) while reader
+# processes page channel history, all against one database file - the same contention several
+# workers (run_workers.py) or a message burst produce.
+# Usage:
+#   python3 tools/benchmark/sqlite_profile_bench.py [--writers 4] [--readers 4] [--seconds 5]
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from app.sqlite_profile import sqlite_engine_options, install_sqlite_profile
+
+CHANNELS = 20
+MEMBERS = 20
+SCHEMA = [
+    "CREATE TABLE message (id INTEGER PRIMARY KEY, channel_id INTEGER NOT NULL, user_id INTEGER NOT NULL, "
+    "content TEXT NOT NULL, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)",
+    "CREATE INDEX ix_message_channel_id_id ON message (channel_id, id)",
+    "CREATE TABLE unread_counter (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, channel_id INTEGER NOT NULL, "
+    "count INTEGER NOT NULL DEFAULT 0, UNIQUE (user_id, channel_id))",
+]
+
+
+def make_engine(path, profile):
+    uri = f"sqlite:///{path}"
+    engine = create_engine(uri, **sqlite_engine_options(uri, enabled=profile))
+    install_sqlite_profile(engine, enabled=profile)
+    return engine
+
+
+def setup(path, profile):
+    engine = make_engine(path, profile)
+    with engine.begin() as conn:
+        for statement in SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text("INSERT INTO unread_counter (user_id, channel_id, count) VALUES (:u, :c, 0)"),
+                     [{'u': u, 'c': c} for u in range(MEMBERS) for c in range(CHANNELS)])
+        conn.execute(text("INSERT INTO message (channel_id, user_id, content) VALUES (:c, 0, 'seed')"),
+                     [{'c': i % CHANNELS} for i in range(20000)])
+    engine.dispose()
+
+
+def writer(path, profile, deadline, index, results):
+    engine = make_engine(path, profile)
+    ok = errors = 0
+    latencies = []
+    i = 0
+    while time.time() < deadline:
+        channel_id = (index + i) % CHANNELS
+        i += 1
+        started = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("INSERT INTO message (channel_id, user_id, content) VALUES (:c, :u, 'hello')"),
+                             {'c': channel_id, 'u': index})
+                conn.execute(text("UPDATE unread_counter SET count = count + 1 WHERE channel_id = :c AND user_id != :u"),
+                             {'c': channel_id, 'u': index})
+            ok += 1
+            latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            errors += 1
+    results.put(('write', ok, errors, latencies))
+
+
+def reader(path, profile, deadline, index, results):
+    engine = make_engine(path, profile)
+    ok = errors = 0
+    latencies = []
+    i = 0
+    while time.time() < deadline:
+        channel_id = (index + i) % CHANNELS
+        i += 1
+        started = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT * FROM message WHERE channel_id = :c ORDER BY id DESC LIMIT 50"),
+                             {'c': channel_id}).all()
+                conn.execute(text("SELECT channel_id, count FROM unread_counter WHERE user_id = :u"),
+                             {'u': index % MEMBERS}).all()
+            ok += 1
+            latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            errors += 1
+    results.put(('read', ok, errors, latencies))
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(profile, writers, readers, seconds):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        setup(path, profile)
+        results = multiprocessing.Queue()
+        deadline = time.time() + 1 + seconds
+        procs = [multiprocessing.Process(target=writer, args=(path, profile, deadline, i, results)) for i in range(writers)]
+        procs += [multiprocessing.Process(target=reader, args=(path, profile, deadline, i, results)) for i in range(readers)]
+        for p in procs:
+            p.start()
+        rows = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+
+    summary = {}
+    for kind in ('write', 'read'):
+        ok = sum(r[1] for r in rows if r[0] == kind)
+        errors = sum(r[2] for r in rows if r[0] == kind)
+        latencies = [lat for r in rows if r[0] == kind for lat in r[3]]
+        summary[kind] = (ok / seconds, errors, percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite profile benchmark')
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    print(f"{args.writers} writer and {args.readers} reader processes, {args.seconds:g}s per run")
+    print(f"{'profile':<8} {'kind':<6} {'ops/s':>9} {'errors':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for profile in (False, True):
+        summary = run(profile, args.writers, args.readers, args.seconds)
+        for kind, (rate, errors, p50, p99) in summary.items():
+            print(f"{'on' if profile else 'off':<8} {kind:<6} {rate:>9.0f} {errors:>7} {p50:>8.2f} {p99:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+-- Schema of a database created by the first release (before schema versioning).
+-- Used by `tools/migration/migrate.py upgrade-check` to rehearse upgrading an old database; never edit.
+
+CREATE TABLE user (
+	id INTEGER NOT NULL, 
+	username VARCHAR(150) NOT NULL, 
+	password VARCHAR(150) NOT NULL, 
+	bio VARCHAR(300), 
+	avatar_url VARCHAR(300), 
+	birth_date VARCHAR(20), 
+	privacy_searchable BOOLEAN, 
+	privacy_listable BOOLEAN, 
+	presence_status VARCHAR(20), 
+	last_seen DATETIME, 
+	hide_status BOOLEAN, 
+	is_superuser BOOLEAN, 
+	is_banned BOOLEAN, 
+	banned_ips TEXT, 
+	ban_reason VARCHAR(500), 
+	banned_at DATETIME, 
+	PRIMARY KEY (id), 
+	UNIQUE (username)
+);
+
+CREATE TABLE user_music (
+	id INTEGER NOT NULL, 
+	user_id INTEGER NOT NULL, 
+	title VARCHAR(200) NOT NULL, 
+	artist VARCHAR(200), 
+	file_url VARCHAR(500) NOT NULL, 
+	cover_url VARCHAR(500), 
+	added_at DATETIME, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(user_id) REFERENCES user (id)
+);
+
+CREATE TABLE room (
+	id INTEGER NOT NULL, 
+	name VARCHAR(150), 
+	type VARCHAR(20) NOT NULL, 
+	is_public BOOLEAN, 
+	owner_id INTEGER, 
+	avatar_url VARCHAR(300), 
+	invite_token VARCHAR(100), 
+	linked_chat_id INTEGER, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(owner_id) REFERENCES user (id), 
+	UNIQUE (invite_token), 
+	FOREIGN KEY(linked_chat_id) REFERENCES room (id)
+);
+
+CREATE TABLE sticker_pack (
+	id INTEGER NOT NULL, 
+	name VARCHAR(100) NOT NULL, 
+	icon_emoji VARCHAR(10), 
+	owner_id INTEGER NOT NULL, 
+	created_at DATETIME, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(owner_id) REFERENCES user (id)
+);
+
+CREATE TABLE channel (
+	id INTEGER NOT NULL, 
+	name VARCHAR(100) NOT NULL, 
+	room_id INTEGER NOT NULL, 
+	description VARCHAR(500), 
+	icon_emoji VARCHAR(10), 
+	icon_image_url VARCHAR(300), 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(room_id) REFERENCES room (id)
+);
+
+CREATE TABLE member (
+	id INTEGER NOT NULL, 
+	user_id INTEGER NOT NULL, 
+	room_id INTEGER NOT NULL, 
+	role VARCHAR(20), 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(user_id) REFERENCES user (id), 
+	FOREIGN KEY(room_id) REFERENCES room (id) ON DELETE CASCADE
+);
+
+CREATE TABLE room_ban (
+	id INTEGER NOT NULL, 
+	room_id INTEGER NOT NULL, 
+	user_id INTEGER NOT NULL, 
+	banned_by_id INTEGER, 
+	reason VARCHAR(500), 
+	banned_at DATETIME NOT NULL, 
+	messages_deleted BOOLEAN, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(room_id) REFERENCES room (id) ON DELETE CASCADE, 
+	FOREIGN KEY(user_id) REFERENCES user (id) ON DELETE CASCADE, 
+	FOREIGN KEY(banned_by_id) REFERENCES user (id)
+);
+
+CREATE TABLE sticker (
+	id INTEGER NOT NULL, 
+	name VARCHAR(100) NOT NULL, 
+	file_url VARCHAR(500) NOT NULL, 
+	pack_id INTEGER NOT NULL, 
+	owner_id INTEGER NOT NULL, 
+	created_at DATETIME, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(pack_id) REFERENCES sticker_pack (id), 
+	FOREIGN KEY(owner_id) REFERENCES user (id)
+);
+
+CREATE TABLE message (
+	id INTEGER NOT NULL, 
+	content TEXT NOT NULL, 
+	timestamp DATETIME, 
+	edited_at DATETIME, 
+	user_id INTEGER NOT NULL, 
+	channel_id INTEGER NOT NULL, 
+	message_type VARCHAR(20), 
+	file_url VARCHAR(500), 
+	file_name VARCHAR(200), 
+	file_size INTEGER, 
+	reply_to_id INTEGER, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(user_id) REFERENCES user (id), 
+	FOREIGN KEY(channel_id) REFERENCES channel (id), 
+	FOREIGN KEY(reply_to_id) REFERENCES message (id)
+);
+
+CREATE TABLE message_reaction (
+	id INTEGER NOT NULL, 
+	message_id INTEGER NOT NULL, 
+	user_id INTEGER NOT NULL, 
+	emoji VARCHAR(50) NOT NULL, 
+	reaction_type VARCHAR(20), 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(message_id) REFERENCES message (id), 
+	FOREIGN KEY(user_id) REFERENCES user (id)
+);
+
+CREATE TABLE read_message (
+	id INTEGER NOT NULL, 
+	user_id INTEGER NOT NULL, 
+	channel_id INTEGER NOT NULL, 
+	last_read_message_id INTEGER, 
+	last_read_at DATETIME, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(user_id) REFERENCES user (id), 
+	FOREIGN KEY(channel_id) REFERENCES channel (id), 
+	FOREIGN KEY(last_read_message_id) REFERENCES message (id)
+);
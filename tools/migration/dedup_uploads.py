@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+# Upload storage maintenance (content-addressed storage, see app/functions/storage.py).
+# Usage:
+#   python3 tools/migration/dedup_uploads.py report    show how much disk deduplication would save
+#   python3 tools/migration/dedup_uploads.py dedup     move files lying flat in the upload subfolders
+#                                                      (uuid names, and hash names from before sharding)
+#                                                      to the hash-sharded layout, rewrite stored URLs
+#                                                      and delete the duplicates
+#   python3 tools/migration/dedup_uploads.py recount   recompute reference counts from the URL columns
+#   python3 tools/migration/dedup_uploads.py sweep     delete stored files nothing has referenced for
+#                                                      STORED_FILE_GRACE_SECONDS
+# Options: --upload-folder PATH (default: uploads/ next to run.py), --batch N (files per commit)
+# `dedup` commits after every batch and only deletes a batch's old files after its URLs are
+# rewritten, so an interrupted run is simply started again. Only the local storage backend is supported.
+
+import argparse
+import os
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from sqlalchemy import case
+import config
+from app.extensions import db
+from app import migrations
+from app.file_storage import get_storage, LocalStorage
+from app.models import StoredFile
+from app.functions.storage import (
+    FILE_REFERENCES, file_extension, is_stored_url, hash_file, store_file, rebuild_file_references,
+    sweep_unreferenced_files
+)
+from migrate import make_app
+
+
+def flat_files(storage):
+    # (subfolder, name) of every file lying directly in an upload subfolder (not sharded yet)
+    for subfolder, is_dir in sorted(storage.list_dir('')):
+        if not is_dir:
+            continue
+        for name, name_is_dir in storage.list_dir(subfolder):
+            if not name_is_dir:
+                yield subfolder, name
+
+
+def file_hash(storage, subfolder, name):
+    # (sha256, size) of a flat file; hash names from before sharding are trusted
+    key = f"{subfolder}/{name}"
+    if is_stored_url(f"/uploads/{key}"):
+        return name.split('.', 1)[0], storage.size(key)
+    return hash_file(storage.path(key))
+
+
+def report(storage):
+    files = 0
+    total = 0
+    seen = {}
+    for subfolder, name in flat_files(storage):
+        digest, size = file_hash(storage, subfolder, name)
+        files += 1
+        total += size
+        seen[(subfolder, digest, file_extension(name))] = size
+    unique = sum(seen.values())
+    print(f"{files} files outside the sharded layout, {total} bytes")
+    print(f"{len(seen)} distinct, {unique} bytes; deduplication saves {total - unique} bytes")
+
+
+def rewrite_urls(mapping):
+    # Point every URL column at the stored copies: {old_url: new_url}
+    old_urls = list(mapping)
+    rewritten = 0
+    for model, attr in FILE_REFERENCES:
+        column = getattr(model, attr)
+        rewritten += model.query.filter(column.in_(old_urls)).update(
+            {column: case(mapping, value=column)}, synchronize_session=False
+        )
+    return rewritten
+
+
+def dedup(storage, batch_size):
+    converted = 0
+    rewritten = 0
+    batch = []
+
+    def flush(batch):
+        mapping = {}
+        for subfolder, name in batch:
+            digest, size = file_hash(storage, subfolder, name)
+            mapping[f"/uploads/{subfolder}/{name}"] = store_file(
+                storage.path(f"{subfolder}/{name}"), digest, size, subfolder, file_extension(name),
+                storage.root, move=False
+            )
+        count = rewrite_urls(mapping)
+        StoredFile.query.filter(StoredFile.url.in_(list(mapping))).delete(synchronize_session=False)
+        db.session.commit()
+        # The old names are unreferenced now
+        for subfolder, name in batch:
+            storage.delete(f"{subfolder}/{name}")
+        return count
+
+    for item in flat_files(storage):
+        batch.append(item)
+        if len(batch) >= batch_size:
+            rewritten += flush(batch)
+            converted += len(batch)
+            print(f"[DEDUP] {converted} files converted, {rewritten} URLs rewritten")
+            batch = []
+    if batch:
+        rewritten += flush(batch)
+        converted += len(batch)
+    rebuild_file_references()
+    db.session.commit()
+    print(f"[DEDUP] Done: {converted} files converted, {rewritten} URLs rewritten")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Upload storage maintenance')
+    parser.add_argument('command', choices=['report', 'dedup', 'recount', 'sweep'])
+    parser.add_argument('--upload-folder', default=os.path.join(PROJECT_ROOT, 'uploads'))
+    parser.add_argument('--batch', type=int, default=config.MIGRATION_BATCH_SIZE)
+    args = parser.parse_args()
+
+    storage = get_storage(args.upload_folder)
+    if not isinstance(storage, LocalStorage):
+        print(f"Only the local storage backend is supported (UPLOAD_STORAGE={config.UPLOAD_STORAGE!r})")
+        sys.exit(1)
+    app = make_app()
+    with app.app_context():
+        migrations.run_migrations()
+        if args.command == 'report':
+            report(storage)
+        elif args.command == 'dedup':
+            dedup(storage, max(1, args.batch))
+        elif args.command == 'recount':
+            rebuild_file_references()
+            db.session.commit()
+            print('Reference counts rebuilt')
+        elif args.command == 'sweep':
+            removed = total = sweep_unreferenced_files(args.upload_folder)
+            while removed:
+                removed = sweep_unreferenced_files(args.upload_folder)
+                total += removed
+            print(f"Removed {total} unreferenced files")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+# Schema migration command line (the app also upgrades the schema on start).
+# Usage:
+#   python3 tools/migration/migrate.py status    show the schema version and pending migrations
+#   python3 tools/migration/migrate.py upgrade   apply pending migrations
+#   python3 tools/migration/migrate.py check     fail (exit 3) if a hot query scans a whole table (SQLite)
+#   python3 tools/migration/migrate.py upgrade-check
+#                                                fail (exit 4) unless a scratch database with the first
+#                                                release's schema (baseline_schema.sql) upgrades cleanly
+#                                                to the tables, columns and indexes of the models
+# Migrations themselves live in app/migrations.py.
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from flask import Flask
+from sqlalchemy import text, inspect
+import config
+from app.extensions import db
+from app import migrations
+from app.sqlite_profile import sqlite_engine_options, install_sqlite_profile
+
+
+# Queries issued on every page view, message send or socket event, with sample parameters
+HOT_QUERIES = [
+    ("SELECT * FROM member WHERE user_id = :a AND room_id = :b", {'a': 1, 'b': 1}),
+    ("SELECT * FROM member WHERE room_id = :a", {'a': 1}),
+    ("SELECT room_id, user_id FROM member WHERE user_id IN (:a, :b)", {'a': 1, 'b': 2}),
+    ("SELECT * FROM room_ban WHERE user_id = :a AND room_id = :b", {'a': 1, 'b': 1}),
+    ("SELECT * FROM room_ban WHERE room_id = :a", {'a': 1}),
+    ("SELECT * FROM channel WHERE room_id = :a", {'a': 1}),
+    ("SELECT * FROM read_message WHERE user_id = :a AND channel_id = :b", {'a': 1, 'b': 1}),
+    ("SELECT * FROM message WHERE channel_id = :a AND id < :b ORDER BY id DESC LIMIT 51", {'a': 1, 'b': 100}),
+    ("SELECT * FROM message WHERE channel_id = :a ORDER BY id DESC LIMIT 51", {'a': 1}),
+    ("SELECT id FROM message WHERE user_id = :a AND channel_id = :b", {'a': 1, 'b': 1}),
+    ("SELECT * FROM message_reaction WHERE message_id = :a AND user_id = :b AND emoji = :c", {'a': 1, 'b': 1, 'c': 'x'}),
+    ("SELECT * FROM message_reaction WHERE message_id IN (:a, :b, :c)", {'a': 1, 'b': 2, 'c': 3}),
+    ("SELECT * FROM unread_counter WHERE user_id = :a AND channel_id IN (:b, :c)", {'a': 1, 'b': 1, 'c': 2}),
+    ("SELECT * FROM message_change WHERE channel_id = :a AND id > :b ORDER BY id LIMIT 201", {'a': 1, 'b': 0}),
+]
+
+
+# Schema of a database created by the first release, and rows that exercise the data migrations
+BASELINE_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline_schema.sql')
+BASELINE_ROWS = """
+INSERT INTO user (id, username, password, banned_ips) VALUES (1, 'alice', 'x', '10.0.0.1,10.0.0.0/24');
+INSERT INTO user (id, username, password) VALUES (2, 'bob', 'x');
+INSERT INTO room (id, name, type, is_public, owner_id) VALUES (1, 'Lobby', 'server', 1, 1);
+INSERT INTO channel (id, name, room_id) VALUES (1, 'general', 1);
+INSERT INTO member (user_id, room_id, role) VALUES (1, 1, 'owner'), (1, 1, 'owner'), (2, 1, 'banned');
+INSERT INTO message (id, content, user_id, channel_id) VALUES (1, 'hello', 1, 1), (2, 'hi', 2, 1);
+INSERT INTO message_reaction (message_id, user_id, emoji) VALUES (1, 2, 'x'), (1, 2, 'x');
+INSERT INTO read_message (user_id, channel_id, last_read_message_id) VALUES (2, 1, 1), (2, 1, 2);
+"""
+
+
+def make_app(database_uri=None):
+    # Minimal app bound to the configured database (no blueprints, sockets or startup upgrade)
+    database_uri = database_uri or config.SQLALCHEMY_DATABASE_URI
+    app = Flask('app')
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = sqlite_engine_options(database_uri)
+    db.init_app(app)
+    with app.app_context():
+        install_sqlite_profile(db.engine)
+    from app import models  # noqa: register every model on the metadata
+    return app
+
+
+def status():
+    version = migrations.current_version()
+    if version is None:
+        print("Schema version: none (database predates versioning or does not exist)")
+        version = 0
+    else:
+        print(f"Schema version: {version}")
+    print(f"Latest version: {migrations.latest_version()}")
+    progress = migrations.batch_progress()
+    for v, description, _, batched in migrations.pending_migrations(version):
+        note = f" (batched, resumes after {progress[v]})" if v in progress else (' (batched)' if batched else '')
+        print(f"  pending {v}: {description}{note}")
+
+
+def check():
+    # Return the number of hot queries whose plan contains a full table scan
+    if db.engine.dialect.name != 'sqlite':
+        print("Query-plan check is only implemented for SQLite")
+        return 0
+    tables = set(db.inspect(db.engine).get_table_names())
+    failures = 0
+    for sql, params in HOT_QUERIES:
+        if sql.split(' FROM ')[1].split()[0] not in tables:
+            continue
+        plan = [row[-1] for row in db.session.execute(text('EXPLAIN QUERY PLAN ' + sql), params)]
+        scans = [step for step in plan if step.startswith('SCAN ')]
+        print(f"[{'SCAN' if scans else 'ok':>4}] {sql}\n       {' | '.join(plan)}")
+        failures += bool(scans)
+    if failures:
+        print(f"{failures} hot queries fall back to a table scan")
+    else:
+        print('All hot queries use an index.')
+    return failures
+
+
+def schema_problems():
+    # Tables, columns and indexes declared on the models that the database lacks (SQLite)
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    # The inspector leaves out expression indexes on SQLite
+    indexes = {row[0] for row in db.session.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+    problems = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            problems.append(f"missing table {table.name}")
+            continue
+        columns = {c['name'] for c in inspector.get_columns(table.name)}
+        problems += [f"missing column {table.name}.{c.name}" for c in table.columns if c.name not in columns]
+        problems += [f"missing index {ix.name}" for ix in table.indexes if ix.name not in indexes]
+    return problems
+
+
+def upgrade_check():
+    # Upgrade a scratch copy of the first release's schema twice and compare it with the models
+    # Returns the number of problems found
+    folder = tempfile.mkdtemp(prefix='boxchat-upgrade-check-')
+    path = os.path.join(folder, 'baseline.db')
+    try:
+        connection = sqlite3.connect(path)
+        with open(BASELINE_SCHEMA, 'r', encoding='utf-8') as f:
+            connection.executescript(f.read())
+        connection.executescript(BASELINE_ROWS)
+        connection.commit()
+        connection.close()
+
+        app = make_app('sqlite:///' + path)
+        problems = []
+        with app.app_context():
+            try:
+                migrations.run_migrations()
+                # A restart must find nothing left to do
+                if migrations.run_migrations():
+                    problems.append('a second run applied migrations again')
+                version = migrations.current_version()
+                if version != migrations.latest_version():
+                    problems.append(f"schema stopped at version {version}")
+                problems += schema_problems()
+            except Exception as e:
+                problems.append(f"upgrade failed: {e}")
+            db.session.remove()
+            db.engine.dispose()
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    for problem in problems:
+        print(f"[UPGRADE CHECK] {problem}")
+    if not problems:
+        print(f"Baseline database upgrades cleanly to version {migrations.latest_version()}.")
+    return len(problems)
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    if command == 'upgrade-check':
+        if upgrade_check():
+            sys.exit(4)
+        return
+    app = make_app()
+    with app.app_context():
+        if command == 'status':
+            status()
+        elif command == 'upgrade':
+            applied = migrations.run_migrations()
+            print(f"Applied {applied} migrations")
+        elif command == 'check':
+            if check():
+                sys.exit(3)
+        else:
+            print('Usage: migrate.py [status|upgrade|check|upgrade-check]')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
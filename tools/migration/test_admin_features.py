@@ -9,7 +9,8 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app import create_app
 from app.extensions import db
-from app.models import User
+from app.models import User, BannedIP
+from app.functions import add_ip_ban, remove_user_ip_bans, invalidate_ip_bans, is_ip_banned
 from werkzeug.security import generate_password_hash
 
 def test_admin_features():
@@ -57,11 +58,12 @@ def test_admin_features():
         if not user.is_banned:
             user.is_banned = True
             user.ban_reason = "Test ban"
-            user.banned_ips = "192.168.1.100"
+            add_ip_ban("192.168.1.100", user_id=user.id, reason=user.ban_reason)
             db.session.commit()
+            invalidate_ip_bans()
             print("   ✓ User marked as banned")
             print(f"   ✓ Ban reason: {user.ban_reason}")
-            print(f"   ✓ Banned IPs: {user.banned_ips}")
+            print(f"   ✓ Banned IPs: {[b.network for b in BannedIP.query.filter_by(user_id=user.id)]}")
         
         # Test password change
         print("\n3. Testing password change...")
@@ -74,11 +76,12 @@ def test_admin_features():
         print("\n4. Testing unban functionality...")
         user.is_banned = False
         user.ban_reason = None
-        user.banned_ips = ""
+        remove_user_ip_bans(user.id)
         db.session.commit()
+        invalidate_ip_bans()
         print("   ✓ User unbanned successfully")
         print(f"   ✓ Ban status: {user.is_banned}")
-        print(f"   ✓ Banned IPs cleared: {user.banned_ips}")
+        print(f"   ✓ Banned IPs cleared: {BannedIP.query.filter_by(user_id=user.id).count() == 0}")
         
         # Test IP ban detection
         print("\n5. Testing IP ban detection...")
@@ -86,17 +89,18 @@ def test_admin_features():
         if test_user:
             # Set up test IPs
             test_user.is_banned = True
-            test_user.banned_ips = "10.0.0.1,192.168.0.1,172.16.0.1"
+            for ip in ("10.0.0.1", "192.168.0.1", "172.16.0.0/12", "2001:db8::/32"):
+                add_ip_ban(ip, user_id=test_user.id)
             db.session.commit()
+            invalidate_ip_bans()
             
-            ips = [ip.strip() for ip in test_user.banned_ips.split(',') if ip.strip()]
+            ips = [b.network for b in BannedIP.query.filter_by(user_id=test_user.id)]
             print(f"   ✓ Banned IPs: {ips}")
             print(f"   ✓ Total banned IPs: {len(ips)}")
             
-            # Test IP lookup
-            test_ip = "192.168.0.1"
-            if test_ip in ips:
-                print(f"   ✓ IP {test_ip} found in banned list")
+            # Test IP lookup (exact addresses and ranges)
+            for test_ip in ("192.168.0.1", "172.20.1.5", "2001:db8::1", "8.8.8.8"):
+                print(f"   ✓ IP {test_ip} banned: {is_ip_banned(test_ip)}")
         
         # Summary
         print("\n" + "="*60)
@@ -106,11 +110,11 @@ def test_admin_features():
         print(f"Test user: {user.username}")
         print(f"  - Is banned: {user.is_banned}")
         print(f"  - Ban reason: {user.ban_reason}")
-        print(f"  - Banned IPs: {user.banned_ips}")
+        print(f"  - Banned IPs: {[b.network for b in BannedIP.query.filter_by(user_id=user.id)]}")
         print("\n✓ All tests completed successfully!\n")
         
         print("Next steps:")
-        print("1. Run database migration: python tools/add_user_ban_fields.py")
+        print("1. Run database migration: python tools/migration/migrate.py upgrade")
         print("2. Update your admin user: is_superuser = True")
         print("3. Test the /admin endpoints with your client")
         print("4. Check templates/settings.html for password change UI")